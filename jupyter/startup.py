@@ -1,4 +1,5 @@
 import os
+import sys
 import scipy
 import random
 import requests
@@ -20,6 +21,9 @@ from IPython.display import Javascript, display, HTML
 
 plt.style.use("bmh")
 
+# Where install.sh clones the dotfiles, for helpers like lastfm_parquet.py
+SCRIPTS_DIR = os.path.expanduser("~/.dotfiles/scripts")
+
 
 def alert(text: str = "All done!"):
     js = f'alert("{text}");'
@@ -72,6 +76,24 @@ def pull_data(
     return data
 
 
+def pull_parquet(path: str, columns: list = None, filters: list = None) -> pd.DataFrame:
+    """Load a hive-partitioned Parquet dataset, e.g. the lastfm_parquet.py export.
+
+    Only the requested columns are read, and filters like [("year", "=", 2024)]
+    skip whole partitions, so this stays fast on years of history.
+    """
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.append(SCRIPTS_DIR)
+    from lastfm_parquet import load_scrobbles
+
+    stime = time()
+    data = load_scrobbles(path, columns=columns, filters=filters or None)
+
+    print(f"That took {time() - stime:.2f} seconds")
+    print(data.shape)
+    return data
+
+
 def figsize(x: int, y: int):
     mpl.rcParams["figure.figsize"] = (x, y)
 
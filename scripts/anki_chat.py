@@ -1,44 +1,113 @@
 import httpx
+import argparse
 import asyncio
-from typing import Dict, List
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from inference import (
+    BACKENDS,
+    Backend,
+    BackendUnavailable,
+    InferenceError,
+    create_backend,
+)
 
 
 MODEL = "mistral"
+ANKI_TIMEOUT = 60.0  # seconds
+CARD_CACHE_SIZE = 256  # cardsInfo results kept, least recently used dropped
 
 
 class AnkiChatAssistant:
+    """
+    Chat about Anki cards with a model.
+
+    Holds one keep-alive connection to AnkiConnect and one inference backend
+    for the whole session, and caches card contents, so moving between cards
+    doesn't refetch them. Use it as an async context manager (or call
+    close()) to release the connections; a backend passed in is left for
+    the caller to close.
+    """
+
     def __init__(
         self,
         anki_connect_url: str = "http://localhost:8765",
         ollama_url: str = "http://localhost:11434",
         model: str = MODEL,
         debug: bool = False,
+        backend: Optional[Backend] = None,
     ):
         self.anki_connect_url = anki_connect_url
         self.ollama_url = ollama_url
         self.model = model
+        # Any inference backend will do; by default, Ollama at ollama_url
+        self.owns_backend = backend is None
+        self.backend = backend or create_backend(
+            "ollama", model, concurrency=1, url=ollama_url
+        )
+        self.anki_client = httpx.AsyncClient(
+            timeout=ANKI_TIMEOUT,
+            limits=httpx.Limits(max_connections=1, max_keepalive_connections=1),
+        )
+        self.cards: OrderedDict = OrderedDict()
+        self.card_id: Optional[int] = None
         self.messages: List[Dict[str, str]] = []
         self.debug = debug
 
-    async def get_card_content(self, card_id: int) -> Dict:
-        """Fetch card content from Anki"""
-        async with httpx.AsyncClient(timeout=60.0) as client:  # 60 second timeout
-            response = await client.post(
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the AnkiConnect connection, and the backend if we made it"""
+        await self.anki_client.aclose()
+        if self.owns_backend:
+            await self.backend.close()
+
+    async def get_cards(self, card_ids: Iterable[int]) -> Dict[int, Dict]:
+        """Fetch cards from Anki, asking only for those not cached"""
+        card_ids = list(card_ids)
+        missing = [card_id for card_id in card_ids if card_id not in self.cards]
+        if missing:
+            response = await self.anki_client.post(
                 self.anki_connect_url,
                 json={
                     "action": "cardsInfo",
                     "version": 6,
-                    "params": {"cards": [card_id]},
+                    "params": {"cards": missing},
                 },
             )
             card_info = response.json()
             if card_info["error"]:
                 raise Exception(f"AnkiConnect error: {card_info['error']}")
-            return card_info["result"][0]
+            for card_id, card in zip(missing, card_info["result"]):
+                # Unknown IDs come back as empty objects; don't cache those
+                if not card:
+                    raise Exception(f"AnkiConnect error: no card {card_id}")
+                self.cards[card_id] = card
+
+        cards = {}
+        for card_id in card_ids:
+            self.cards.move_to_end(card_id)
+            cards[card_id] = self.cards[card_id]
+        while len(self.cards) > CARD_CACHE_SIZE:
+            self.cards.popitem(last=False)
+        return cards
+
+    async def get_card_content(self, card_id: int) -> Dict:
+        """Fetch card content from Anki"""
+        return (await self.get_cards([card_id]))[card_id]
 
     async def chat_with_card(self, card_id: int, user_msg: str) -> str:
         """Chat about a specific card"""
         try:
+            # Start a new conversation when moving to another card
+            if card_id != self.card_id:
+                self.card_id = card_id
+                self.messages = []
+
             # Get card content if this is first message
             if not self.messages:
                 card = await self.get_card_content(card_id)
@@ -65,33 +134,50 @@ class AnkiChatAssistant:
             # Add user message to context
             self.messages.append({"role": "user", "content": user_msg})
 
-            # Get response from Ollama
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.ollama_url}/api/chat",
-                    json={
-                        "model": self.model,
-                        "messages": self.messages,
-                        "stream": False,
-                        "options": {"temperature": 0.7, "top_p": 0.9},
-                    },
-                )
-
-                response_data = response.json()
-                ai_response = response_data["message"]["content"]
-                self.messages.append({"role": "assistant", "content": ai_response})
-                return ai_response
-        except httpx.ReadTimeout:
-            return "Error: Ollama server not responding. Is it running? Try 'ollama serve' in another terminal."
-        except httpx.ConnectError:
-            return "Error: Couldn't connect to Ollama. Is it installed and running?"
+            # Get response from the model
+            ai_response = await self.backend.chat(
+                self.messages, temperature=0.7, top_p=0.9
+            )
+            self.messages.append({"role": "assistant", "content": ai_response})
+            return ai_response
+        except BackendUnavailable as e:
+            if e.timed_out:
+                return "Error: Model server not responding. Is it running? Try 'ollama serve' in another terminal."
+            return f"Error: Couldn't connect to the model server ({e}). Is it installed and running?"
         except Exception as e:
             return f"Error: Something went wrong - {str(e)}"
 
 
-async def main():
-    assistant = AnkiChatAssistant(model="mistral", debug=True)  # enable debug mode
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Chat with a model about an Anki card")
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="ollama",
+        help="Where to run the model (default: %(default)s)",
+    )
+    parser.add_argument("--model", help=f"Model to use (default: {MODEL} on ollama)")
+    parser.add_argument("--ollama-url", default="http://localhost:11434")
+    return parser.parse_args()
 
+
+async def main():
+    args = parse_args()
+    if args.backend == "ollama":
+        backend = create_backend(
+            "ollama", args.model or MODEL, concurrency=1, url=args.ollama_url
+        )
+    else:
+        backend = create_backend(args.backend, args.model, max_retries=2)
+    async with backend, AnkiChatAssistant(
+        model=backend.model, debug=True, backend=backend  # enable debug mode
+    ) as assistant:
+        await chat_session(assistant, backend)
+
+
+async def chat_session(assistant: AnkiChatAssistant, backend: Backend):
+    """Check both connections, then chat until the user quits"""
     try:
         # First check if we can connect to AnkiConnect
         card_id = int(input("Enter Anki card ID: "))
@@ -102,20 +188,28 @@ async def main():
             print("Is Anki running with AnkiConnect addon installed?")
             return
 
-        # Try to connect to Ollama
+        # Try to connect to the model
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{assistant.ollama_url}/api/version")
-                print(f"\nOllama version: {response.json()['version']}")
-        except Exception as e:
-            print(f"\nError connecting to Ollama: {e}")
+            print(f"\nUsing {await backend.check()}")
+        except InferenceError as e:
+            print(f"\nError connecting to the model: {e}")
             print("Is ollama serve running?")
             return
 
         while True:
-            user_input = input("\nYour question (or 'quit' to exit): ")
+            user_input = input(
+                "\nYour question ('card <id>' to switch cards, 'quit' to exit): "
+            )
             if user_input.lower() == "quit":
                 break
+            if user_input.lower().startswith("card "):
+                try:
+                    new_card_id = int(user_input.split()[1])
+                    await assistant.get_card_content(new_card_id)
+                    card_id = new_card_id
+                except Exception as e:
+                    print(f"\nCouldn't switch cards: {e}")
+                continue
 
             response = await assistant.chat_with_card(card_id, user_input)
             print(f"\nAssistant: {response}")
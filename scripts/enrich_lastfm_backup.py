@@ -7,139 +7,416 @@
 # ///
 """
 Enrich scrobbles database with Last.fm artist metadata.
+
+Tags live in artist-level tables (artists, tags, artist_tags), so enrichment
+costs one write per artist rather than one per scrobble. Flags such as
+kid_music are derived from the tags by lastfm_flags and exposed through the
+artist_summary and scrobbles_enriched views.
 """
 
+import argparse
+import random
 import sqlite3
-import requests
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
-import os
+
+import requests
+
+from lastfm_cache import CACHE_PATH, DEFAULT_MAX_BYTES, ResponseCache
+from lastfm_client import CacheMiss, LastfmClient, LastfmError
+from lastfm_flags import (
+    DEFAULT_FLAGS,
+    init_flag_tables,
+    load_rules,
+    reclassify,
+    sync_flag_rules,
+)
 
 # Configuration
-LASTFM_API_KEY = os.environ["LASTFM_KEY"]
-LASTFM_SECRET = os.environ["LASTFM_SECRET"]
-LASTFM_USERNAME = os.environ["LASTFM_USERNAME"]
 DB_PATH = Path(__file__).parent / "lastfm_archive.db"
-LASTFM_API_URL = "http://ws.audioscrobbler.com/2.0/"
+BATCH_SIZE = 50
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RATE = 4.0  # Last.fm allows 5 requests/sec averaged over 5 minutes
+DEFAULT_ATTEMPTS = 3
 
+# https://www.last.fm/api/errorcodes
+ERROR_NOT_FOUND = 6
+TRANSIENT_ERRORS = {8, 11, 16, 29}  # operation failed, offline, temporary, rate limit
 
-def add_metadata_columns(conn):
-    """Add columns for artist metadata."""
+
+def init_metadata_tables(conn):
+    """Create the artist-level metadata tables and views."""
     cursor = conn.cursor()
 
-    # Add columns if they don't exist
-    try:
-        cursor.execute("ALTER TABLE scrobbles ADD COLUMN artist_tags TEXT")
-    except sqlite3.OperationalError:
-        pass  # Column already exists
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS artists (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            mbid TEXT,
+            tags_fetched_at TEXT
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_artists_mbid ON artists(mbid)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS artist_tags (
+            artist_id INTEGER NOT NULL REFERENCES artists(id),
+            tag_id INTEGER NOT NULL REFERENCES tags(id),
+            count INTEGER,
+            PRIMARY KEY (artist_id, tag_id)
+        ) WITHOUT ROWID
+    """
+    )
+    init_flag_tables(conn)
 
-    try:
-        cursor.execute("ALTER TABLE scrobbles ADD COLUMN kid_music INTEGER DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass
+    # Superseded by the flag_rules table
+    cursor.execute("DROP TABLE IF EXISTS kid_tags")
+
+    # Same shape as the old denormalized columns, so existing queries can
+    # swap `scrobbles` for `scrobbles_enriched`. Views are rebuilt each run
+    # so older definitions get replaced.
+    cursor.execute("DROP VIEW IF EXISTS scrobbles_enriched")
+    cursor.execute("DROP VIEW IF EXISTS artist_summary")
+    cursor.execute(
+        """
+        CREATE VIEW artist_summary AS
+        SELECT
+            a.id AS artist_id,
+            a.name AS artist,
+            a.mbid,
+            (
+                SELECT group_concat(t.name, ',')
+                FROM artist_tags at
+                JOIN tags t ON t.id = at.tag_id
+                WHERE at.artist_id = a.id
+            ) AS artist_tags,
+            (
+                SELECT group_concat(af.flag, ',')
+                FROM artist_flags af
+                WHERE af.artist_id = a.id
+            ) AS flags,
+            EXISTS (
+                SELECT 1
+                FROM artist_flags af
+                WHERE af.artist_id = a.id AND af.flag = 'kid_music'
+            ) AS kid_music
+        FROM artists a
+        WHERE a.tags_fetched_at IS NOT NULL
+    """
+    )
+    cursor.execute(
+        """
+        CREATE VIEW scrobbles_enriched AS
+        SELECT
+            s.*,
+            a.artist_tags,
+            a.flags AS artist_flags,
+            COALESCE(a.kid_music, 0) AS kid_music
+        FROM scrobbles s
+        LEFT JOIN artist_summary a ON a.artist = s.artist
+    """
+    )
 
     conn.commit()
 
 
-def get_artist_tags(artist_name: str, api_key: str):
-    """Get top tags for an artist."""
-    params = {
-        "method": "artist.gettoptags",
-        "artist": artist_name,
-        "api_key": api_key,
-        "format": "json",
-        "limit": 10,
-    }
+def migrate_denormalized_columns(conn):
+    """Move artist_tags/kid_music off scrobbles rows into the artist tables.
 
-    try:
-        response = requests.get(LASTFM_API_URL, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+    Older databases stored tags on every scrobble. Artists that were already
+    enriched keep their tags, then the columns are dropped.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(scrobbles)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if "artist_tags" not in columns:
+        return
 
-        tags = data.get("toptags", {}).get("tag", [])
-        if isinstance(tags, dict):
-            tags = [tags]
+    cursor.execute(
+        """
+        SELECT artist, MAX(artist_mbid), MAX(artist_tags)
+        FROM scrobbles
+        WHERE artist_tags IS NOT NULL
+        GROUP BY artist
+    """
+    )
+    rows = cursor.fetchall()
+    print(f"Migrating tags for {len(rows)} artists off the scrobbles table...")
+
+    with conn:
+        for artist, mbid, tags_str in rows:
+            tags = [(tag, None) for tag in tags_str.split(",") if tag]
+            save_artist_tags(conn, artist, mbid, tags)
+        conn.execute("ALTER TABLE scrobbles DROP COLUMN kid_music")
+        conn.execute("ALTER TABLE scrobbles DROP COLUMN artist_tags")
 
-        return [tag["name"].lower() for tag in tags if "name" in tag]
-    except Exception as e:
-        print(f"  Error fetching tags for {artist_name}: {e}")
-        return []
+    print("Migration done; run VACUUM to reclaim the space from the old columns")
 
 
-def enrich_artists(conn, api_key, min_plays: int = 5):
-    """Fetch and store tags for all unique artists."""
+def get_artist_tags(client: LastfmClient, artist_name: str):
+    """Get top tags for an artist as (name, count) pairs.
+
+    An empty list means Last.fm genuinely has no tags (or no such artist);
+    failed requests raise instead, so they aren't recorded as "no tags".
+    """
+    try:
+        data = client.call("artist.gettoptags", artist=artist_name, limit=10)
+    except LastfmError as e:
+        if e.code == ERROR_NOT_FOUND:
+            return []
+        raise
+
+    tags = data.get("toptags", {}).get("tag", [])
+    if isinstance(tags, dict):
+        tags = [tags]
+
+    return [
+        (tag["name"].lower(), int(tag.get("count", 0) or 0))
+        for tag in tags
+        if "name" in tag
+    ]
+
+
+def fetch_tags_with_retry(
+    client: LastfmClient,
+    artist_name: str,
+    attempts: int = DEFAULT_ATTEMPTS,
+    base_delay: float = 1.0,
+):
+    """get_artist_tags, retrying transient failures with full-jitter backoff.
+
+    The client already retries at the HTTP level; this covers API-level
+    errors and timeouts that outlast those, spreading the workers' retries out.
+    """
+    for attempt in range(attempts):
+        try:
+            return get_artist_tags(client, artist_name)
+        except CacheMiss:
+            raise
+        except LastfmError as e:
+            if e.code not in TRANSIENT_ERRORS or attempt == attempts - 1:
+                raise
+        except (requests.exceptions.RequestException, ValueError):
+            if attempt == attempts - 1:
+                raise
+        time.sleep(random.uniform(0, base_delay * 2**attempt))
+
+
+def save_artist_tags(conn, artist: str, mbid: str | None, tags):
+    """Upsert one artist and replace its tags. The caller commits."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO artists (name, mbid, tags_fetched_at)
+        VALUES (?, NULLIF(?, ''), ?)
+        ON CONFLICT(name) DO UPDATE SET
+            mbid = COALESCE(excluded.mbid, artists.mbid),
+            tags_fetched_at = excluded.tags_fetched_at
+        RETURNING id
+    """,
+        (artist, mbid or "", datetime.now().isoformat()),
+    )
+    artist_id = cursor.fetchone()[0]
+
+    cursor.execute("DELETE FROM artist_tags WHERE artist_id = ?", (artist_id,))
+    cursor.executemany(
+        "INSERT OR IGNORE INTO tags (name) VALUES (?)", [(name,) for name, _ in tags]
+    )
+    cursor.executemany(
+        """
+        INSERT OR IGNORE INTO artist_tags (artist_id, tag_id, count)
+        SELECT ?, id, ? FROM tags WHERE name = ?
+    """,
+        [(artist_id, count, name) for name, count in tags],
+    )
+    return artist_id
+
+
+def enrich_artists(
+    conn,
+    client: LastfmClient,
+    min_plays: int = 5,
+    batch_size: int = BATCH_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    refresh: bool = False,
+):
+    """Fetch and store tags for all unique artists.
+
+    Lookups run on a thread pool (the client enforces the global rate); this
+    thread is the only writer and commits every batch_size artists. Artists
+    whose lookup fails are left unfetched, so the next run retries them.
+    With refresh=True, already-enriched artists are looked up again too.
+    """
     cursor = conn.cursor()
 
     # Only enrich artists with 5+ plays (probably ~500-1000 artists?)
     cursor.execute(
         """
-        SELECT artist, COUNT(*) as plays
-        FROM scrobbles
-        WHERE artist_tags IS NULL
-        GROUP BY artist
+        SELECT s.artist, MAX(s.artist_mbid), COUNT(*) as plays
+        FROM scrobbles s
+        LEFT JOIN artists a ON a.name = s.artist
+        WHERE a.tags_fetched_at IS NULL OR ?
+        GROUP BY s.artist
         HAVING plays >= ?
         ORDER BY plays DESC
     """,
-        (min_plays,),
+        (refresh, min_plays),
     )
 
-    artists = [row[0] for row in cursor.fetchall()]
+    artists = [(row[0], row[1]) for row in cursor.fetchall()]
     total = len(artists)
 
     print(f"Found {total} artists to enrich")
 
-    KID_TAGS = {
-        "children",
-        "kids",
-        "childrens music",
-        "kids music",
-        "lullaby",
-        "lullabies",
-        "nursery rhymes",
-        "educational",
-        "toddler",
-        "baby",
-        "preschool",
-    }
-
-    for i, artist in enumerate(artists, 1):
-        print(f"[{i}/{total}] {artist}")
-
-        tags = get_artist_tags(artist, api_key)
-        tags_str = ",".join(tags) if tags else ""
-
-        # Check if kid music
-        is_kid = 1 if (set(tags) & KID_TAGS) else 0
-
-        # Update all scrobbles by this artist
-        cursor.execute(
-            """
-            UPDATE scrobbles
-            SET artist_tags = ?, kid_music = ?
-            WHERE artist = ?
-        """,
-            (tags_str, is_kid, artist),
-        )
+    tagged = untagged = failed = 0
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(fetch_tags_with_retry, client, artist): (artist, mbid)
+            for artist, mbid in artists
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            artist, mbid = futures[future]
+            try:
+                tags = future.result()
+            except Exception as e:
+                print(f"[{i}/{total}] {artist}: failed, will retry next run ({e})")
+                failed += 1
+                continue
+
+            print(f"[{i}/{total}] {artist}: {len(tags)} tags")
+            save_artist_tags(conn, artist, mbid, tags)
+            if tags:
+                tagged += 1
+            else:
+                untagged += 1
+
+            if (tagged + untagged) % batch_size == 0:
+                conn.commit()
 
-        conn.commit()
+    conn.commit()
+    elapsed = time.monotonic() - start_time
+    print(
+        f"\nEnrichment complete! {tagged} tagged, {untagged} without tags, "
+        f"{failed} failed in {elapsed:.1f}s"
+    )
 
-        # Be nice to Last.fm API
-        time.sleep(0.2)
 
-    print("\nEnrichment complete!")
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Enrich scrobbles with artist tags")
+    parser.add_argument(
+        "--min-plays",
+        type=int,
+        default=5,
+        help="Only enrich artists with at least this many plays (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Concurrent tag lookups (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_RATE,
+        help="Max API requests per second across all lookups (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="Artists per commit (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Look up tags again for artists that were already enriched",
+    )
+    parser.add_argument(
+        "--cache",
+        type=Path,
+        default=CACHE_PATH,
+        help="Response cache file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Always query the API directly"
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=DEFAULT_MAX_BYTES // (1024 * 1024),
+        help="Evict least recently used responses beyond this size (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use cached responses; uncached artists are left for a later run",
+    )
+    parser.add_argument(
+        "--rules",
+        type=Path,
+        help="JSON file of flag rules (default: lastfm_flags.DEFAULT_FLAGS)",
+    )
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
     conn = sqlite3.connect(DB_PATH)
 
-    # Add columns
-    print("Adding metadata columns...")
-    add_metadata_columns(conn)
+    # Set up tables
+    print("Setting up metadata tables...")
+    init_metadata_tables(conn)
+    sync_flag_rules(conn, load_rules(args.rules) if args.rules else DEFAULT_FLAGS)
+    migrate_denormalized_columns(conn)
 
     # Enrich
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache, max_bytes=args.cache_max_mb * 1024 * 1024)
+
     print("\nFetching artist metadata from Last.fm...")
-    enrich_artists(conn, LASTFM_API_KEY)
+    with LastfmClient(
+        timeout=10,
+        pool_size=args.concurrency,
+        rate=args.rate,
+        cache=cache,
+        offline=args.offline,
+    ) as client:
+        enrich_artists(
+            conn,
+            client,
+            args.min_plays,
+            args.batch_size,
+            args.concurrency,
+            args.refresh,
+        )
+
+    if cache is not None:
+        print(f"Response cache: {cache.stats}")
+        cache.close()
 
+    # Tags may have changed, so refresh the derived flags
+    for flag, count in sorted(reclassify(conn).items()):
+        print(f"{flag}: {count:,} artists")
     conn.close()
 
 
@@ -0,0 +1,410 @@
+"""
+Shared inference backends for the scripts that talk to a language model
+(librarian.py, anki_chat.py).
+
+Requests are written once in the Messages API shape (model, max_tokens,
+system, messages, tools, tool_choice) and sent to either:
+    - AnthropicBackend: the Anthropic API, through the SDK
+    - OllamaBackend: an Ollama-compatible /api/chat endpoint, e.g. a local
+      `ollama serve`; forced tool calls become JSON-schema structured output
+
+Responses come back with the same attributes either way (content blocks
+with type/text/name/input, and usage token counts), and errors as
+StatusError (with the HTTP status and retry-after) or BackendUnavailable.
+Each backend holds one pooled keep-alive HTTP client, capped at
+`concurrency` connections and requests in flight; use it as an async
+context manager so the pool is closed afterwards.
+
+librarian_stub.py serves both APIs locally for tests.
+"""
+
+import abc
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import anthropic
+import httpx
+
+# Configuration
+BACKENDS = ("anthropic", "ollama")
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_MODEL = "mistral"
+ANTHROPIC_MODEL = "claude-opus-4-20250514"  # for chat() when no model is given
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 120.0  # seconds; local models can be slow to answer
+CHAT_MAX_TOKENS = 1024
+# Sent first when a conversation opens with the assistant (e.g. a greeting),
+# since the Messages API wants the user to speak first
+OPENING_TURN = "Hello."
+
+
+class InferenceError(Exception):
+    """A request to a backend failed."""
+
+
+class StatusError(InferenceError):
+    """The backend answered with an HTTP error status."""
+
+    def __init__(
+        self, status_code: int, message: str, retry_after: Optional[float] = None
+    ):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class BackendUnavailable(InferenceError):
+    """The backend couldn't be reached, or didn't answer in time."""
+
+    def __init__(self, message: str, timed_out: bool = False):
+        super().__init__(message)
+        self.timed_out = timed_out
+
+
+@dataclass
+class Block:
+    """A content block, with the attributes of the SDK's text/tool_use blocks."""
+
+    type: str
+    text: str = ""
+    name: str = ""
+    input: Any = None
+
+
+@dataclass
+class Usage:
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+
+
+@dataclass
+class Response:
+    """A model response, with the attributes of the SDK's Message."""
+
+    content: List[Block] = field(default_factory=list)
+    usage: Usage = field(default_factory=Usage)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def response_text(response: Any) -> str:
+    """All text blocks of a response, joined."""
+    return "".join(block.text for block in response.content if block.type == "text")
+
+
+def split_system(messages: List[Dict[str, str]]):
+    """
+    Separate chat messages in the Ollama/OpenAI shape into a system prompt
+    and Messages API turns.
+
+    Args:
+        messages: {"role", "content"} dictionaries, system role included
+
+    Returns:
+        (system prompt, remaining messages)
+    """
+    system = [m["content"] for m in messages if m["role"] == "system"]
+    turns = [m for m in messages if m["role"] != "system"]
+    return "\n\n".join(system), turns
+
+
+class Backend(abc.ABC):
+    """Common interface; subclasses implement create() and close()."""
+
+    name = ""
+    default_model = ""
+
+    def __init__(
+        self, model: Optional[str] = None, concurrency: int = DEFAULT_CONCURRENCY
+    ):
+        self.model = model
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @abc.abstractmethod
+    async def close(self) -> None:
+        """Close the backend's HTTP client."""
+
+    @abc.abstractmethod
+    async def create(self, request: Dict[str, Any]) -> Any:
+        """
+        Send one Messages API-shaped request.
+
+        Args:
+            request: Keyword arguments as for messages.create; the backend's
+                model, if set, replaces request["model"]
+
+        Returns:
+            The response (content blocks and usage)
+        """
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = CHAT_MAX_TOKENS,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+    ) -> str:
+        """
+        Plain chat: send {"role", "content"} messages and return the reply.
+
+        Args:
+            messages: Conversation so far, system role included
+            max_tokens: Longest reply
+            temperature: Sampling temperature (backend default if None)
+            top_p: Nucleus sampling cutoff (backend default if None)
+
+        Returns:
+            The reply text
+        """
+        system, turns = split_system(messages)
+        request = {
+            "model": self.model or self.default_model,
+            "max_tokens": max_tokens,
+            "messages": turns,
+        }
+        if system:
+            request["system"] = system
+        if temperature is not None:
+            request["temperature"] = temperature
+        if top_p is not None:
+            request["top_p"] = top_p
+        return response_text(await self.create(request))
+
+    async def check(self) -> str:
+        """Describe the backend, raising InferenceError if it's unusable."""
+        return self.name
+
+
+class AnthropicBackend(Backend):
+    """The Anthropic Messages API through the SDK's async client.
+
+    SDK retries are off by default, so callers with their own rate limiting
+    and backoff (librarian.py) see every 429/529.
+    """
+
+    name = "anthropic"
+    default_model = ANTHROPIC_MODEL
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: int = 0,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        super().__init__(model, concurrency)
+        self.client = anthropic.AsyncAnthropic(
+            max_retries=max_retries,
+            timeout=timeout,
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=concurrency, max_keepalive_connections=concurrency
+                )
+            ),
+        )
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def create(self, request: Dict[str, Any]) -> Any:
+        if self.model:
+            request = {**request, "model": self.model}
+        messages = request["messages"]
+        if messages and messages[0]["role"] == "assistant":
+            opening = {"role": "user", "content": OPENING_TURN}
+            request = {**request, "messages": [opening, *messages]}
+        async with self.semaphore:
+            try:
+                return await self.client.messages.create(**request)
+            except anthropic.APIStatusError as e:
+                raise StatusError(
+                    e.status_code,
+                    str(e),
+                    parse_retry_after(e.response.headers.get("retry-after")),
+                ) from e
+            except anthropic.APITimeoutError as e:
+                raise BackendUnavailable(str(e), timed_out=True) from e
+            except anthropic.APIConnectionError as e:
+                raise BackendUnavailable(str(e)) from e
+
+    async def check(self) -> str:
+        return f"Anthropic API ({self.model or 'model per request'})"
+
+
+class OllamaBackend(Backend):
+    """An Ollama-compatible /api/chat endpoint.
+
+    A forced tool call (tool_choice {"type": "tool"}) is sent as structured
+    output, with the tool's input schema as the response format, and the
+    JSON reply comes back as a tool_use block. Earlier tool calls and
+    results in the conversation are sent as their JSON and text.
+    """
+
+    name = "ollama"
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        url: str = OLLAMA_URL,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        super().__init__(model or OLLAMA_MODEL, concurrency)
+        self.url = url.rstrip("/")
+        self.client = httpx.AsyncClient(
+            base_url=self.url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            ),
+        )
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    @staticmethod
+    def block_text(block: Any) -> str:
+        if isinstance(block, str):
+            return block
+        if block["type"] == "text":
+            return block["text"]
+        if block["type"] == "tool_use":
+            return json.dumps(block["input"])
+        if block["type"] == "tool_result":
+            content = block.get("content", "")
+            return content if isinstance(content, str) else json.dumps(content)
+        return ""
+
+    def to_ollama(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Translate a Messages API request to an /api/chat payload."""
+        messages = []
+        system = request.get("system")
+        if system:
+            text = (
+                system
+                if isinstance(system, str)
+                else "\n\n".join(block["text"] for block in system)
+            )
+            messages.append({"role": "system", "content": text})
+        for message in request["messages"]:
+            content = message["content"]
+            blocks = [content] if isinstance(content, str) else content
+            text = "\n".join(filter(None, (self.block_text(b) for b in blocks)))
+            messages.append({"role": message["role"], "content": text})
+
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": False,
+            "options": {"num_predict": request["max_tokens"]},
+        }
+        for option in ("temperature", "top_p"):
+            if option in request:
+                payload["options"][option] = request[option]
+        tool = self.forced_tool(request)
+        if tool is not None:
+            payload["format"] = tool["input_schema"]
+        return payload
+
+    @staticmethod
+    def forced_tool(request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        choice = request.get("tool_choice") or {}
+        if choice.get("type") != "tool":
+            return None
+        return next(
+            (
+                tool
+                for tool in request.get("tools", [])
+                if tool["name"] == choice["name"]
+            ),
+            None,
+        )
+
+    async def create(self, request: Dict[str, Any]) -> Response:
+        async with self.semaphore:
+            try:
+                response = await self.client.post(
+                    "/api/chat", json=self.to_ollama(request)
+                )
+            except httpx.TimeoutException as e:
+                raise BackendUnavailable(
+                    f"{self.url} didn't answer in time: {e}", timed_out=True
+                ) from e
+            except httpx.TransportError as e:
+                raise BackendUnavailable(f"Couldn't connect to {self.url}: {e}") from e
+        if response.status_code >= 400:
+            raise StatusError(
+                response.status_code,
+                response.text,
+                parse_retry_after(response.headers.get("retry-after")),
+            )
+
+        data = response.json()
+        text = data["message"]["content"]
+        usage = Usage(
+            input_tokens=data.get("prompt_eval_count", 0),
+            output_tokens=data.get("eval_count", 0),
+        )
+        tool = self.forced_tool(request)
+        if tool is None:
+            return Response([Block("text", text=text)], usage)
+        try:
+            return Response(
+                [Block("tool_use", name=tool["name"], input=json.loads(text))], usage
+            )
+        except json.JSONDecodeError:
+            # Left for the caller to treat as a missing answer
+            return Response([Block("text", text=text)], usage)
+
+    async def check(self) -> str:
+        try:
+            response = await self.client.get("/api/version")
+            version = response.json()["version"]
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            raise BackendUnavailable(
+                f"Couldn't get the version of {self.url}: {e}"
+            ) from e
+        return f"Ollama {version} at {self.url} ({self.model})"
+
+
+def create_backend(
+    name: str,
+    model: Optional[str] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    **kwargs,
+) -> Backend:
+    """
+    Create a backend by name.
+
+    Args:
+        name: One of BACKENDS
+        model: Model to use instead of the one in each request (required
+            for Ollama unless OLLAMA_MODEL will do)
+        concurrency: Pooled connections and requests in flight
+        **kwargs: Backend-specific options (e.g. url for Ollama)
+
+    Returns:
+        The backend; use it as an async context manager
+    """
+    if name == "anthropic":
+        return AnthropicBackend(model, concurrency, **kwargs)
+    if name == "ollama":
+        return OllamaBackend(model, concurrency, **kwargs)
+    raise ValueError(f"Unknown backend {name!r}; expected one of {', '.join(BACKENDS)}")
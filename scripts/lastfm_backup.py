@@ -12,28 +12,53 @@ Designed to run as scheduled job (cron/systemd timer).
 Written by Claude Code.
 """
 
+import argparse
 import sqlite3
 import requests
 import time
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 import sys
-import os
+
+from lastfm_client import LASTFM_USERNAME, LastfmClient
+from lastfm_import import detect_format, iter_export, open_export
+from lastfm_schema import SCHEMA_VERSION, fact_table, schema_version, write_facts
+from lastfm_search import init_search, refresh_search
+from lastfm_stats import init_rollups, refresh_rollups, total_plays
 
 # Configuration
-LASTFM_API_KEY = os.environ["LASTFM_KEY"]
-LASTFM_SECRET = os.environ["LASTFM_SECRET"]
-LASTFM_USERNAME = os.environ["LASTFM_USERNAME"]
 DB_PATH = Path(__file__).parent / "lastfm_archive.db"
-LASTFM_API_URL = "http://ws.audioscrobbler.com/2.0/"
+# Last.fm allows 5 requests/sec averaged over 5 minutes; stay a bit under it
+DEFAULT_RATE = 4.0
+DEFAULT_WORKERS = 4
+DEFAULT_SYNCHRONOUS = "NORMAL"
+DEFAULT_CACHE_SIZE = -64000  # ~64 MB
+DEFAULT_IMPORT_BATCH = 5000
 
 
-def init_db(db_path: Path):
-    """Create database and tables if they don't exist."""
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path)
+def configure_connection(
+    conn, synchronous: str = DEFAULT_SYNCHRONOUS, cache_size: int = DEFAULT_CACHE_SIZE
+):
+    """Apply journaling and cache pragmas suited to bulk ingestion.
+
+    WAL lets readers (stats, notebooks) keep working while the archiver writes,
+    and synchronous=NORMAL is durable enough in WAL mode while skipping an
+    fsync per transaction. A negative cache_size is in KiB, per SQLite.
+    """
     cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={synchronous}")
+    cursor.execute(f"PRAGMA cache_size={int(cache_size)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
 
+def create_v1_tables(cursor):
+    """The original one-row-of-strings-per-scrobble layout."""
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS scrobbles (
@@ -66,169 +91,620 @@ def init_db(db_path: Path):
     """
     )
 
+
+def init_db(
+    db_path: Path,
+    synchronous: str = DEFAULT_SYNCHRONOUS,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+):
+    """Create database and tables if they don't exist."""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    configure_connection(conn, synchronous, cache_size)
+    cursor = conn.cursor()
+
+    # A v2 archive (see lastfm_schema.py) already has its tables, and its
+    # scrobbles is a view, which can't take these indexes
+    if schema_version(conn) < SCHEMA_VERSION:
+        create_v1_tables(cursor)
+
+    # One row per fetch window; last_page advances as pages are committed,
+    # so an interrupted run can pick up the same window where it stopped
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            id INTEGER PRIMARY KEY,
+            from_timestamp INTEGER NOT NULL,
+            to_timestamp INTEGER NOT NULL,
+            total_pages INTEGER,
+            last_page INTEGER NOT NULL DEFAULT 0,
+            started_at TEXT NOT NULL,
+            completed_at TEXT
+        )
+    """
+    )
+
+    # Scrobbles sharing a second with a different, archived one. timestamp
+    # is the key, so they can't be stored, but verify_archive counts them
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scrobble_collisions (
+            timestamp INTEGER NOT NULL,
+            artist TEXT NOT NULL,
+            track TEXT NOT NULL,
+            PRIMARY KEY (timestamp, artist, track)
+        ) WITHOUT ROWID
+    """
+    )
+
     conn.commit()
+    init_rollups(conn)
+    init_search(conn)
     return conn
 
 
 def get_last_archived_timestamp(conn):
     """Get the most recent timestamp we've already archived."""
     cursor = conn.cursor()
-    cursor.execute("SELECT MAX(timestamp) FROM scrobbles")
+    cursor.execute(f"SELECT MAX(timestamp) FROM {fact_table(conn)}")
     result = cursor.fetchone()[0]
     return result if result else 0
 
 
+@dataclass
+class Checkpoint:
+    """A fetch window and how far through its pages we've committed."""
+
+    id: int
+    from_timestamp: int
+    to_timestamp: int
+    total_pages: int | None
+    last_page: int
+
+
+def pending_checkpoints(conn):
+    """Windows that were started but never completed, oldest first."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT id, from_timestamp, to_timestamp, total_pages, last_page
+        FROM backfill_checkpoints
+        WHERE completed_at IS NULL
+        ORDER BY id
+    """
+    )
+    return [Checkpoint(*row) for row in cursor.fetchall()]
+
+
+def start_checkpoint(conn, from_timestamp: int, to_timestamp: int):
+    """Record a new fetch window before any of its pages are requested."""
+    with conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO backfill_checkpoints (from_timestamp, to_timestamp, started_at)
+            VALUES (?, ?, ?)
+        """,
+            (from_timestamp, to_timestamp, datetime.now().isoformat()),
+        )
+    return Checkpoint(cursor.lastrowid, from_timestamp, to_timestamp, None, 0)
+
+
+def update_checkpoint(conn, checkpoint: Checkpoint, complete: bool = False):
+    """Persist the window's progress; pages are idempotent to re-fetch."""
+    with conn:
+        conn.execute(
+            """
+            UPDATE backfill_checkpoints
+            SET total_pages = ?, last_page = ?, completed_at = ?
+            WHERE id = ?
+        """,
+            (
+                checkpoint.total_pages,
+                checkpoint.last_page,
+                datetime.now().isoformat() if complete else None,
+                checkpoint.id,
+            ),
+        )
+
+
+def prune_checkpoints(conn):
+    """Drop completed windows; only unfinished ones are ever read back."""
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM backfill_checkpoints WHERE completed_at IS NOT NULL"
+        )
+    return cursor.rowcount
+
+
 def fetch_recent_tracks(
-    username: str, api_key: str, from_timestamp: int, page: int = 1, retries: int = 3
+    client: LastfmClient,
+    username: str,
+    from_timestamp: int,
+    page: int = 1,
+    to_timestamp: int | None = None,
 ):
-    """Fetch tracks from Last.fm API with retry logic."""
+    """Fetch a page of tracks from Last.fm; the client handles retries."""
     params = {
-        "method": "user.getrecenttracks",
         "user": username,
-        "api_key": api_key,
-        "format": "json",
         "limit": 200,
         "page": page,
         "from": from_timestamp,
         "extended": 1,
     }
+    # Pinning the upper bound keeps page boundaries stable while we page
+    # through, even if new scrobbles arrive mid-run
+    if to_timestamp is not None:
+        params["to"] = to_timestamp
 
-    for attempt in range(retries):
-        try:
-            response = requests.get(LASTFM_API_URL, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            if attempt < retries - 1:
-                wait_time = 2 ** attempt  # 1s, 2s, 4s
-                print(f"  API error (attempt {attempt + 1}/{retries}): {e}")
-                print(f"  Retrying in {wait_time}s...")
-                time.sleep(wait_time)
-            else:
-                raise  # Give up after all retries
+    return client.call("user.getrecenttracks", **params)
 
 
-def insert_scrobbles(conn, scrobbles):
-    """Insert scrobbles into database, ignoring duplicates."""
-    cursor = conn.cursor()
-    archived_timestamp = datetime.now().isoformat()
+def normalize_scrobble(scrobble, archived_timestamp: str):
+    """Flatten one API track into a scrobbles row tuple.
+
+    Returns None for "now playing" tracks, which have no timestamp yet.
+    Raises KeyError/ValueError/TypeError on malformed entries.
+    """
+    # Skip "now playing" tracks
+    if "@attr" in scrobble and scrobble["@attr"].get("nowplaying") == "true":
+        return None
+
+    # Sometimes Last.fm returns inconsistent structures, so be defensive
+    timestamp = int(scrobble["date"]["uts"])
+
+    # Artist can be dict with 'name' or just a string
+    artist_data = scrobble.get("artist", {})
+    if isinstance(artist_data, dict):
+        artist = artist_data.get("name", "Unknown Artist")
+        artist_mbid = artist_data.get("mbid", "")
+    else:
+        artist = str(artist_data)
+        artist_mbid = ""
+
+    # Album can be dict with '#text' or just a string
+    album_data = scrobble.get("album", {})
+    if isinstance(album_data, dict):
+        album = album_data.get("#text", "")
+        album_mbid = album_data.get("mbid", "")
+    else:
+        album = str(album_data) if album_data else ""
+        album_mbid = ""
+
+    track = scrobble.get("name", "Unknown Track")
+    track_mbid = scrobble.get("mbid", "")
+    loved = 1 if scrobble.get("loved") == "1" else 0
+
+    return (
+        timestamp,
+        artist,
+        album,
+        track,
+        album_mbid,
+        artist_mbid,
+        track_mbid,
+        loved,
+        archived_timestamp,
+    )
 
-    inserted = 0
+
+def iter_normalized(scrobbles, archived_timestamp: str):
+    """Normalize scrobbles lazily, logging and dropping malformed entries."""
     for scrobble in scrobbles:
-        # Skip "now playing" tracks
-        if "@attr" in scrobble and scrobble["@attr"].get("nowplaying") == "true":
+        try:
+            row = normalize_scrobble(scrobble, archived_timestamp)
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            # Log problematic scrobbles but don't crash
+            print(f"Warning: Skipping malformed scrobble: {e}", file=sys.stderr)
             continue
+        if row is not None:
+            yield row
 
-        # Sometimes Last.fm returns inconsistent structures, so be defensive
-        try:
-            timestamp = int(scrobble["date"]["uts"])
-
-            # Artist can be dict with 'name' or just a string
-            artist_data = scrobble.get("artist", {})
-            if isinstance(artist_data, dict):
-                artist = artist_data.get("name", "Unknown Artist")
-                artist_mbid = artist_data.get("mbid", "")
-            else:
-                artist = str(artist_data)
-                artist_mbid = ""
-
-            # Album can be dict with '#text' or just a string
-            album_data = scrobble.get("album", {})
-            if isinstance(album_data, dict):
-                album = album_data.get("#text", "")
-                album_mbid = album_data.get("mbid", "")
-            else:
-                album = str(album_data) if album_data else ""
-                album_mbid = ""
-
-            track = scrobble.get("name", "Unknown Track")
-            track_mbid = scrobble.get("mbid", "")
-            loved = 1 if scrobble.get("loved") == "1" else 0
-
-            cursor.execute(
+
+def normalize_page(scrobbles, archived_timestamp: str):
+    """Normalize a whole API page, logging and dropping malformed entries."""
+    return list(iter_normalized(scrobbles, archived_timestamp))
+
+
+def write_rows(conn, rows):
+    """Write normalized rows in one transaction, ignoring duplicates.
+
+    Returns (inserted, duplicates). The inserted count is the statement's
+    rowcount, which skips rows ignored by OR IGNORE and changes made by
+    triggers (unlike conn.total_changes).
+    """
+    if not rows:
+        return 0, 0
+
+    if schema_version(conn) >= SCHEMA_VERSION:
+        inserted = write_facts(conn, rows)
+    else:
+        with conn:
+            cursor = conn.executemany(
                 """
-                INSERT INTO scrobbles 
+                INSERT OR IGNORE INTO scrobbles
                 (timestamp, artist, album, track, album_mbid, artist_mbid, track_mbid, loved, date_archived)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
-                (
-                    timestamp,
-                    artist,
-                    album,
-                    track,
-                    album_mbid,
-                    artist_mbid,
-                    track_mbid,
-                    loved,
-                    archived_timestamp,
-                ),
+                rows,
             )
-            inserted += 1
+        inserted = cursor.rowcount
 
-        except (KeyError, ValueError, TypeError) as e:
-            # Log problematic scrobbles but don't crash
-            print(f"Warning: Skipping malformed scrobble: {e}", file=sys.stderr)
-            continue
-        except sqlite3.IntegrityError:
-            # Duplicate timestamp, skip silently
-            pass
+    if inserted < len(rows):
+        record_collisions(conn, rows)
+    return inserted, len(rows) - inserted
 
-    conn.commit()
-    return inserted
 
+def record_collisions(conn, rows, chunk_size: int = 500):
+    """Remember ignored rows that weren't the scrobble stored at their second.
 
-def main():
-    print(f"Starting Last.fm archival at {datetime.now()}")
+    Most ignored rows are re-fetches of what's already archived; the rest
+    are a second scrobble in the same second (e.g. a track skipped straight
+    away), which the timestamp key can't hold.
+    """
+    timestamps = list({row[0] for row in rows})
+    stored = {}
+    for start in range(0, len(timestamps), chunk_size):
+        chunk = timestamps[start : start + chunk_size]
+        cursor = conn.execute(
+            f"""
+            SELECT timestamp, artist, track FROM scrobbles
+            WHERE timestamp IN ({", ".join("?" * len(chunk))})
+        """,
+            chunk,
+        )
+        stored.update(
+            (timestamp, (artist, track)) for timestamp, artist, track in cursor
+        )
+
+    collisions = {
+        (timestamp, artist, track)
+        for timestamp, artist, _, track, *_ in rows
+        if stored.get(timestamp, (artist, track)) != (artist, track)
+    }
+    if collisions:
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO scrobble_collisions VALUES (?, ?, ?)",
+                collisions,
+            )
+
+
+def insert_scrobbles(conn, scrobbles):
+    """Insert a page of scrobbles into the database, ignoring duplicates.
+
+    Returns (inserted, duplicates).
+    """
+    archived_timestamp = datetime.now().isoformat()
+    rows = normalize_page(scrobbles, archived_timestamp)
+    return write_rows(conn, rows)
 
-    # Initialize database
-    conn = init_db(DB_PATH)
 
-    # Get last archived timestamp to avoid re-downloading everything
-    last_timestamp = get_last_archived_timestamp(conn)
+def iter_pages(fetch_page, pages, workers: int = DEFAULT_WORKERS):
+    """Fetch pages concurrently but yield (page, data) strictly in page order.
+
+    At most 2 * workers requests are in flight, so a slow page can't let the
+    rest of the backfill pile up in memory ahead of the writer.
+    """
+    pages = iter(pages)
+    window = max(1, workers) * 2
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        in_flight = deque()
+
+        def submit_next():
+            page = next(pages, None)
+            if page is not None:
+                in_flight.append((page, executor.submit(fetch_page, page)))
+
+        for _ in range(window):
+            submit_next()
+
+        try:
+            while in_flight:
+                page, future = in_flight.popleft()
+                data = future.result()
+                submit_next()
+                yield page, data
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+
+def import_export(conn, path: str, fmt: str, batch_size: int, stats):
+    """Stream an export file into the archive in batched transactions.
+
+    Records flow file -> reader -> normalizer -> batch of batch_size rows, so
+    memory stays flat however large the export is.
+    """
+    archived_timestamp = datetime.now().isoformat()
+    start_time = time.monotonic()
+    with open_export(path) as f:
+        rows = iter_normalized(iter_export(f, fmt), archived_timestamp)
+        while batch := list(islice(rows, batch_size)):
+            inserted, duplicates = write_rows(conn, batch)
+            stats.inserted += inserted
+            stats.duplicates += duplicates
+            stats.pages += 1
+
+            done = stats.inserted + stats.duplicates
+            elapsed = time.monotonic() - start_time
+            print(
+                f"  {done:,} scrobbles read, {stats.inserted:,} new "
+                f"({done / elapsed:,.0f} scrobbles/s)"
+            )
+
+
+@dataclass
+class ArchiveStats:
+    """Running totals for the end-of-run summary."""
+
+    inserted: int = 0
+    duplicates: int = 0
+    pages: int = 0
+
+
+def store_page(conn, page, data, stats: ArchiveStats):
+    """Insert one fetched page and return its tracks."""
+    tracks = data.get("recenttracks", {}).get("track", [])
+    if isinstance(tracks, dict):
+        tracks = [tracks]
+
+    inserted, duplicates = insert_scrobbles(conn, tracks)
+    stats.inserted += inserted
+    stats.duplicates += duplicates
+    stats.pages += 1
     print(
-        f"Last archived timestamp: {last_timestamp} ({datetime.fromtimestamp(last_timestamp) if last_timestamp else 'Never'})"
+        f"  Inserted {inserted} new scrobbles from page {page} ({duplicates} duplicates)"
     )
+    return tracks
 
-    # Fetch and store tracks
-    page = 1
-    total_inserted = 0
 
-    while True:
-        print(f"Fetching page {page}...")
-        try:
-            data = fetch_recent_tracks(
-                LASTFM_USERNAME, LASTFM_API_KEY, last_timestamp, page
+def run_checkpoint(conn, client, checkpoint: Checkpoint, stats, workers):
+    """Fetch every remaining page of a window, checkpointing as we go.
+
+    Page 1 tells us how many pages there are; the rest can go in parallel.
+    Returns False if the window had to be abandoned part-way.
+    """
+
+    def fetch_page(page):
+        return fetch_recent_tracks(
+            client,
+            LASTFM_USERNAME,
+            checkpoint.from_timestamp,
+            page,
+            checkpoint.to_timestamp,
+        )
+
+    try:
+        if checkpoint.total_pages is None:
+            print("Fetching page 1...")
+            data = fetch_page(1)
+            checkpoint.total_pages = int(data["recenttracks"]["@attr"]["totalPages"])
+            store_page(conn, 1, data, stats)
+            checkpoint.last_page = 1
+            update_checkpoint(conn, checkpoint)
+
+        first = checkpoint.last_page + 1
+        if first <= checkpoint.total_pages:
+            print(
+                f"Fetching pages {first}-{checkpoint.total_pages} with {workers} workers..."
             )
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data: {e}", file=sys.stderr)
-            break
+            for page, data in iter_pages(
+                fetch_page, range(first, checkpoint.total_pages + 1), workers
+            ):
+                store_page(conn, page, data, stats)
+                checkpoint.last_page = page
+                update_checkpoint(conn, checkpoint)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data: {e}", file=sys.stderr)
+        return False
+    except KeyError as e:
+        print(f"Unexpected API response, missing {e}", file=sys.stderr)
+        return False
+
+    update_checkpoint(conn, checkpoint, complete=True)
+    return True
+
+
+def run_pending_checkpoints(conn, client, stats, workers):
+    """Resume every unfinished window in order; stop at the first failure."""
+    for checkpoint in pending_checkpoints(conn):
+        print(
+            f"Resuming window {datetime.fromtimestamp(checkpoint.from_timestamp)} to "
+            f"{datetime.fromtimestamp(checkpoint.to_timestamp)} after page {checkpoint.last_page}"
+        )
+        if not run_checkpoint(conn, client, checkpoint, stats, workers):
+            return False
+    return True
+
+
+def verify_archive(conn, client, since: date | None = None, workers=DEFAULT_WORKERS):
+    """Compare per-day scrobble counts against the API and queue any gaps.
+
+    Each short day becomes a pending checkpoint window, so it's re-fetched by
+    run_pending_checkpoints (now, or on the next run). Scrobbles that
+    collided with another in the same second count as archived, as the API
+    counts them too. Returns the gap days.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT date(timestamp, 'unixepoch') AS day, COUNT(*)
+        FROM (
+            SELECT timestamp FROM {fact_table(conn)}
+            UNION ALL
+            SELECT timestamp FROM scrobble_collisions
+        )
+        GROUP BY day
+    """
+    )
+    local_counts = {date.fromisoformat(day): n for day, n in cursor.fetchall()}
+    if not local_counts and since is None:
+        print("Nothing archived yet, nothing to verify")
+        return []
+
+    # Today is still filling up, so only check complete UTC days
+    first_day = since or min(local_counts)
+    last_day = datetime.now(timezone.utc).date() - timedelta(days=1)
+    days = [
+        first_day + timedelta(days=n) for n in range((last_day - first_day).days + 1)
+    ]
+    print(f"Verifying {len(days)} days from {first_day} to {last_day}...")
+
+    def day_bounds(day):
+        start = int(
+            datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+        )
+        return start, start + 86400 - 1
+
+    def fetch_day_total(day):
+        start, end = day_bounds(day)
+        data = client.call(
+            "user.getrecenttracks",
+            user=LASTFM_USERNAME,
+            limit=1,
+            **{"from": start, "to": end},
+        )
+        return int(data["recenttracks"]["@attr"]["total"])
+
+    gaps = []
+    for day, remote in iter_pages(fetch_day_total, days, workers):
+        local = local_counts.get(day, 0)
+        if remote > local:
+            print(f"  {day}: {local} archived, {remote} on Last.fm")
+            gaps.append(day)
+            start_checkpoint(conn, *day_bounds(day))
+        elif remote < local:
+            # Deleted on Last.fm since we archived them; keep our copy
+            print(f"  {day}: {local} archived, only {remote} on Last.fm")
+
+    print(f"Found {len(gaps)} days with missing scrobbles")
+    return gaps
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Archive Last.fm scrobbles")
+    parser.add_argument(
+        "--synchronous",
+        default=DEFAULT_SYNCHRONOUS,
+        choices=["OFF", "NORMAL", "FULL"],
+        help="SQLite synchronous pragma (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help="SQLite cache_size pragma; negative values are KiB (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Concurrent page fetches once the page count is known (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_RATE,
+        help="Max API requests per second across all workers (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Compare per-day counts with the API and re-fetch days with gaps",
+    )
+    parser.add_argument(
+        "--since",
+        type=date.fromisoformat,
+        help="With --verify, only check days from this date (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--import",
+        dest="import_path",
+        metavar="PATH",
+        help="Load an export file (JSON, NDJSON or CSV; '-' for stdin) instead of calling the API",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "ndjson", "csv"],
+        help="Export format for --import (default: from the file extension)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_IMPORT_BATCH,
+        help="Rows per transaction for --import (default: %(default)s)",
+    )
+    return parser.parse_args()
 
-        tracks = data.get("recenttracks", {}).get("track", [])
-        if not tracks:
-            break
 
-        # Insert into database
-        inserted = insert_scrobbles(conn, tracks)
-        total_inserted += inserted
-        print(f"  Inserted {inserted} new scrobbles from page {page}")
+def main():
+    args = parse_args()
+    print(f"Starting Last.fm archival at {datetime.now()}")
 
-        # Check if we're on the last page
-        total_pages = int(data["recenttracks"]["@attr"]["totalPages"])
-        if page >= total_pages:
-            break
+    # Initialize database
+    conn = init_db(DB_PATH, args.synchronous, args.cache_size)
+
+    stats = ArchiveStats()
+    if args.import_path:
+        fmt = args.format or detect_format(args.import_path)
+        print(f"Importing {args.import_path} as {fmt}...")
+        import_export(conn, args.import_path, fmt, args.batch_size, stats)
+        finish_run(conn, stats)
+        return
+
+    client = LastfmClient(pool_size=args.workers, rate=args.rate)
+    # Only fetching counts towards the throughput; verifying is timed apart
+    start_time = time.monotonic()
+
+    # Finish any interrupted windows before starting a new one; otherwise the
+    # MAX(timestamp) cursor below would jump over the unfetched history
+    completed = run_pending_checkpoints(conn, client, stats, args.workers)
+
+    if completed:
+        # Get last archived timestamp to avoid re-downloading everything
+        last_timestamp = get_last_archived_timestamp(conn)
+        print(
+            f"Last archived timestamp: {last_timestamp} ({datetime.fromtimestamp(last_timestamp) if last_timestamp else 'Never'})"
+        )
+        checkpoint = start_checkpoint(conn, last_timestamp, int(time.time()))
+        completed = run_checkpoint(conn, client, checkpoint, stats, args.workers)
+    elapsed = time.monotonic() - start_time
+
+    if completed and args.verify:
+        verify_start = time.monotonic()
+        verify_archive(conn, client, args.since, args.workers)
+        print(f"Verified in {time.monotonic() - verify_start:.1f}s")
+        refetch_start = time.monotonic()
+        run_pending_checkpoints(conn, client, stats, args.workers)
+        elapsed += time.monotonic() - refetch_start
+
+    if stats.pages and elapsed > 0:
+        scrobbles = stats.inserted + stats.duplicates
+        print(
+            f"Fetched {stats.pages} pages in {elapsed:.1f}s "
+            f"({stats.pages / elapsed:.2f} pages/s, {scrobbles / elapsed:.1f} scrobbles/s)"
+        )
 
-        page += 1
-        time.sleep(0.3)  # Be nice to Last.fm API
+    client.close()
+    finish_run(conn, stats)
 
-    conn.close()
-    print(f"Archive complete. Total new scrobbles: {total_inserted}")
 
-    # Print some stats
-    conn = sqlite3.connect(DB_PATH)
+def finish_run(conn, stats: ArchiveStats):
+    """Bring the derived tables up to date and print the run summary."""
+    start_time = time.monotonic()
+    prune_checkpoints(conn)
+    refresh_rollups(conn)
+    refresh_search(conn)
+    print(f"Refreshed rollups and search index in {time.monotonic() - start_time:.1f}s")
+    print(
+        f"Archive complete. Total new scrobbles: {stats.inserted} ({stats.duplicates} duplicates skipped)"
+    )
+
+    # Print some stats, from the rollups rather than a full table scan
+    total = total_plays(conn)
     cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM scrobbles")
-    total = cursor.fetchone()[0]
-    cursor.execute("SELECT MIN(timestamp), MAX(timestamp) FROM scrobbles")
+    cursor.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {fact_table(conn)}")
     min_ts, max_ts = cursor.fetchone()
     conn.close()
 
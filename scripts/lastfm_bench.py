@@ -0,0 +1,341 @@
+#!/usr/bin/env -S uv run
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "requests",
+# ]
+# ///
+"""
+Benchmark the Last.fm archive pipeline against a local fake API.
+
+For each history size, a synthetic skewed history is served by
+lastfm_stub.py and pushed through the real code paths into a fresh
+database, timing:
+    - ingestion (lastfm_backup's checkpointed, concurrent page fetch)
+    - rollup and search index refresh
+    - enrichment (enrich_artists) and flag reclassification
+    - stats/search queries and get_last_archived_timestamp
+    - the resulting database size
+
+Results are written as JSON. Given a baseline from an earlier run, every
+metric is compared and anything worse by more than --tolerance is flagged,
+with a non-zero exit status so it can gate a change.
+
+Usage:
+    python lastfm_bench.py --sizes 10k,100k --save-baseline
+    python lastfm_bench.py --sizes 10k,100k          # compare with the baseline
+    python lastfm_bench.py --sizes 1M --schema 2 --out bench_v2.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from pathlib import Path
+
+# The stub ignores credentials, but lastfm_client requires them at import
+for name in ("LASTFM_KEY", "LASTFM_SECRET", "LASTFM_USERNAME"):
+    os.environ.setdefault(name, "bench")
+
+from enrich_lastfm_backup import enrich_artists, init_metadata_tables
+from lastfm_backup import (
+    ArchiveStats,
+    get_last_archived_timestamp,
+    init_db,
+    run_checkpoint,
+    start_checkpoint,
+)
+from lastfm_client import LastfmClient
+from lastfm_flags import reclassify, sync_flag_rules
+from lastfm_schema import file_size, migrate
+from lastfm_search import refresh_search, search
+from lastfm_stats import plays_per, refresh_rollups, top, total_plays
+from lastfm_stub import END_TIMESTAMP, make_history, serve
+
+# Configuration
+BASELINE_PATH = Path(__file__).parent / "lastfm_bench_baseline.json"
+DEFAULT_SIZES = "10k,100k"
+DEFAULT_ARTISTS = 5000
+DEFAULT_SKEW = 1.0
+DEFAULT_WORKERS = 8
+DEFAULT_TOLERANCE = 0.25
+QUERY_REPEAT = 5
+# Timings this small are mostly noise; don't flag them
+NOISE_FLOOR_MS = 1.0
+
+# metric -> which direction is better
+METRICS = {
+    "ingest_s": "lower",
+    "ingest_scrobbles_per_s": "higher",
+    "rollups_refresh_s": "lower",
+    "search_refresh_s": "lower",
+    "enrich_s": "lower",
+    "enrich_artists_per_s": "higher",
+    "reclassify_ms": "lower",
+    "last_timestamp_ms": "lower",
+    "query_top_artists_ms": "lower",
+    "query_top_tracks_year_ms": "lower",
+    "query_weekly_plays_ms": "lower",
+    "query_total_plays_ms": "lower",
+    "query_search_ms": "lower",
+    "db_bytes": "lower",
+    "bytes_per_scrobble": "lower",
+}
+
+
+def parse_size(text: str) -> int:
+    """'10k' -> 10000, '1.5M' -> 1500000."""
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    text = text.strip().lower()
+    if text[-1:] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+
+def best_of(fn, repeat: int = QUERY_REPEAT):
+    """Best wall time of repeat calls, in ms."""
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start_time)
+    return best * 1000
+
+
+def run_size(size: int, work_dir: Path, args):
+    """Benchmark one history size in work_dir; returns its metrics."""
+    results = {}
+    quiet = open(os.devnull, "w")
+
+    start_time = time.perf_counter()
+    history = make_history(size, args.artists, seed=args.seed, skew=args.skew)
+    results["generate_s"] = time.perf_counter() - start_time
+
+    server = serve(history, latency=args.latency)
+    client = LastfmClient(api_url=server.url, pool_size=args.workers, rate=args.rate)
+    db_path = work_dir / f"bench_{size}.db"
+    conn = init_db(db_path)
+    if args.schema == 2:
+        migrate(conn)
+
+    try:
+        # Ingestion: one backfill window over the whole history
+        stats = ArchiveStats()
+        start_time = time.perf_counter()
+        with redirect_stdout(quiet):
+            checkpoint = start_checkpoint(conn, 0, END_TIMESTAMP)
+            completed = run_checkpoint(conn, client, checkpoint, stats, args.workers)
+        elapsed = time.perf_counter() - start_time
+        if not completed or stats.inserted != size:
+            raise RuntimeError(
+                f"ingested {stats.inserted:,} of {size:,} scrobbles (completed={completed})"
+            )
+        results["ingest_s"] = elapsed
+        results["ingest_scrobbles_per_s"] = size / elapsed
+
+        start_time = time.perf_counter()
+        refresh_rollups(conn)
+        results["rollups_refresh_s"] = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        refresh_search(conn)
+        results["search_refresh_s"] = time.perf_counter() - start_time
+
+        # Enrichment and flags
+        if not args.skip_enrich:
+            init_metadata_tables(conn)
+            sync_flag_rules(conn)
+            start_time = time.perf_counter()
+            with redirect_stdout(quiet):
+                enrich_artists(conn, client, args.min_plays, concurrency=args.workers)
+            elapsed = time.perf_counter() - start_time
+            (enriched,) = conn.execute(
+                "SELECT COUNT(*) FROM artists WHERE tags_fetched_at IS NOT NULL"
+            ).fetchone()
+            results["enrich_s"] = elapsed
+            results["enrich_artists_per_s"] = enriched / elapsed if elapsed else 0.0
+            results["reclassify_ms"] = best_of(lambda: reclassify(conn), repeat=3)
+
+        # Reads
+        top_artist = top(conn, "artist", limit=1)[0][0]
+        # The span depends on size, so take the year of the newest scrobble
+        last_year = datetime.fromtimestamp(
+            get_last_archived_timestamp(conn), timezone.utc
+        ).year
+        queries = {
+            "last_timestamp_ms": lambda: get_last_archived_timestamp(conn),
+            "query_top_artists_ms": lambda: top(conn, "artist", limit=50),
+            "query_top_tracks_year_ms": lambda: top(
+                conn, "track", f"{last_year}-01-01", f"{last_year + 1}-01-01", 50
+            ),
+            "query_weekly_plays_ms": lambda: plays_per(conn, "week", top_artist),
+            "query_total_plays_ms": lambda: total_plays(conn),
+            "query_search_ms": lambda: search(conn, "artst 12"),
+        }
+        for metric, query in queries.items():
+            results[metric] = best_of(query)
+
+        results["db_bytes"] = file_size(conn, db_path)
+        results["bytes_per_scrobble"] = results["db_bytes"] / size
+        results["requests_served"] = server.requests_served
+    finally:
+        client.close()
+        conn.close()
+        server.shutdown()
+        quiet.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance: float):
+    """Print current vs baseline for every shared metric; return regressions."""
+    regressions = []
+    for size, metrics in results["runs"].items():
+        base = baseline.get("runs", {}).get(size)
+        if base is None:
+            print(f"\n{size} scrobbles: not in baseline")
+            continue
+
+        print(f"\n{size} scrobbles:")
+        for metric, better in METRICS.items():
+            if metric not in metrics or metric not in base or not base[metric]:
+                continue
+            current, previous = metrics[metric], base[metric]
+            ratio = current / previous
+            worse = (
+                ratio > 1 + tolerance
+                if better == "lower"
+                else ratio < 1 / (1 + tolerance)
+            )
+            if metric.endswith("_ms") and max(current, previous) < NOISE_FLOOR_MS:
+                worse = False
+
+            marker = "  REGRESSION" if worse else ""
+            print(
+                f"  {metric:<26} {previous:>14,.2f} -> {current:>14,.2f} ({ratio:.2f}x){marker}"
+            )
+            if worse:
+                regressions.append((size, metric, previous, current))
+    return regressions
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Last.fm archive pipeline"
+    )
+    parser.add_argument(
+        "--sizes",
+        default=DEFAULT_SIZES,
+        help="Comma-separated history sizes, e.g. 10k,100k,1M,10M (default: %(default)s)",
+    )
+    parser.add_argument("--artists", type=int, default=DEFAULT_ARTISTS)
+    parser.add_argument(
+        "--skew",
+        type=float,
+        default=DEFAULT_SKEW,
+        help="Zipf exponent for artist/track popularity (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument(
+        "--rate", type=float, help="Cap requests per second (default: unlimited)"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Stub delay per request in seconds"
+    )
+    parser.add_argument("--min-plays", type=int, default=5)
+    parser.add_argument("--skip-enrich", action="store_true")
+    parser.add_argument(
+        "--schema", type=int, choices=[1, 2], default=1, help="Archive layout to test"
+    )
+    parser.add_argument(
+        "--work-dir", type=Path, help="Keep the databases here instead of a temp dir"
+    )
+    parser.add_argument("--out", type=Path, help="Write results JSON here")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store these results as the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed slowdown before flagging, as a fraction (default: %(default)s)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+
+    results = {
+        "created": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "config": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+        },
+        "runs": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or Path(tmp_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        for size in sizes:
+            print(f"Benchmarking {size:,} scrobbles...")
+            metrics = run_size(size, work_dir, args)
+            results["runs"][str(size)] = metrics
+            print(
+                f"  ingest {metrics['ingest_scrobbles_per_s']:,.0f} scrobbles/s, "
+                f"db {metrics['bytes_per_scrobble']:,.0f} bytes/scrobble"
+            )
+
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.out}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+
+    regressions = compare(
+        results, json.loads(args.baseline.read_text()), args.tolerance
+    )
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {args.tolerance:.0%}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+On-disk cache of Last.fm API responses, for slow-changing lookups.
+
+Entries are zlib-compressed JSON in a SQLite file, keyed by a hash of the
+method and its parameters (minus the API key). Each method has its own TTL;
+methods without one (e.g. user.getrecenttracks) are never cached. When the
+cache outgrows max_bytes, the least recently used entries are evicted.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+CACHE_PATH = Path(__file__).parent / "lastfm_cache.db"
+DAY = 24 * 60 * 60
+DEFAULT_TTLS = {
+    "artist.gettoptags": 30 * DAY,
+    "artist.getinfo": 30 * DAY,
+}
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+IGNORED_PARAMS = {"api_key", "format"}
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0
+        return (
+            f"{self.hits} hits, {self.misses} misses ({self.expired} expired), "
+            f"{rate:.0%} hit rate, {self.writes} writes, {self.evictions} evicted"
+        )
+
+
+class ResponseCache:
+    """Thread-safe, size-bounded LRU cache of decoded API payloads."""
+
+    def __init__(
+        self,
+        path: Path = CACHE_PATH,
+        ttls: dict | None = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                method TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """
+        )
+        self.conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)
+        """
+        )
+        self.conn.commit()
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def cacheable(self, method: str) -> bool:
+        return bool(self.ttls.get(method))
+
+    @staticmethod
+    def key(method: str, params: dict) -> str:
+        """Content address for a call: identical requests share one entry."""
+        relevant = {k: str(v) for k, v in params.items() if k not in IGNORED_PARAMS}
+        blob = json.dumps([method, relevant], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, method: str, params: dict):
+        """Return the cached payload, or None on a miss or expired entry."""
+        key = self.key(method, params)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+
+            body, created_at = row
+            if now - created_at > self.ttls.get(method, 0):
+                self.stats.misses += 1
+                self.stats.expired += 1
+                return None
+
+            self.conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+            self.stats.hits += 1
+        return json.loads(zlib.decompress(body))
+
+    def put(self, method: str, params: dict, data):
+        """Store a payload, evicting old entries if over the size budget."""
+        key = self.key(method, params)
+        body = zlib.compress(json.dumps(data).encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO responses
+                (key, method, body, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """,
+                (key, method, body, len(body), now, now),
+            )
+            self.total_bytes += len(body) - (old[0] if old else 0)
+            self.stats.writes += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until back under 90% of budget."""
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.stats.evictions += len(evicted)
+
+    def close(self):
+        self.conn.close()
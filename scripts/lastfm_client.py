@@ -0,0 +1,158 @@
+"""
+Shared Last.fm API client for the archive scripts.
+
+Holds one pooled keep-alive session so repeated calls reuse the same
+connection instead of paying TCP/DNS setup every time, with transport-level
+retries and an optional request-rate cap.
+"""
+
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Configuration
+LASTFM_API_KEY = os.environ["LASTFM_KEY"]
+LASTFM_SECRET = os.environ["LASTFM_SECRET"]
+LASTFM_USERNAME = os.environ["LASTFM_USERNAME"]
+# Overridable so the scripts can be exercised against lastfm_stub.py
+LASTFM_API_URL = os.environ.get("LASTFM_API_URL", "http://ws.audioscrobbler.com/2.0/")
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0  # 1s, 2s, 4s
+DEFAULT_TIMEOUT = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Error payloads that are real answers (e.g. 6: no such artist), safe to cache
+CACHEABLE_ERRORS = {6}
+
+
+class LastfmError(requests.exceptions.RequestException):
+    """Error payload returned by the API (e.g. {"error": 6, "message": ...})."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"Last.fm error {code}: {message}")
+        self.code = code
+
+
+class CacheMiss(requests.exceptions.RequestException):
+    """Raised in offline mode when a response isn't in the cache."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket capping how often API calls may start."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class LastfmClient:
+    """Pooled, retrying, optionally rate-limited Last.fm API client.
+
+    Safe to share between threads; size the pool to the number of workers.
+    With a ResponseCache, cacheable methods are answered locally when
+    possible, and offline=True makes every other call raise CacheMiss.
+    """
+
+    def __init__(
+        self,
+        api_key: str = LASTFM_API_KEY,
+        api_url: str = LASTFM_API_URL,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        timeout: float = DEFAULT_TIMEOUT,
+        rate: float | None = None,
+        cache=None,
+        offline: bool = False,
+    ):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate) if rate else None
+        self.cache = cache
+        self.offline = offline
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Accept-Encoding": "gzip", "User-Agent": "dotfiles-lastfm-archive"}
+        )
+
+    def call(self, method: str, **params):
+        """Call an API method and return the decoded JSON payload."""
+        use_cache = self.cache is not None and self.cache.cacheable(method)
+        if use_cache:
+            data = self.cache.get(method, params)
+            if data is not None:
+                return self._check(data)
+        if self.offline:
+            raise CacheMiss(f"{method} {params} is not cached")
+
+        if self.limiter:
+            self.limiter.acquire()
+
+        query = {"method": method, "api_key": self.api_key, "format": "json", **params}
+        response = self.session.get(self.api_url, params=query, timeout=self.timeout)
+
+        # Errors come back as JSON bodies, sometimes with a 200 status
+        try:
+            data = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise
+        error = data.get("error") if isinstance(data, dict) else None
+        if error is None:
+            response.raise_for_status()
+        if use_cache and (error is None or error in CACHEABLE_ERRORS):
+            self.cache.put(method, params, data)
+        return self._check(data)
+
+    @staticmethod
+    def _check(data):
+        """Raise LastfmError for error payloads, otherwise pass data through."""
+        if isinstance(data, dict) and "error" in data:
+            raise LastfmError(data["error"], data.get("message", ""))
+        return data
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,213 @@
+#!/usr/bin/env -S uv run
+# /// script
+# requires-python = ">=3.11"
+# ///
+"""
+Tag-derived artist flags (kid_music, podcast, ...) computed from stored tags.
+
+Each flag is a set of weighted tags plus a threshold: an artist gets the flag
+when the summed weights of its matching tags reach the threshold. With
+scale_by_count, each weight is scaled by how strongly Last.fm applies the tag
+(its 0-100 count). Reclassifying is one set-based SQL pass, no network.
+
+Usage:
+    python lastfm_flags.py                  # reclassify with DEFAULT_FLAGS
+    python lastfm_flags.py --rules my.json  # same shape as DEFAULT_FLAGS
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+DB_PATH = Path(__file__).parent / "lastfm_archive.db"
+
+KID_TAGS = {
+    "children",
+    "kids",
+    "childrens music",
+    "kids music",
+    "lullaby",
+    "lullabies",
+    "nursery rhymes",
+    "educational",
+    "toddler",
+    "baby",
+    "preschool",
+}
+
+DEFAULT_FLAGS = {
+    # Any one kid tag in an artist's top tags is enough
+    "kid_music": {"threshold": 1, "tags": {tag: 1 for tag in KID_TAGS}},
+    "podcast": {
+        "threshold": 1,
+        "tags": {
+            "podcast": 1,
+            "podcasts": 1,
+            "talk": 0.5,
+            "spoken word": 0.5,
+            "interview": 0.5,
+            "news": 0.5,
+        },
+    },
+    "white_noise": {
+        "threshold": 0.5,
+        "scale_by_count": True,
+        "tags": {
+            "white noise": 1,
+            "brown noise": 1,
+            "pink noise": 1,
+            "nature sounds": 1,
+            "rain sounds": 1,
+            "sleep": 0.5,
+        },
+    },
+}
+
+
+def init_flag_tables(conn):
+    """Create the rule and result tables."""
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flag_definitions (
+            flag TEXT PRIMARY KEY,
+            threshold REAL NOT NULL,
+            scale_by_count INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flag_rules (
+            flag TEXT NOT NULL REFERENCES flag_definitions(flag),
+            tag TEXT NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (tag, flag)
+        ) WITHOUT ROWID
+    """
+    )
+    # Only flags an artist actually has are stored
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS artist_flags (
+            artist_id INTEGER NOT NULL REFERENCES artists(id),
+            flag TEXT NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (artist_id, flag)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_artist_flags_flag ON artist_flags(flag)
+    """
+    )
+
+    conn.commit()
+
+
+def load_rules(path: Path):
+    """Read a JSON rules file shaped like DEFAULT_FLAGS."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def sync_flag_rules(conn, flags=DEFAULT_FLAGS):
+    """Replace the stored rules with `flags`."""
+    with conn:
+        conn.execute("DELETE FROM flag_rules")
+        conn.execute("DELETE FROM flag_definitions")
+        conn.executemany(
+            """
+            INSERT INTO flag_definitions (flag, threshold, scale_by_count)
+            VALUES (?, ?, ?)
+        """,
+            [
+                (flag, rule["threshold"], int(rule.get("scale_by_count", False)))
+                for flag, rule in flags.items()
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO flag_rules (flag, tag, weight) VALUES (?, ?, ?)",
+            [
+                (flag, tag.lower(), weight)
+                for flag, rule in flags.items()
+                for tag, weight in rule["tags"].items()
+            ],
+        )
+
+
+def reclassify(conn):
+    """Recompute every flag for every artist from the stored tags.
+
+    Returns {flag: artist count}. Tags migrated from the old per-scrobble
+    columns have no count, so they're treated as full strength.
+    """
+    with conn:
+        conn.execute("DELETE FROM artist_flags")
+        conn.execute(
+            """
+            INSERT INTO artist_flags (artist_id, flag, score)
+            SELECT
+                at.artist_id,
+                r.flag,
+                SUM(
+                    r.weight * CASE
+                        WHEN d.scale_by_count THEN COALESCE(at.count, 100) / 100.0
+                        ELSE 1.0
+                    END
+                ) AS score
+            FROM artist_tags at
+            JOIN tags t ON t.id = at.tag_id
+            JOIN flag_rules r ON r.tag = t.name
+            JOIN flag_definitions d ON d.flag = r.flag
+            GROUP BY at.artist_id, r.flag
+            HAVING score >= MAX(d.threshold)
+        """
+        )
+
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT d.flag, COUNT(af.artist_id)
+        FROM flag_definitions d
+        LEFT JOIN artist_flags af ON af.flag = d.flag
+        GROUP BY d.flag
+    """
+    )
+    return dict(cursor.fetchall())
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Recompute tag-derived flags")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--rules", type=Path, help="JSON file of flag rules")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+    init_flag_tables(conn)
+    sync_flag_rules(conn, load_rules(args.rules) if args.rules else DEFAULT_FLAGS)
+
+    start_time = time.monotonic()
+    try:
+        counts = reclassify(conn)
+    except sqlite3.OperationalError as e:
+        print(f"Error: {e} (run enrich_lastfm_backup.py first)")
+        return
+    elapsed = time.monotonic() - start_time
+
+    for flag, count in sorted(counts.items()):
+        print(f"{flag}: {count:,} artists")
+    print(f"Reclassified in {elapsed * 1000:.0f}ms")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
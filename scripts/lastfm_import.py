@@ -0,0 +1,230 @@
+"""
+Streaming readers for Last.fm export files, for `lastfm_backup.py --import`.
+
+Every reader is a generator yielding one API-shaped track dict at a time
+(the same shape user.getrecenttracks returns), so exports of any size go
+through lastfm_backup's normal normalization in constant memory.
+
+Supported inputs:
+    - JSON: an array of tracks, of API pages ({"recenttracks": {...}}), or a
+      single page; parsed incrementally, holding one array element (a track,
+      or a page of an array of pages) at a time
+    - NDJSON: one track or page per line
+    - CSV with a header row, e.g. uts,utc_time,artist,artist_mbid,album,...
+      or a dump of the scrobbles table (timestamp,artist,album,track,...)
+Flat records (CSV rows, or JSON objects with a string artist) are mapped
+onto the API shape by column name. Files ending in .gz are decompressed.
+"""
+
+import csv
+import gzip
+import json
+import sys
+from pathlib import Path
+
+CHUNK_SIZE = 1 << 16
+
+# Flat column name -> aliases seen in the wild
+FLAT_COLUMNS = {
+    "timestamp": ("timestamp", "uts", "date_uts"),
+    "artist": ("artist", "artist_name"),
+    "artist_mbid": ("artist_mbid",),
+    "album": ("album", "album_name"),
+    "album_mbid": ("album_mbid",),
+    "track": ("track", "track_name", "name"),
+    "track_mbid": ("track_mbid",),
+    "loved": ("loved",),
+}
+
+
+def open_export(path: str):
+    """Open an export as text; '-' means stdin, which stays open after."""
+    if path == "-":
+        # Decoded like a file, and closing it leaves the process's stdin be
+        return open(sys.stdin.fileno(), encoding="utf-8", newline="", closefd=False)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def detect_format(path: str) -> str:
+    """Guess the format from the file name; stdin defaults to NDJSON."""
+    suffixes = Path(path.removesuffix(".gz")).suffixes
+    suffix = suffixes[-1].lower() if suffixes else ""
+    if suffix == ".csv":
+        return "csv"
+    if suffix == ".json":
+        return "json"
+    return "ndjson"
+
+
+class JsonStream:
+    """A JSON text read from a file a chunk at a time.
+
+    Values are decoded from a sliding buffer; a value that runs past the
+    buffer is retried after reading at least as much again as is buffered,
+    so even one huge value costs O(n log n) rather than O(n^2) decoding.
+    """
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size: int = 0):
+        chunk = self.f.read(max(size, self.chunk_size))
+        self.eof = not chunk
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+
+    def peek(self, skip: str = " \t\r\n"):
+        """The next character not in skip, without consuming it; '' at the end."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in skip:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self.fill()
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}", self.buf, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # A number at the end of the buffer may continue in the file
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            self.fill(len(self.buf) - self.pos)
+
+    def items(self):
+        """Yield the elements of the array starting here, one at a time."""
+        self.expect("[")
+        while True:
+            char = self.peek(" \t\r\n,")
+            if char == "]":
+                self.pos += 1
+                return
+            if not char:
+                raise json.JSONDecodeError("Unterminated array", self.buf, self.pos)
+            yield self.value()
+
+
+def iter_json_object(stream: JsonStream, wrap: str | None = None):
+    """Yield the tracks of the object starting here as they're read.
+
+    The elements of a "track" array, directly or under "recenttracks", are
+    yielded one at a time. An object without one is yielded whole (as
+    {wrap: object} if wrap is given), so expand_record can handle it.
+    """
+    fields = {}
+    streamed = False
+    stream.expect("{")
+    while True:
+        char = stream.peek(" \t\r\n,")
+        if char == "}":
+            stream.pos += 1
+            break
+        if not char:
+            raise json.JSONDecodeError("Unterminated object", stream.buf, stream.pos)
+        key = stream.value()
+        stream.expect(":")
+        char = stream.peek()
+        if key == "recenttracks" and char == "{":
+            yield from iter_json_object(stream, wrap=key)
+            streamed = True
+        elif key == "track" and char == "[":
+            yield from stream.items()
+            streamed = True
+        else:
+            fields[key] = stream.value()
+    if not streamed:
+        yield {wrap: fields} if wrap else fields
+
+
+def iter_json_values(f, chunk_size: int = CHUNK_SIZE):
+    """Yield the records of a JSON export without reading it all.
+
+    A top-level array yields its elements; a top-level object (a single
+    page) yields its tracks one at a time.
+    """
+    stream = JsonStream(f, chunk_size)
+    first = stream.peek()
+    if first == "[":
+        yield from stream.items()
+    elif first == "{":
+        yield from iter_json_object(stream)
+    elif first:
+        yield stream.value()
+
+
+def iter_ndjson_values(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def flat_to_track(record: dict) -> dict:
+    """Map a flat row (CSV/table dump) onto the API track shape."""
+
+    def get(column):
+        for alias in FLAT_COLUMNS[column]:
+            if record.get(alias) not in (None, ""):
+                return record[alias]
+        return ""
+
+    return {
+        "date": {"uts": get("timestamp")},
+        "artist": {"name": get("artist"), "mbid": get("artist_mbid")},
+        "album": {"#text": get("album"), "mbid": get("album_mbid")},
+        "name": get("track"),
+        "mbid": get("track_mbid"),
+        "loved": str(get("loved") or "0"),
+    }
+
+
+def expand_record(record):
+    """Yield API-shaped tracks from one decoded record of any supported shape."""
+    if isinstance(record, list):
+        for item in record:
+            yield from expand_record(item)
+    elif not isinstance(record, dict):
+        # Let the normalizer report it as malformed
+        yield record
+    elif "recenttracks" in record:
+        tracks = record["recenttracks"].get("track", [])
+        yield from expand_record(tracks if isinstance(tracks, list) else [tracks])
+    elif isinstance(record.get("track"), list):
+        yield from expand_record(record["track"])
+    elif isinstance(record.get("date"), dict) or isinstance(record.get("artist"), dict):
+        yield record
+    else:
+        yield flat_to_track(record)
+
+
+def iter_export(f, fmt: str):
+    """Yield API-shaped tracks from an open export file."""
+    if fmt == "csv":
+        for row in csv.DictReader(f):
+            yield flat_to_track(row)
+        return
+
+    values = iter_json_values(f) if fmt == "json" else iter_ndjson_values(f)
+    for value in values:
+        yield from expand_record(value)
@@ -0,0 +1,192 @@
+#!/usr/bin/env -S uv run
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "pyarrow",
+# ]
+# ///
+"""
+Export the scrobble archive to Parquet for analysis, and load it back fast.
+
+The export is hive-partitioned by year/month (year=2024/month=03/...), with
+artist/album/track dictionary-encoded. Re-running only rewrites months whose
+row count in the archive (read from the stats rollups) differs from what was
+last exported, so a daily sync touches just the current month.
+
+Usage:
+    python lastfm_parquet.py                  # sync to ./lastfm_parquet/
+    python lastfm_parquet.py --out ~/data/scrobbles
+
+In a notebook:
+    from lastfm_parquet import load_scrobbles
+    df = load_scrobbles(columns=["timestamp", "artist"], filters=[("year", ">=", 2020)])
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from lastfm_stats import init_rollups, refresh_rollups
+
+DB_PATH = Path(__file__).parent / "lastfm_archive.db"
+EXPORT_PATH = Path(__file__).parent / "lastfm_parquet"
+STATE_FILE = "_export_state.json"
+
+DICTIONARY_COLUMNS = ["artist", "album", "track"]
+SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.int64()),
+        ("played_at", pa.timestamp("s", tz="UTC")),
+        ("artist", pa.dictionary(pa.int32(), pa.string())),
+        ("album", pa.dictionary(pa.int32(), pa.string())),
+        ("track", pa.dictionary(pa.int32(), pa.string())),
+        ("album_mbid", pa.string()),
+        ("artist_mbid", pa.string()),
+        ("track_mbid", pa.string()),
+        ("loved", pa.int8()),
+        ("date_archived", pa.string()),
+    ]
+)
+
+
+def month_counts(conn):
+    """{'YYYY-MM': scrobbles} for every month in the archive, from the rollups."""
+    refresh_rollups(conn)
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT substr(period, 1, 7), SUM(plays)
+        FROM play_rollups
+        WHERE grain = 'month' AND kind = 'artist'
+        GROUP BY period
+    """
+    )
+    return dict(cursor.fetchall())
+
+
+def read_month(conn, month: str):
+    """All scrobbles in one month as an Arrow table, via the timestamp index."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT timestamp, artist, album, track, album_mbid, artist_mbid,
+               track_mbid, loved, date_archived
+        FROM scrobbles
+        WHERE timestamp >= CAST(strftime('%s', :start) AS INTEGER)
+          AND timestamp < CAST(strftime('%s', :start, '+1 month') AS INTEGER)
+        ORDER BY timestamp
+    """,
+        {"start": f"{month}-01"},
+    )
+    columns = list(zip(*cursor.fetchall()))
+    if not columns:
+        return SCHEMA.empty_table()
+    timestamps = pa.array(columns[0], pa.int64())
+    arrays = [
+        timestamps,
+        timestamps.cast(pa.timestamp("s", tz="UTC")),
+        *(pa.array(col, pa.string()).dictionary_encode() for col in columns[1:4]),
+        *(pa.array(col, pa.string()) for col in columns[4:7]),
+        pa.array(columns[7], pa.int8()),
+        pa.array([str(value) for value in columns[8]], pa.string()),
+    ]
+    return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def write_partition(table, out_dir: Path, month: str):
+    """Replace one month's partition atomically."""
+    year, mon = month.split("-")
+    partition = out_dir / f"year={year}" / f"month={mon}"
+    partition.mkdir(parents=True, exist_ok=True)
+    # Dot-prefixed so readers skip it if a write is interrupted
+    tmp_path = partition / ".part-0.parquet.tmp"
+    pq.write_table(
+        table,
+        tmp_path,
+        compression="zstd",
+        use_dictionary=DICTIONARY_COLUMNS,
+    )
+    os.replace(tmp_path, partition / "part-0.parquet")
+
+
+def export(conn, out_dir: Path = EXPORT_PATH):
+    """Sync the archive to Parquet, rewriting only months that changed.
+
+    Returns the list of months written.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    state_path = out_dir / STATE_FILE
+    exported = json.loads(state_path.read_text()) if state_path.exists() else {}
+
+    changed = [
+        month
+        for month, count in sorted(month_counts(conn).items())
+        if exported.get(month) != count
+    ]
+    for month in changed:
+        table = read_month(conn, month)
+        write_partition(table, out_dir, month)
+        exported[month] = table.num_rows
+        print(f"  {month}: {table.num_rows:,} scrobbles")
+
+        # Save as we go, so an interrupted sync doesn't redo finished months
+        state_path.write_text(json.dumps(exported, indent=1, sort_keys=True))
+
+    return changed
+
+
+def load_scrobbles(
+    path: Path = EXPORT_PATH,
+    columns: list[str] | None = None,
+    filters=None,
+    as_pandas: bool = True,
+):
+    """Load the exported archive, reading only the columns and rows asked for.
+
+    filters takes pyarrow expressions or DNF tuples, e.g.
+    [("year", "=", 2024), ("artist", "=", "Lucio Dalla")]. Filters on
+    year/month prune whole partitions; others use row-group statistics.
+    Files are memory-mapped rather than read into buffers.
+    """
+    dataset = ds.dataset(
+        str(path),
+        format="parquet",
+        partitioning="hive",
+        filesystem=pafs.LocalFileSystem(use_mmap=True),
+    )
+    if filters is not None and not isinstance(filters, ds.Expression):
+        filters = pq.filters_to_expression(filters)
+    table = dataset.to_table(columns=columns, filter=filters)
+    return table.to_pandas() if as_pandas else table
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Export scrobbles to Parquet")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--out", type=Path, default=EXPORT_PATH)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+    init_rollups(conn)
+
+    start_time = time.monotonic()
+    print(f"Syncing {args.db} to {args.out}...")
+    changed = export(conn, args.out)
+    conn.close()
+    print(f"Wrote {len(changed)} partitions in {time.monotonic() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
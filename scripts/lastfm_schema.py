@@ -0,0 +1,470 @@
+#!/usr/bin/env -S uv run
+# /// script
+# requires-python = ">=3.11"
+# ///
+"""
+Compact (v2) storage layout for the scrobble archive, and the migration to it.
+
+v1 stores every scrobble as a row of full strings: artist, album, track,
+three MBIDs and an ISO date_archived. v2 interns the names into dimension
+tables and keeps only integers per scrobble:
+
+    dim_artist (id, name, mbid)
+    dim_album  (id, artist_id, name, mbid)
+    dim_track  (id, artist_id, name, mbid)
+    scrobble_facts (timestamp PK, track_id, album_id, loved, archived_at)
+        WITHOUT ROWID, archived_at in epoch seconds (with microseconds)
+
+`scrobbles` becomes a view with the v1 columns, so existing queries (stats,
+search, enrichment, notebooks) keep working unchanged. The archiver writes
+to the fact table directly; an INSTEAD OF trigger on the view covers any
+other writer. PRAGMA user_version records the layout.
+
+Usage:
+    python lastfm_schema.py                  # migrate ./lastfm_archive.db
+    python lastfm_schema.py --no-backup
+"""
+
+import argparse
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+DB_PATH = Path(__file__).parent / "lastfm_archive.db"
+SCHEMA_VERSION = 2
+FACT_TABLE = "scrobble_facts"
+# Denormalized columns from before enrich_lastfm_backup.py moved tags out
+LEGACY_COLUMNS = {"artist_tags", "kid_music"}
+
+V2_TABLES = [
+    """
+    CREATE TABLE dim_artist (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        mbid TEXT
+    )
+    """,
+    """
+    CREATE TABLE dim_album (
+        id INTEGER PRIMARY KEY,
+        artist_id INTEGER NOT NULL REFERENCES dim_artist (id),
+        name TEXT NOT NULL,
+        mbid TEXT,
+        UNIQUE (artist_id, name)
+    )
+    """,
+    """
+    CREATE TABLE dim_track (
+        id INTEGER PRIMARY KEY,
+        artist_id INTEGER NOT NULL REFERENCES dim_artist (id),
+        name TEXT NOT NULL,
+        mbid TEXT,
+        UNIQUE (artist_id, name)
+    )
+    """,
+    """
+    CREATE TABLE scrobble_facts (
+        timestamp INTEGER PRIMARY KEY,
+        track_id INTEGER NOT NULL REFERENCES dim_track (id),
+        album_id INTEGER REFERENCES dim_album (id),
+        loved INTEGER NOT NULL DEFAULT 0,
+        archived_at REAL NOT NULL
+    ) WITHOUT ROWID
+    """,
+    # Artist lookups go name -> dim_artist -> dim_track(artist_id) -> here;
+    # album_id (and the timestamp key) make it covering for the view's joins
+    "CREATE INDEX idx_facts_track ON scrobble_facts (track_id, album_id)",
+]
+
+# v1's date_archived (local datetime.isoformat(), microseconds only when
+# non-zero) <-> epoch seconds; the fraction is parsed separately, since
+# strftime('%s') drops it
+ARCHIVED_AT = """
+    CAST(strftime('%s', {0}, 'utc') AS INTEGER)
+    + COALESCE(CAST(NULLIF(substr({0}, 21), '') AS INTEGER), 0) / 1e6
+"""
+DATE_ARCHIVED = """
+    strftime('%Y-%m-%dT%H:%M:%S', CAST({0} AS INTEGER), 'unixepoch', 'localtime')
+    || COALESCE('.' || NULLIF(printf('%06d', MIN(
+        CAST(round(({0} - CAST({0} AS INTEGER)) * 1e6) AS INTEGER), 999999
+    )), '000000'), '')
+"""
+
+# Same columns, names and '' for missing values as the v1 table
+COMPAT_VIEW = f"""
+    CREATE VIEW scrobbles AS
+    SELECT f.timestamp,
+           a.name AS artist,
+           COALESCE(al.name, '') AS album,
+           t.name AS track,
+           COALESCE(al.mbid, '') AS album_mbid,
+           COALESCE(a.mbid, '') AS artist_mbid,
+           COALESCE(t.mbid, '') AS track_mbid,
+           f.loved,
+           {DATE_ARCHIVED.format("f.archived_at")} AS date_archived
+    FROM scrobble_facts f
+    JOIN dim_track t ON t.id = f.track_id
+    JOIN dim_artist a ON a.id = t.artist_id
+    LEFT JOIN dim_album al ON al.id = f.album_id
+"""
+
+# Fill in an MBID we didn't have, but never overwrite one
+UPSERT_MBID = "DO UPDATE SET mbid = excluded.mbid WHERE mbid IS NULL AND excluded.mbid IS NOT NULL"
+
+COMPAT_INSERT_TRIGGER = f"""
+    CREATE TRIGGER scrobbles_insert INSTEAD OF INSERT ON scrobbles
+    BEGIN
+        INSERT INTO dim_artist (name, mbid)
+        VALUES (NEW.artist, NULLIF(NEW.artist_mbid, ''))
+        ON CONFLICT (name) {UPSERT_MBID};
+
+        INSERT INTO dim_track (artist_id, name, mbid)
+        SELECT id, NEW.track, NULLIF(NEW.track_mbid, '') FROM dim_artist WHERE name = NEW.artist
+        ON CONFLICT (artist_id, name) {UPSERT_MBID};
+
+        INSERT INTO dim_album (artist_id, name, mbid)
+        SELECT id, NEW.album, NULLIF(NEW.album_mbid, '') FROM dim_artist
+        WHERE name = NEW.artist AND COALESCE(NEW.album, '') != ''
+        ON CONFLICT (artist_id, name) {UPSERT_MBID};
+
+        INSERT OR IGNORE INTO scrobble_facts (timestamp, track_id, album_id, loved, archived_at)
+        SELECT NEW.timestamp, t.id, al.id, COALESCE(NEW.loved, 0),
+               COALESCE({ARCHIVED_AT.format("NEW.date_archived")},
+                        CAST(strftime('%s', 'now') AS INTEGER))
+        FROM dim_artist a
+        JOIN dim_track t ON t.artist_id = a.id AND t.name = NEW.track
+        LEFT JOIN dim_album al ON al.artist_id = a.id AND al.name = NEW.album
+        WHERE a.name = NEW.artist;
+    END
+"""
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def fact_table(conn):
+    """The table that physically holds one row per scrobble.
+
+    Use it for timestamp-only queries (MIN/MAX, per-day counts, triggers),
+    which shouldn't pay for the view's joins.
+    """
+    return FACT_TABLE if schema_version(conn) >= SCHEMA_VERSION else "scrobbles"
+
+
+def dimension_ids(conn, table: str, columns, keys):
+    """Look keys up in a dimension table with one join.
+
+    The keys go into a temp table, so each is found through the table's
+    unique index instead of a subquery per scrobble. Returns
+    key -> (id, mbid) for the keys that exist.
+    """
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS keys_{table} ({', '.join(columns)})")
+    conn.execute(f"DELETE FROM temp.keys_{table}")
+    conn.executemany(
+        f"INSERT INTO temp.keys_{table} VALUES ({', '.join('?' * len(columns))})",
+        keys,
+    )
+    match = " AND ".join(f"d.{column} = k.{column}" for column in columns)
+    rows = conn.execute(
+        f"SELECT {', '.join(f'k.{column}' for column in columns)}, d.id, d.mbid "
+        f"FROM temp.keys_{table} k JOIN {table} d ON {match}"
+    )
+    return {row[:-2]: row[-2:] for row in rows}
+
+
+def store_dimension(conn, table: str, columns, mbids):
+    """Make sure every key is in a dimension table; returns key -> id.
+
+    Only keys that aren't there yet are inserted, and an MBID is only
+    written where the stored one is missing (as UPSERT_MBID does).
+
+    mbids maps each key (a tuple of the columns' values) to its MBID or ''.
+    """
+    found = dimension_ids(conn, table, columns, mbids)
+    missing = [key for key in mbids if key not in found]
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}, mbid) "
+        f"VALUES ({'?, ' * len(columns)}NULLIF(?, ''))",
+        ((*key, mbids[key]) for key in missing),
+    )
+    conn.executemany(
+        f"UPDATE {table} SET mbid = ? WHERE id = ?",
+        (
+            (mbids[key], dimension_id)
+            for key, (dimension_id, mbid) in found.items()
+            if mbid is None and mbids[key]
+        ),
+    )
+    if missing:
+        found.update(dimension_ids(conn, table, columns, missing))
+    return {key: dimension_id for key, (dimension_id, _) in found.items()}
+
+
+def write_facts(conn, rows):
+    """Insert normalized v1-shaped rows into the v2 tables in one transaction.
+
+    Dimension ids are looked up (and new names inserted) once per batch,
+    then the facts go in with plain values. Returns how many scrobbles were
+    new, like write_rows.
+    """
+    artists = {}
+    for _, artist, _, _, _, artist_mbid, *_ in rows:
+        artists[artist,] = artists.get((artist,)) or artist_mbid
+
+    epochs = {}
+
+    def epoch(archived):
+        if archived not in epochs:
+            epochs[archived] = datetime.fromisoformat(archived).timestamp()
+        return epochs[archived]
+
+    with conn:
+        artist_ids = store_dimension(conn, "dim_artist", ("name",), artists)
+
+        tracks = {}
+        albums = {}
+        for _, artist, album, track, album_mbid, _, track_mbid, *_ in rows:
+            artist_id = artist_ids[artist,]
+            tracks[artist_id, track] = tracks.get((artist_id, track)) or track_mbid
+            if album:
+                albums[artist_id, album] = albums.get((artist_id, album)) or album_mbid
+        track_ids = store_dimension(conn, "dim_track", ("artist_id", "name"), tracks)
+        album_ids = store_dimension(conn, "dim_album", ("artist_id", "name"), albums)
+
+        def fact(row):
+            timestamp, artist, album, track, _, _, _, loved, archived = row
+            artist_id = artist_ids[artist,]
+            return (
+                timestamp,
+                track_ids[artist_id, track],
+                album_ids.get((artist_id, album)),
+                loved,
+                epoch(archived),
+            )
+
+        cursor = conn.executemany(
+            """
+            INSERT OR IGNORE INTO scrobble_facts (timestamp, track_id, album_id, loved, archived_at)
+            VALUES (?, ?, ?, ?, ?)
+        """,
+            map(fact, rows),
+        )
+    return cursor.rowcount
+
+
+def migrate(conn):
+    """Convert a v1 archive to v2 in a single transaction.
+
+    Triggers on the old table (rollup and search queues) are recreated on
+    the fact table. Returns the number of scrobbles moved.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(scrobbles)")}
+    if columns & LEGACY_COLUMNS:
+        raise RuntimeError(
+            "scrobbles still has artist_tags/kid_music; run enrich_lastfm_backup.py first"
+        )
+
+    triggers = conn.execute(
+        """
+        SELECT sql FROM sqlite_master
+        WHERE type = 'trigger' AND tbl_name = 'scrobbles'
+    """
+    ).fetchall()
+
+    conn.execute("BEGIN")
+    try:
+        for statement in V2_TABLES:
+            conn.execute(statement)
+        conn.execute(
+            """
+            INSERT INTO dim_artist (name, mbid)
+            SELECT artist, MAX(NULLIF(artist_mbid, '')) FROM scrobbles GROUP BY artist
+        """
+        )
+        for table, column, condition in (
+            ("dim_track", "track", ""),
+            ("dim_album", "album", "WHERE s.album != ''"),
+        ):
+            conn.execute(
+                f"""
+                INSERT INTO {table} (artist_id, name, mbid)
+                SELECT a.id, s.{column}, MAX(NULLIF(s.{column}_mbid, ''))
+                FROM scrobbles s
+                JOIN dim_artist a ON a.name = s.artist
+                {condition}
+                GROUP BY a.id, s.{column}
+            """
+            )
+        conn.execute(
+            f"""
+            INSERT INTO scrobble_facts (timestamp, track_id, album_id, loved, archived_at)
+            SELECT s.timestamp, t.id, al.id, COALESCE(s.loved, 0),
+                   COALESCE({ARCHIVED_AT.format("s.date_archived")}, 0)
+            FROM scrobbles s
+            JOIN dim_artist a ON a.name = s.artist
+            JOIN dim_track t ON t.artist_id = a.id AND t.name = s.track
+            LEFT JOIN dim_album al ON al.artist_id = a.id AND al.name = s.album
+        """
+        )
+
+        (before,) = conn.execute("SELECT COUNT(*) FROM scrobbles").fetchone()
+        (after,) = conn.execute(f"SELECT COUNT(*) FROM {FACT_TABLE}").fetchone()
+        if before != after:
+            raise RuntimeError(f"migrated {after} of {before} scrobbles; rolled back")
+
+        conn.execute("DROP TABLE scrobbles")
+        conn.execute(COMPAT_VIEW)
+        conn.execute(COMPAT_INSERT_TRIGGER)
+        for (sql,) in triggers:
+            conn.execute(re.sub(r"\bON\s+scrobbles\b", f"ON {FACT_TABLE}", sql, 1))
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return after
+
+
+def file_size(conn, db_path: Path):
+    """Bytes on disk, with the WAL folded back into the main file first."""
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    wal_path = db_path.with_name(db_path.name + "-wal")
+    return db_path.stat().st_size + (
+        wal_path.stat().st_size if wal_path.exists() else 0
+    )
+
+
+def scrobble_bytes(conn):
+    """Bytes used by the scrobbles themselves (tables and their indexes).
+
+    Rollups and the search index are left out, since the layout change
+    doesn't touch them. None if SQLite was built without dbstat.
+    """
+    tables = ("scrobbles", "dim_artist", "dim_album", "dim_track", FACT_TABLE)
+    try:
+        (size,) = conn.execute(
+            f"""
+            SELECT SUM(pgsize) FROM dbstat
+            WHERE name IN (
+                SELECT name FROM sqlite_master
+                WHERE tbl_name IN ({", ".join("?" * len(tables))})
+                  AND type IN ('table', 'index')
+            )
+        """,
+            tables,
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return size
+
+
+def benchmark_queries(conn):
+    """Typical reads against the scrobbles table/view, for before/after timing."""
+    top_artist, latest = conn.execute(
+        """
+        SELECT (SELECT artist FROM scrobbles GROUP BY artist ORDER BY COUNT(*) DESC LIMIT 1),
+               MAX(timestamp)
+        FROM scrobbles
+    """
+    ).fetchone()
+    month = ((latest or 0) - 30 * 86400, latest or 0)
+    return {
+        "plays by top artist": (
+            "SELECT COUNT(*) FROM scrobbles WHERE artist = ?",
+            (top_artist,),
+        ),
+        "top artist's tracks": (
+            "SELECT track, COUNT(*) FROM scrobbles WHERE artist = ? GROUP BY track",
+            (top_artist,),
+        ),
+        "latest 200": (
+            "SELECT * FROM scrobbles ORDER BY timestamp DESC LIMIT 200",
+            (),
+        ),
+        "last 30 days": (
+            "SELECT artist, track FROM scrobbles WHERE timestamp BETWEEN ? AND ?",
+            month,
+        ),
+        "plays per artist": (
+            "SELECT artist, COUNT(*) FROM scrobbles GROUP BY artist",
+            (),
+        ),
+    }
+
+
+def time_queries(conn, queries, repeat: int = 3):
+    """Best-of-repeat wall time in ms for each query."""
+    timings = {}
+    for label, (sql, params) in queries.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            best = min(best, time.perf_counter() - start_time)
+        timings[label] = best * 1000
+    return timings
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Migrate the scrobble archive to the compact v2 layout"
+    )
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument(
+        "--no-backup",
+        action="store_true",
+        help="Don't copy the v1 database to <db>.v1.db first",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+    if schema_version(conn) >= SCHEMA_VERSION:
+        print(f"{args.db} is already at schema v{schema_version(conn)}")
+        return
+
+    if not args.no_backup:
+        backup_path = args.db.with_suffix(".v1.db")
+        print(f"Backing up to {backup_path}...")
+        backup = sqlite3.connect(backup_path)
+        conn.backup(backup)
+        backup.close()
+
+    size_before = file_size(conn, args.db)
+    scrobbles_before = scrobble_bytes(conn)
+    queries = benchmark_queries(conn)
+    before = time_queries(conn, queries)
+
+    start_time = time.monotonic()
+    moved = migrate(conn)
+    # Reclaim the v1 table's pages so the file actually shrinks
+    conn.execute("VACUUM")
+    print(f"Migrated {moved:,} scrobbles in {time.monotonic() - start_time:.1f}s")
+
+    size_after = file_size(conn, args.db)
+    scrobbles_after = scrobble_bytes(conn)
+    after = time_queries(conn, queries)
+    conn.close()
+
+    print(
+        f"File size: {size_before / 1e6:,.1f} MB -> {size_after / 1e6:,.1f} MB "
+        f"({size_after / size_before:.0%})"
+    )
+    if scrobbles_before and scrobbles_after:
+        print(
+            f"Scrobbles and indexes: {scrobbles_before / 1e6:,.1f} MB -> "
+            f"{scrobbles_after / 1e6:,.1f} MB ({scrobbles_after / scrobbles_before:.0%})"
+        )
+    print("Query times (best of 3):")
+    for label in queries:
+        print(f"  {label:<20} {before[label]:>8.1f}ms -> {after[label]:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
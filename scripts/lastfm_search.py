@@ -0,0 +1,218 @@
+#!/usr/bin/env -S uv run
+# /// script
+# requires-python = ">=3.11"
+# ///
+"""
+Full-text search over the artists, albums and tracks in the scrobble archive.
+
+search_items holds one row per distinct artist, album and track with its play
+count. search_fts is an FTS5 trigram index over just the item names, so
+substring matches are index lookups rather than LIKE scans, and misspellings
+still match on the trigrams they share with the real name.
+
+Like the stats rollups, new scrobbles are queued by a trigger (search_pending)
+and folded in set-wise by refresh_search(), which the archiver runs at the
+end of each run, so ingestion only pays for a cheap queue insert per row.
+
+Usage:
+    python lastfm_search.py "lucio dala"
+    python lastfm_search.py "caruso" --kind track
+"""
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+from lastfm_schema import fact_table
+
+DB_PATH = Path(__file__).parent / "lastfm_archive.db"
+# kind -> scrobbles column holding the item's name
+KINDS = {"artist": "s.artist", "album": "s.album", "track": "s.track"}
+
+
+def init_search(conn):
+    """Create the search tables and triggers.
+
+    On a database that predates the index, it's built from existing scrobbles.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_items'"
+    )
+    if cursor.fetchone() is not None:
+        return
+
+    table = fact_table(conn)
+    with conn:
+        conn.execute(
+            """
+            CREATE TABLE search_items (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                name TEXT NOT NULL,
+                plays INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (kind, artist, name)
+            )
+        """
+        )
+        conn.execute(
+            """
+            CREATE VIRTUAL TABLE search_fts USING fts5(
+                name,
+                content = 'search_items',
+                content_rowid = 'id',
+                tokenize = 'trigram'
+            )
+        """
+        )
+        # Play count bumps don't touch the indexed text, so only new rows
+        # need to reach the FTS index
+        conn.execute(
+            """
+            CREATE TRIGGER search_items_fts AFTER INSERT ON search_items
+            BEGIN
+                INSERT INTO search_fts (rowid, name) VALUES (NEW.id, NEW.name);
+            END
+        """
+        )
+        conn.execute(
+            """
+            CREATE TABLE search_pending (
+                timestamp INTEGER PRIMARY KEY
+            )
+        """
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER scrobbles_search AFTER INSERT ON {table}
+            BEGIN
+                INSERT OR IGNORE INTO search_pending (timestamp) VALUES (NEW.timestamp);
+            END
+        """
+        )
+        conn.execute(
+            f"INSERT INTO search_pending (timestamp) SELECT timestamp FROM {table}"
+        )
+    refresh_search(conn)
+
+
+def refresh_search(conn):
+    """Fold queued scrobbles into the search index. Returns how many."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM search_pending")
+    pending = cursor.fetchone()[0]
+    if not pending:
+        return 0
+
+    # CROSS JOIN keeps the queue as the outer loop, as in refresh_rollups
+    with conn:
+        for kind, column in KINDS.items():
+            conn.execute(
+                f"""
+                INSERT INTO search_items (kind, artist, name, plays)
+                SELECT ?, s.artist, {column} AS name, COUNT(*)
+                FROM search_pending p
+                CROSS JOIN scrobbles s ON s.timestamp = p.timestamp
+                WHERE {column} != ''
+                GROUP BY s.artist, name
+                ON CONFLICT (kind, artist, name) DO UPDATE SET plays = plays + excluded.plays
+            """,
+                (kind,),
+            )
+        conn.execute("DELETE FROM search_pending")
+    return pending
+
+
+def _phrase(text: str) -> str:
+    """Quote text as an FTS5 string, so punctuation isn't parsed as syntax."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _trigrams(text: str):
+    text = text.lower()
+    return sorted({text[i : i + 3] for i in range(len(text) - 2)})
+
+
+def search(conn, query: str, limit: int = 20, kind: str | None = None):
+    """Ranked (kind, artist, name, plays) matches for query.
+
+    Exact substring matches come first; if there aren't enough, items
+    sharing trigrams with the query fill the rest, which is what catches
+    misspellings. Ties are broken by play count.
+    """
+    query = query.strip()
+    if kind is not None and kind not in KINDS:
+        raise ValueError(f"kind must be one of {list(KINDS)}")
+
+    cursor = conn.cursor()
+    if len(query) < 3:
+        # Too short for trigrams; prefix match on the (much smaller) item table
+        cursor.execute(
+            """
+            SELECT kind, artist, name, plays
+            FROM search_items
+            WHERE name LIKE ? || '%' AND (? IS NULL OR kind = ?)
+            ORDER BY plays DESC
+            LIMIT ?
+        """,
+            (query, kind, kind, limit),
+        )
+        return cursor.fetchall()
+
+    exact = _phrase(query)
+    fuzzy = " OR ".join(_phrase(t) for t in _trigrams(query))
+
+    results = []
+    seen = set()
+    for expression in (exact, fuzzy):
+        cursor.execute(
+            """
+            SELECT i.id, i.kind, i.artist, i.name, i.plays
+            FROM search_fts
+            JOIN search_items i ON i.id = search_fts.rowid
+            WHERE search_fts MATCH ? AND (? IS NULL OR i.kind = ?)
+            ORDER BY search_fts.rank, i.plays DESC
+            LIMIT ?
+        """,
+            (expression, kind, kind, limit),
+        )
+        for row_id, *row in cursor.fetchall():
+            if row_id not in seen:
+                seen.add(row_id)
+                results.append(tuple(row))
+        if len(results) >= limit:
+            break
+    return results[:limit]
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Search the scrobble archive")
+    parser.add_argument("query")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--kind", choices=list(KINDS))
+    parser.add_argument("--limit", type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+    init_search(conn)
+    refresh_search(conn)
+
+    start_time = time.monotonic()
+    results = search(conn, args.query, args.limit, args.kind)
+    elapsed = time.monotonic() - start_time
+
+    for kind, artist, name, plays in results:
+        label = artist if kind == "artist" else f"{artist} - {name}"
+        print(f"{plays:>7,}  {kind:<6}  {label}")
+    print(f"{len(results)} matches in {elapsed * 1000:.1f}ms")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env -S uv run
+# /// script
+# requires-python = ">=3.11"
+# ///
+"""
+Listening stats from pre-aggregated rollups of the scrobble archive.
+
+play_rollups holds day/week/month play counts per artist, album and track.
+A trigger queues each newly inserted scrobble in rollup_pending, and
+refresh_rollups() folds just those rows in, so the archiver keeps the
+rollups current without rescanning the table. Periods are UTC; weeks
+start on Monday.
+
+Usage:
+    python lastfm_stats.py top --kind artist --year 2024
+    python lastfm_stats.py per --grain week --artist "Lucio Dalla"
+"""
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+from lastfm_schema import fact_table
+
+DB_PATH = Path(__file__).parent / "lastfm_archive.db"
+
+GRAINS = {
+    "day": "date(s.timestamp, 'unixepoch')",
+    "week": "date(s.timestamp, 'unixepoch', '-6 days', 'weekday 1')",
+    "month": "strftime('%Y-%m-01', s.timestamp, 'unixepoch')",
+}
+KINDS = {
+    "artist": ("s.artist", ""),
+    "album": ("s.album", "AND s.album != ''"),
+    "track": ("s.track", ""),
+}
+
+
+def init_rollups(conn):
+    """Create rollup tables and the insert trigger.
+
+    On a database that predates the rollups, every existing scrobble is
+    queued so the first refresh builds them from scratch.
+    """
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS play_rollups (
+            grain TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            period TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            name TEXT NOT NULL,
+            plays INTEGER NOT NULL,
+            PRIMARY KEY (grain, kind, period, artist, name)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rollup_pending (
+            timestamp INTEGER PRIMARY KEY
+        )
+    """
+    )
+
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'scrobbles_rollup'"
+    )
+    if cursor.fetchone() is None:
+        table = fact_table(conn)
+        cursor.execute(
+            f"""
+            CREATE TRIGGER scrobbles_rollup AFTER INSERT ON {table}
+            BEGIN
+                INSERT OR IGNORE INTO rollup_pending (timestamp) VALUES (NEW.timestamp);
+            END
+        """
+        )
+        cursor.execute(
+            f"INSERT OR IGNORE INTO rollup_pending (timestamp) SELECT timestamp FROM {table}"
+        )
+
+    conn.commit()
+
+
+def refresh_rollups(conn):
+    """Fold queued scrobbles into the rollups. Returns how many were folded."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM rollup_pending")
+    pending = cursor.fetchone()[0]
+    if not pending:
+        return 0
+
+    # CROSS JOIN pins the (small) queue as the outer loop; on a v2 archive
+    # the planner would otherwise start from the view's dimension tables
+    with conn:
+        for grain, period in GRAINS.items():
+            for kind, (name, condition) in KINDS.items():
+                conn.execute(
+                    f"""
+                    INSERT INTO play_rollups (grain, kind, period, artist, name, plays)
+                    SELECT ?, ?, {period} AS period, s.artist, {name} AS name, COUNT(*)
+                    FROM rollup_pending p
+                    CROSS JOIN scrobbles s ON s.timestamp = p.timestamp
+                    WHERE true {condition}
+                    GROUP BY period, s.artist, name
+                    ON CONFLICT (grain, kind, period, artist, name)
+                    DO UPDATE SET plays = plays + excluded.plays
+                """,
+                    (grain, kind),
+                )
+        conn.execute("DELETE FROM rollup_pending")
+    return pending
+
+
+def rebuild_rollups(conn):
+    """Throw the rollups away and rebuild them from every scrobble."""
+    with conn:
+        conn.execute("DELETE FROM play_rollups")
+        conn.execute(
+            f"INSERT OR IGNORE INTO rollup_pending (timestamp) SELECT timestamp FROM {fact_table(conn)}"
+        )
+    return refresh_rollups(conn)
+
+
+def total_plays(conn, since: str | None = None, until: str | None = None):
+    """Total scrobbles, optionally within [since, until) as YYYY-MM-DD."""
+    grain = "month" if _month_aligned(since) and _month_aligned(until) else "day"
+    return sum(count for _, count in plays_per(conn, grain, since=since, until=until))
+
+
+def top(
+    conn,
+    kind: str = "artist",
+    since: str | None = None,
+    until: str | None = None,
+    limit: int = 10,
+):
+    """Most played artists/albums/tracks in [since, until).
+
+    Whole-month ranges are answered from the month rollups; anything else
+    falls back to the day rollups.
+    """
+    grain = "month" if _month_aligned(since) and _month_aligned(until) else "day"
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT artist, name, SUM(plays) AS total
+        FROM play_rollups
+        WHERE grain = ? AND kind = ?
+            AND period >= COALESCE(?, '') AND period < COALESCE(?, '9999')
+        GROUP BY artist, name
+        ORDER BY total DESC
+        LIMIT ?
+    """,
+        (grain, kind, since, until, limit),
+    )
+    return cursor.fetchall()
+
+
+def plays_per(
+    conn,
+    grain: str = "week",
+    artist: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+):
+    """(period, plays) for every period, optionally for a single artist."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT period, SUM(plays)
+        FROM play_rollups
+        WHERE grain = ? AND kind = 'artist'
+            AND (? IS NULL OR artist = ?)
+            AND period >= COALESCE(?, '') AND period < COALESCE(?, '9999')
+        GROUP BY period
+        ORDER BY period
+    """,
+        (grain, artist, artist, since, until),
+    )
+    return cursor.fetchall()
+
+
+def _month_aligned(day: str | None):
+    return day is None or day.endswith("-01")
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Listening stats from rollups")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    top_parser = subparsers.add_parser("top", help="Most played artists/albums/tracks")
+    top_parser.add_argument("--kind", choices=list(KINDS), default="artist")
+    top_parser.add_argument("--year", type=int)
+    top_parser.add_argument("--limit", type=int, default=10)
+
+    per_parser = subparsers.add_parser("per", help="Plays per day/week/month")
+    per_parser.add_argument("--grain", choices=list(GRAINS), default="week")
+    per_parser.add_argument("--artist")
+    per_parser.add_argument("--year", type=int)
+
+    subparsers.add_parser("rebuild", help="Rebuild the rollups from scratch")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+    init_rollups(conn)
+    refresh_rollups(conn)
+
+    since = until = None
+    if getattr(args, "year", None):
+        since, until = f"{args.year}-01-01", f"{args.year + 1}-01-01"
+
+    start_time = time.monotonic()
+    if args.command == "top":
+        for artist, name, plays in top(conn, args.kind, since, until, args.limit):
+            label = artist if args.kind == "artist" else f"{artist} - {name}"
+            print(f"{plays:>7,}  {label}")
+    elif args.command == "per":
+        for period, plays in plays_per(conn, args.grain, args.artist, since, until):
+            print(f"{period}  {plays:>6,}")
+    elif args.command == "rebuild":
+        print(f"Rebuilt rollups from {rebuild_rollups(conn):,} scrobbles")
+    print(f"({(time.monotonic() - start_time) * 1000:.1f}ms)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
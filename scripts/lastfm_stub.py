@@ -0,0 +1,249 @@
+"""
+Tiny stand-in for the Last.fm API, for exercising the archive scripts locally.
+
+Serves a synthetic, deterministic scrobble history:
+    - user.getrecenttracks, newest first, honouring page/limit/from/to the
+      way the real API does
+    - artist.gettoptags, with stable made-up tags per artist; some artists
+      have no tags and some are "not found" (error 6), as on the real API
+
+Artist popularity follows a Zipf-like curve (a few artists get most plays),
+and so do tracks within an artist. The history is held as compact columns
+and pages are built on request, so millions of scrobbles fit comfortably.
+
+Usage:
+    python lastfm_stub.py --scrobbles 50000 --port 8765
+    LASTFM_API_URL=http://127.0.0.1:8765/2.0/ python lastfm_backup.py --workers 8
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import accumulate
+from urllib.parse import parse_qs, urlparse
+
+START_TIMESTAMP = 1_262_304_000  # 2010-01-01
+END_TIMESTAMP = 1_735_689_600  # 2025-01-01
+MAX_GAP = 600
+TRACKS_PER_ARTIST = 60
+TRACKS_PER_ALBUM = 12
+
+TAGS = [
+    "rock", "pop", "indie", "electronic", "jazz", "folk", "hip-hop",
+    "classical", "italian", "cantautori", "ambient", "soul", "punk", "metal",
+    "80s", "90s", "female vocalists", "singer-songwriter", "experimental",
+]  # fmt: skip
+# Rarer tags that trip the rules in lastfm_flags.py
+SPECIAL_TAGS = ["kids music", "lullaby", "podcast", "talk", "white noise", "sleep"]
+
+
+def zipf_weights(n: int, skew: float):
+    """Cumulative weights for ranks 1..n with P(rank) ~ 1 / rank**skew."""
+    return list(accumulate(1 / rank**skew for rank in range(1, n + 1)))
+
+
+class History:
+    """Synthetic scrobbles stored column-wise, oldest first.
+
+    Indexing returns API-shaped track dicts, built on demand.
+    """
+
+    def __init__(self, timestamps, artists, tracks):
+        self.timestamps = timestamps
+        self.artists = artists
+        self.tracks = tracks
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        artist = f"Artist {self.artists[index] + 1}"
+        track = self.tracks[index]
+        return {
+            "artist": {"name": artist, "mbid": ""},
+            "album": {
+                "#text": f"{artist} Album {track // TRACKS_PER_ALBUM + 1}",
+                "mbid": "",
+            },
+            "name": f"Track {track + 1}",
+            "mbid": "",
+            "loved": "1" if track == 0 else "0",
+            "date": {"uts": str(self.timestamps[index])},
+        }
+
+    def window(self, from_ts: int, to_ts: int):
+        """Index range [lo, hi) of scrobbles with from_ts <= timestamp <= to_ts."""
+        return bisect_left(self.timestamps, from_ts), bisect_right(
+            self.timestamps, to_ts
+        )
+
+
+def make_history(count: int, artists: int = 500, seed: int = 0, skew: float = 1.0):
+    """Build `count` scrobbles spread over 2010-2025, oldest first.
+
+    skew is the Zipf exponent for artist and track popularity; 0 is uniform.
+    """
+    rng = random.Random(seed)
+    # Keep the whole history inside the fixed span, however many rows
+    mean_gap = max(1, min(MAX_GAP // 2, (END_TIMESTAMP - START_TIMESTAMP) // count))
+    gaps = rng.choices(range(1, 2 * mean_gap), k=count)
+    timestamps = array("q", accumulate(gaps, initial=START_TIMESTAMP))[1:]
+    artist_ids = array(
+        "i",
+        rng.choices(range(artists), cum_weights=zipf_weights(artists, skew), k=count),
+    )
+    track_ids = array(
+        "h",
+        rng.choices(
+            range(TRACKS_PER_ARTIST),
+            cum_weights=zipf_weights(TRACKS_PER_ARTIST, skew),
+            k=count,
+        ),
+    )
+    return History(timestamps, artist_ids, track_ids)
+
+
+def artist_tags(name: str):
+    """Stable top tags for a stub artist, or None if it "doesn't exist"."""
+    try:
+        number = int(name.removeprefix("Artist "))
+    except ValueError:
+        return None
+    if number % 11 == 0:
+        return None
+    if number % 7 == 0:
+        return []
+
+    rng = random.Random(number)
+    names = rng.sample(TAGS, rng.randint(2, 8))
+    if number % 13 == 0:
+        names.insert(rng.randint(0, len(names)), rng.choice(SPECIAL_TAGS))
+    return [
+        {"name": tag, "count": 100 - 10 * rank, "url": ""}
+        for rank, tag in enumerate(names)
+    ]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Request handler; the server instance carries the history."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        methods = {
+            "user.getrecenttracks": self.recent_tracks,
+            "artist.gettoptags": self.top_tags,
+        }
+        handler = methods.get(params.get("method"))
+        if handler is None:
+            self.send_json(400, {"error": 3, "message": "Invalid Method"})
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests_served += 1
+        handler(params)
+
+    def recent_tracks(self, params):
+        history = self.server.history
+        lo, hi = history.window(
+            int(params.get("from", 0)), int(params.get("to", 2**63))
+        )
+
+        limit = int(params.get("limit", 50))
+        page = int(params.get("page", 1))
+        total = hi - lo
+        total_pages = max(1, -(-total // limit))
+        # Newest first: page 1 ends at hi
+        newest = hi - (page - 1) * limit
+        tracks = [
+            history[i] for i in range(newest - 1, max(lo, newest - limit) - 1, -1)
+        ]
+
+        self.send_json(
+            200,
+            {
+                "recenttracks": {
+                    "track": tracks,
+                    "@attr": {
+                        "user": params.get("user", ""),
+                        "page": str(page),
+                        "perPage": str(limit),
+                        "totalPages": str(total_pages),
+                        "total": str(total),
+                    },
+                }
+            },
+        )
+
+    def top_tags(self, params):
+        name = params.get("artist", "")
+        tags = artist_tags(name)
+        if tags is None:
+            self.send_json(
+                200,
+                {"error": 6, "message": "The artist you supplied could not be found"},
+            )
+            return
+        self.send_json(200, {"toptags": {"tag": tags, "@attr": {"artist": name}}})
+
+    def send_json(self, status: int, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(history, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+    """Start the stub in a background thread and return the server.
+
+    Use port=0 to get a free port; the bound URL is server.url.
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.history = history
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.requests_served = 0
+    server.url = f"http://{host}:{server.server_address[1]}/2.0/"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Last.fm API stub")
+    parser.add_argument("--scrobbles", type=int, default=10_000)
+    parser.add_argument("--artists", type=int, default=500)
+    parser.add_argument(
+        "--skew", type=float, default=1.0, help="Zipf exponent for artist popularity"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="Seconds of delay per request"
+    )
+    args = parser.parse_args()
+
+    history = make_history(args.scrobbles, args.artists, skew=args.skew)
+    server = serve(history, port=args.port, latency=args.latency)
+    print(f"Serving {args.scrobbles:,} scrobbles at {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,202 @@
 import sqlite3
 import logging
 import csv
-import re
+import hashlib
 import argparse
+import asyncio
+import json
+import os
 import random
-from typing import Dict, List, Any
+import re
+import time
+from typing import Dict, List, Any, Iterable, Iterator, Optional
 
 import anthropic
-import pandas as pd
+
+from inference import (
+    BACKENDS,
+    OLLAMA_MODEL,
+    Backend,
+    BackendUnavailable,
+    StatusError,
+    create_backend,
+)
+from librarian_cluster import DEFAULT_HOLDOUT, ClusterPlan, agreement, plan_clusters
 
 # Configuration constants
 DATABASE_PATH = "metadata_working.db"
-MODEL_NAME = "claude-opus-4-20250514"
+MODEL_NAME = "claude-opus-4-20250514"  # with --backend anthropic
 RAW_RESPONSES_CSV = "raw_responses.csv"
 PARSED_RESPONSES_CSV = "parsed_responses.csv"
+MAX_TOKENS = 1000
+
+# Concurrency and rate budgets for bulk runs (defaults match the API's tier 1;
+# a budget of 0 is unlimited, the default for a local --backend ollama)
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RPM = 50
+DEFAULT_ITPM = 30000
+DEFAULT_OTPM = 8000
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 2.0  # seconds, doubled per attempt
+BACKOFF_MAX = 60.0
+THROTTLE_STATUSES = (429, 529)
+RETRY_STATUSES = (500, 502, 503, 504)
+PROGRESS_INTERVAL = 10.0  # seconds between progress lines
+
+# Packing several books into one request (--pack N)
+DEFAULT_PACK_SIZE = 1
+PACK_TOKENS_PER_BOOK = 250  # max_tokens budget per book in a packed request
+PACK_ATTEMPTS = 2  # attempts per pack before its missing books go one at a time
+MAX_CATEGORIES = 3
+
+# Per-request token usage and latency, for the end-of-run cost summary
+USAGE_CSV = "usage.csv"
+# USD per million tokens for MODEL_NAME; cache writes (5 minute TTL) cost
+# 1.25x input and cache reads 0.1x, and batches are half price
+PRICE_INPUT = 15.0
+PRICE_OUTPUT = 75.0
+CACHE_WRITE_MULTIPLIER = 1.25
+CACHE_READ_MULTIPLIER = 0.1
+BATCH_DISCOUNT = 0.5
+
+# Answers already paid for, so reruns only request new, changed or failed books
+RESULTS_DB = "librarian_results.db"
+
+# Message Batches mode
+BATCH_STATE_JSON = "batch_state.json"
+BATCH_MAX_REQUESTS = 10000  # per batch; the API allows up to 100,000 / 256 MB
+BATCH_POLL_MIN = 10.0  # seconds; polling backs off up to BATCH_POLL_MAX
+BATCH_POLL_MAX = 300.0
+# One row per book, with its tags (sorted) joined into one string
 QUERY = """
 select
 	b.id,
 	b.title,
 	b.author_sort as author,
-	t.name as tags
+	(
+		select group_concat(name, ', ')
+		from (
+			select t.name
+			from books_tags_link btl
+			join tags t on btl.tag = t.id
+			where btl.book = b.id
+			order by t.name
+		)
+	) as tags
 from books b
-left join books_tags_link btl on b.id = btl.book
-left join tags t on btl.tag = t.id
+order by b.id
 """
 
-MAIN_PROMPT = """You are a world-class librarian. Respond with the top 3 most likely categories for this book (in decreasing order of generality), as well as 1-2 sentences describing the book. Your response should be in the form: CATEGORIES = ["Fiction", "Science fiction", "Dystopia"], NOTES = "This book is an eco thriller featuring feminist and anarchist themes"."""
+MAIN_PROMPT = """You are a world-class librarian. For each book, give the top 3 most likely categories (in decreasing order of generality), as well as 1-2 sentences describing the book. Books are listed one per line, each starting with its ID in square brackets, e.g. [ID 42]. Record every book with the record_categories tool, using the same IDs; never skip, merge or renumber books."""
+
+# The answer is requested as a tool call, so it comes back as JSON matching
+# this schema instead of free text
+CATEGORIZE_TOOL = {
+    "name": "record_categories",
+    "description": "Record the categories and a short description of each book.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "books": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string", "description": "The book's ID"},
+                        "categories": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "minItems": 1,
+                            "maxItems": MAX_CATEGORIES,
+                            "description": "Most general category first",
+                        },
+                        "notes": {
+                            "type": "string",
+                            "description": "1-2 sentences describing the book",
+                        },
+                    },
+                    "required": ["id", "categories", "notes"],
+                },
+            }
+        },
+        "required": ["books"],
+    },
+}
+
+# Worked examples sent ahead of every request. Together with MAIN_PROMPT and
+# the tool they form a static prefix that's marked for prompt caching, so
+# after the first request it's read from the cache at a tenth of the input
+# price. Prefixes shorter than CACHE_MIN_TOKENS aren't cached at all, so
+# there are enough examples to clear it (checked at startup).
+CACHE_MIN_TOKENS = 1024  # for Opus and Sonnet; Haiku needs 2048
+FEW_SHOT_EXAMPLES = [
+    (
+        "Title: The Dispossessed, Author: Le Guin, Ursula K., Existing tags: Fiction",
+        ["Fiction", "Science fiction", "Utopian fiction"],
+        "A physicist moves between an anarchist moon and its capitalist twin planet; a study of freedom, ownership and what utopia costs.",
+    ),
+    (
+        "Title: Sapiens: A Brief History of Humankind, Author: Harari, Yuval Noah, Existing tags: None",
+        ["Non-fiction", "History", "Anthropology"],
+        "A sweeping account of how Homo sapiens came to dominate the planet, from the cognitive revolution through agriculture, empire and science.",
+    ),
+    (
+        "Title: Il nome della rosa, Author: Eco, Umberto, Existing tags: Italian",
+        ["Fiction", "Historical fiction", "Mystery"],
+        "A Franciscan friar investigates a string of deaths in a 14th-century Italian abbey, in a novel steeped in medieval theology and semiotics.",
+    ),
+    (
+        "Title: The Very Hungry Caterpillar, Author: Carle, Eric, Existing tags: Kids",
+        ["Children's", "Picture books", "Nature"],
+        "A caterpillar eats its way through the week before becoming a butterfly; a classic picture book about counting, days and metamorphosis.",
+    ),
+    (
+        "Title: Salt, Fat, Acid, Heat, Author: Nosrat, Samin, Existing tags: Cooking, Non-fiction",
+        ["Non-fiction", "Cooking", "Culinary technique"],
+        "An illustrated guide to cooking by understanding four elements rather than following recipes, with recipes to practise on.",
+    ),
+    (
+        "Title: Maus, Author: Spiegelman, Art, Existing tags: Comics",
+        ["Non-fiction", "Graphic novels", "Holocaust memoir"],
+        "The author's father's survival of Auschwitz, told as a comic with Jews drawn as mice and Nazis as cats, alongside their strained relationship.",
+    ),
+    (
+        "Title: Ariel, Author: Plath, Sylvia, Existing tags: None",
+        ["Poetry", "American poetry", "Confessional poetry"],
+        "Plath's last poems, written in the months before her death; intense, controlled verse about motherhood, rage, illness and rebirth.",
+    ),
+    (
+        "Title: Steve Jobs, Author: Isaacson, Walter, Existing tags: Biography, Business",
+        ["Non-fiction", "Biography", "Technology industry"],
+        "An authorized biography of Apple's co-founder, drawn from interviews with Jobs and those around him, from the garage to the iPhone.",
+    ),
+    (
+        "Title: Introduction to Algorithms, Author: Cormen, Thomas H., Existing tags: Computer Science",
+        ["Non-fiction", "Computer science", "Textbooks"],
+        "A comprehensive university textbook on the design and analysis of algorithms, from sorting and graphs to dynamic programming and NP-completeness.",
+    ),
+    (
+        "Title: The Hunger Games, Author: Collins, Suzanne, Existing tags: YA",
+        ["Fiction", "Young adult", "Dystopian fiction"],
+        "A teenager volunteers for a televised fight to the death in her sister's place, and becomes the face of a rebellion against the Capitol.",
+    ),
+    (
+        "Title: It, Author: King, Stephen, Existing tags: Fiction, Horror",
+        ["Fiction", "Horror", "Coming-of-age"],
+        "Seven friends in a small Maine town face a shape-shifting evil that feeds on children, first as kids in 1958 and again as adults.",
+    ),
+    (
+        "Title: In Patagonia, Author: Chatwin, Bruce, Existing tags: Travel",
+        ["Non-fiction", "Travel writing", "South America"],
+        "A fragmentary account of the author's journey through Patagonia, weaving local history, legends and eccentric characters into the landscape.",
+    ),
+    (
+        "Title: Meditations, Author: Aurelius, Marcus, Existing tags: Philosophy, Classics",
+        ["Non-fiction", "Philosophy", "Stoicism"],
+        "The Roman emperor's private notes to himself on duty, mortality and self-discipline, a foundational text of Stoic philosophy.",
+    ),
+]
+FEW_SHOT_TOOL_USE_ID = "toolu_examples"
 
 # Set up logging
 logging.basicConfig(
@@ -34,6 +205,28 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def iter_books(db_path: str):
+    """
+    Stream book records from the SQLite database, one per book.
+
+    Args:
+        db_path: Path to the SQLite database
+
+    Yields:
+        Book records as dictionaries (tags is None for untagged books)
+    """
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        for row in conn.execute(QUERY):
+            yield dict(row)
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {e}")
+        raise
+    finally:
+        conn.close()
+
+
 def get_books_data(db_path: str) -> List[Dict[str, Any]]:
     """
     Fetch book data from the SQLite database.
@@ -44,128 +237,1257 @@ def get_books_data(db_path: str) -> List[Dict[str, Any]]:
     Returns:
         List of book records as dictionaries
     """
+    return list(iter_books(db_path))
+
+
+def few_shot_messages() -> List[Dict[str, Any]]:
+    """
+    FEW_SHOT_EXAMPLES as one listing of books and the tool call answering
+    it, with the cache breakpoint on the answer so the tool, system prompt
+    and examples are cached together.
+
+    Returns:
+        Messages to put ahead of the books being categorized; the next user
+        turn must start with few_shot_result()
+    """
+    listing = "\n".join(
+        f"[ID E{i}] {question}"
+        for i, (question, _, _) in enumerate(FEW_SHOT_EXAMPLES, 1)
+    )
+    answer = {
+        "books": [
+            {"id": f"E{i}", "categories": categories, "notes": notes}
+            for i, (_, categories, notes) in enumerate(FEW_SHOT_EXAMPLES, 1)
+        ]
+    }
+    return [
+        {"role": "user", "content": [{"type": "text", "text": listing}]},
+        {
+            "role": "assistant",
+            "content": [
+                {
+                    "type": "tool_use",
+                    "id": FEW_SHOT_TOOL_USE_ID,
+                    "name": CATEGORIZE_TOOL["name"],
+                    "input": answer,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+        },
+    ]
+
+
+def few_shot_result() -> Dict[str, Any]:
+    """The tool result block acknowledging the examples' tool call."""
+    return {
+        "type": "tool_result",
+        "tool_use_id": FEW_SHOT_TOOL_USE_ID,
+        "content": "Recorded.",
+    }
+
+
+def describe_book(book: Dict[str, Any]) -> str:
+    """The one-line description of a book that the model sees."""
+    return f"Title: {book['title']}, Author: {book['author']}, Existing tags: {book['tags']}"
+
+
+def build_request(books: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Build the messages.create arguments for one or more books, each marked
+    with its ID, with the answer forced through CATEGORIZE_TOOL.
+
+    Args:
+        books: Book dictionaries, with distinct IDs
+
+    Returns:
+        Keyword arguments for messages.create
+    """
+    text = "\n".join(f"[ID {book['id']}] {describe_book(book)}" for book in books)
+    return {
+        "model": MODEL_NAME,
+        "max_tokens": max(MAX_TOKENS, PACK_TOKENS_PER_BOOK * len(books)),
+        "temperature": 1,
+        "system": [{"type": "text", "text": MAIN_PROMPT}],
+        "tools": [CATEGORIZE_TOOL],
+        "tool_choice": {"type": "tool", "name": CATEGORIZE_TOOL["name"]},
+        "messages": few_shot_messages()
+        + [
+            {
+                "role": "user",
+                "content": [few_shot_result(), {"type": "text", "text": text}],
+            }
+        ],
+    }
+
+
+def validate_answer(item: Any) -> Optional[Dict[str, Any]]:
+    """
+    Check one book's entry in the tool input against CATEGORIZE_TOOL's schema.
+
+    Args:
+        item: One element of the tool input's "books"
+
+    Returns:
+        {"categories", "notes"} with surrounding whitespace stripped, or
+        None if the entry doesn't fit the schema
+    """
+    if not isinstance(item, dict):
+        return None
+    categories, notes = item.get("categories"), item.get("notes")
+    if (
+        not isinstance(categories, list)
+        or not 1 <= len(categories) <= MAX_CATEGORIES
+        or not all(isinstance(c, str) and c.strip() for c in categories)
+        or not isinstance(notes, str)
+    ):
+        return None
+    return {"categories": [c.strip() for c in categories], "notes": notes.strip()}
+
+
+def extract_answers(message: Any) -> Dict[str, Dict[str, Any]]:
+    """
+    Pull the valid per-book answers out of a response's tool calls.
+
+    Args:
+        message: A Messages API response
+
+    Returns:
+        {book ID (as a string): {"categories", "notes"}}; books missing or
+        failing validation are left out
+    """
+    answers = {}
+    for block in message.content:
+        if block.type != "tool_use" or block.name != CATEGORIZE_TOOL["name"]:
+            continue
+        items = block.input.get("books") if isinstance(block.input, dict) else None
+        for item in items if isinstance(items, list) else []:
+            answer = validate_answer(item)
+            if answer is not None and "id" in item:
+                answers[str(item["id"])] = answer
+    return answers
+
+
+def cached_prefix_tokens() -> int:
+    """Rough size of the cached prefix: the tool, system prompt and examples."""
+    request = build_request([])
+    request["messages"] = few_shot_messages()
+    return estimate_input_tokens(request)
+
+
+def estimate_input_tokens(request: Dict[str, Any]) -> int:
+    """Rough input token count (~4 characters per token) for budgeting."""
+    chars = len(json.dumps(request.get("tools", []))) + sum(
+        len(block["text"]) for block in request["system"]
+    )
+    for message in request["messages"]:
+        for block in message["content"]:
+            chars += len(
+                block["text"] if block["type"] == "text" else json.dumps(block)
+            )
+    return chars // 4 + 1
+
+
+class UsageTracker:
+    """
+    Token usage and latency per request, written to USAGE_CSV as they come
+    in and summed for the end-of-run cost report.
+    """
+
+    FIELDS = [
+        "id",
+        "input_tokens",
+        "cache_creation_input_tokens",
+        "cache_read_input_tokens",
+        "output_tokens",
+        "latency",
+    ]
+
+    def __init__(
+        self, csv_path: str = USAGE_CSV, batch: bool = False, priced: bool = True
+    ):
+        self.csv_path = csv_path
+        self.batch = batch
+        # False for local models, which cost nothing per token
+        self.priced = priced
+        self.totals = {field: 0 for field in self.FIELDS[1:5]}
+        self.requests = 0
+        # latency totals/counts for requests that did and didn't hit the cache
+        self.latency = {True: [0.0, 0], False: [0.0, 0]}
+
+    def record(self, book_id: Any, usage: Any, latency: Optional[float] = None) -> None:
+        """
+        Record one response's usage.
+
+        Args:
+            book_id: ID of the book the request was for
+            usage: The response's usage object
+            latency: Seconds the request took (None for batch results)
+        """
+        row = {"id": book_id, "latency": "" if latency is None else f"{latency:.3f}"}
+        for field in self.FIELDS[1:5]:
+            row[field] = getattr(usage, field, 0) or 0
+            self.totals[field] += row[field]
+        self.requests += 1
+        if latency is not None:
+            hit = row["cache_read_input_tokens"] > 0
+            self.latency[hit][0] += latency
+            self.latency[hit][1] += 1
+
+        new_file = not os.path.exists(self.csv_path)
+        with open(self.csv_path, "a", newline="", encoding="utf-8") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=self.FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def cost(self, cached: bool = True) -> float:
+        """USD for the recorded usage; cached=False prices it as if every
+        prompt token were sent uncached."""
+        totals = self.totals
+        if cached:
+            input_cost = PRICE_INPUT * (
+                totals["input_tokens"]
+                + CACHE_WRITE_MULTIPLIER * totals["cache_creation_input_tokens"]
+                + CACHE_READ_MULTIPLIER * totals["cache_read_input_tokens"]
+            )
+        else:
+            input_cost = PRICE_INPUT * (
+                totals["input_tokens"]
+                + totals["cache_creation_input_tokens"]
+                + totals["cache_read_input_tokens"]
+            )
+        total = (input_cost + PRICE_OUTPUT * totals["output_tokens"]) / 1_000_000
+        return total * (BATCH_DISCOUNT if self.batch else 1.0)
+
+    def log_summary(self) -> None:
+        """Log tokens, cost and the savings from prompt caching."""
+        if not self.requests:
+            return
+        totals = self.totals
+        prompt_tokens = (
+            totals["input_tokens"]
+            + totals["cache_creation_input_tokens"]
+            + totals["cache_read_input_tokens"]
+        )
+        logger.info(
+            f"Usage over {self.requests} requests: {prompt_tokens:,} prompt tokens "
+            f"({totals['cache_read_input_tokens'] / prompt_tokens:.0%} read from cache, "
+            f"{totals['cache_creation_input_tokens']:,} written), "
+            f"{totals['output_tokens']:,} output tokens"
+        )
+        if self.priced:
+            cost, uncached = self.cost(), self.cost(cached=False)
+            logger.info(
+                f"Cost: ${cost:.2f} (${uncached:.2f} without caching, "
+                f"{1 - cost / uncached if uncached else 0:.0%} saved)"
+            )
+        (hit_time, hits), (miss_time, misses) = self.latency[True], self.latency[False]
+        if hits and misses:
+            hit_mean, miss_mean = hit_time / hits, miss_time / misses
+            logger.info(
+                f"Latency: {hit_mean:.2f}s mean with a cache hit vs {miss_mean:.2f}s "
+                f"without ({1 - hit_mean / miss_mean:.0%} faster)"
+            )
+
+
+def resolve_model(backend: str, model: Optional[str] = None) -> str:
+    """The model a run uses: the one given, else the backend's default."""
+    return model or (MODEL_NAME if backend == "anthropic" else OLLAMA_MODEL)
+
+
+def prompt_version(model: str = MODEL_NAME) -> str:
+    """Short hash of everything that shapes an answer besides the book itself."""
+    prompt = json.dumps([model, MAIN_PROMPT, CATEGORIZE_TOOL, FEW_SHOT_EXAMPLES])
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def content_hash(book: Dict[str, Any]) -> str:
+    """Short hash of the book metadata the model sees."""
+    text = json.dumps([book["title"], book["author"], book["tags"]], default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def parse_v0_response(response: str, ok: bool) -> tuple:
+    """
+    (categories JSON, notes, error) from an answer stored before tool calls,
+    in the CATEGORIES = [...], NOTES = "..." form.
+    """
+    if not ok:
+        return None, None, response
+    categories = re.search(r"CATEGORIES\s*=\s*(\[.*?\])", response, re.DOTALL)
+    notes = re.search(r'NOTES\s*=\s*"(.*?)"', response, re.DOTALL)
     try:
-        conn = sqlite3.connect(db_path)
-        df = pd.read_sql(QUERY, conn)
-        conn.close()
-        return df.to_dict(orient="records")
-    except sqlite3.Error as e:
-        logger.error(f"Database error: {e}")
-        raise
+        parsed = json.loads(categories.group(1)) if categories else None
+    except json.JSONDecodeError:
+        parsed = None
+    if not isinstance(parsed, list):
+        # Kept for reference, but not usable as an answer
+        return None, response, "unparsed free-text answer"
+    return json.dumps(parsed), notes.group(1).strip() if notes else "", None
+
+
+class ResultsStore:
+    """
+    Validated answers in a SQLite database, keyed by book ID, content hash
+    and prompt version, so an answer is reused only while the book and prompt
+    are unchanged.
+
+    Every result is committed as it arrives, so a crash or Ctrl-C loses at
+    most the requests in flight; failures are stored too, but count as
+    unanswered. Answers taken from a cluster's representative record its
+    book ID in propagated_from, and count as answered only for clustered
+    runs.
+    """
+
+    # Bump when the table changes shape, and add a migration from the
+    # previous version; stored rows are always carried over, since they
+    # were paid for
+    SCHEMA_VERSION = 2
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            book_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            categories TEXT,  -- JSON list, NULL on failure
+            notes TEXT,
+            error TEXT,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            propagated_from INTEGER,  -- representative's book ID, if not asked
+            PRIMARY KEY (book_id, content_hash, prompt_version)
+        ) WITHOUT ROWID
+    """
+
+    def __init__(self, db_path: str = RESULTS_DB, model: str = MODEL_NAME):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        self.version = prompt_version(model)
+
+    def migrate(self) -> None:
+        """Create the table, or bring an older one up to SCHEMA_VERSION."""
+        (version,) = self.conn.execute("PRAGMA user_version").fetchone()
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'results'"
+        ).fetchone()
+        if exists and version == self.SCHEMA_VERSION:
+            return
+
+        self.conn.execute("BEGIN")
+        try:
+            if not exists:
+                self.conn.execute(self.SCHEMA)
+            else:
+                for step in range(version, self.SCHEMA_VERSION):
+                    logger.info(f"Migrating {self.db_path} from version {step}")
+                    getattr(self, f"migrate_from_v{step}")()
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    def migrate_from_v0(self) -> None:
+        """Free-text responses with an ok flag -> categories, notes and error."""
+        self.conn.execute("ALTER TABLE results RENAME TO results_v0")
+        self.conn.execute(
+            """
+            CREATE TABLE results (
+                book_id INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                categories TEXT,
+                notes TEXT,
+                error TEXT,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (book_id, content_hash, prompt_version)
+            ) WITHOUT ROWID
+        """
+        )
+        rows = self.conn.execute(
+            "SELECT book_id, content_hash, prompt_version, response, ok, updated_at "
+            "FROM results_v0"
+        ).fetchall()
+        self.conn.executemany(
+            "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (book_id, digest, version, *parse_v0_response(response, ok), updated)
+                for book_id, digest, version, response, ok, updated in rows
+            ),
+        )
+        self.conn.execute("DROP TABLE results_v0")
 
+    def migrate_from_v1(self) -> None:
+        """Add propagated_from; earlier answers all came from the model."""
+        self.conn.execute("ALTER TABLE results ADD COLUMN propagated_from INTEGER")
 
-def get_book_categorization(
-    client: anthropic.Anthropic, book: Dict[str, Any]
+    def close(self) -> None:
+        self.conn.close()
+
+    def answered(self, propagated: bool = False) -> set:
+        """
+        (book ID, content hash) of every book answered for the current prompt.
+
+        Args:
+            propagated: Count answers taken from a cluster's representative
+        """
+        rows = self.conn.execute(
+            "SELECT book_id, content_hash FROM results "
+            "WHERE prompt_version = ? AND error IS NULL "
+            "AND (? OR propagated_from IS NULL)",
+            (self.version, propagated),
+        )
+        return set(rows)
+
+    def pending(
+        self, books: Iterable[Dict[str, Any]], propagated: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Books without a successful answer for their current metadata, once
+        each.
+
+        Args:
+            books: Book dictionaries
+            propagated: Count answers taken from a cluster's representative
+                as answered; otherwise those books are asked about again
+
+        Returns:
+            The books that still need a request
+        """
+        answered = self.answered(propagated)
+        pending, seen = [], set()
+        for book in books:
+            key = (book["id"], content_hash(book))
+            if key not in answered and key not in seen:
+                pending.append(book)
+                seen.add(key)
+        return pending
+
+    def save(self, book: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """
+        Store and commit one book's result.
+
+        Args:
+            book: Dictionary containing book metadata
+            result: {"id", "categories", "notes"} or {"id", "error"}, with
+                "propagated_from" for an answer taken from a representative
+        """
+        categories = result.get("categories")
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results "
+            "(book_id, content_hash, prompt_version, categories, notes, error, "
+            "propagated_from) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                book["id"],
+                content_hash(book),
+                self.version,
+                None if categories is None else json.dumps(categories),
+                result.get("notes"),
+                result.get("error"),
+                result.get("propagated_from"),
+            ),
+        )
+        self.conn.commit()
+
+    def results(self, books: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the stored result of each book.
+
+        Args:
+            books: Book dictionaries
+
+        Yields:
+            {"id", "categories", "notes"}, with "propagated_from" (and notes
+            None) for answers taken from a representative, or {"id", "error"}
+            for books without an answer
+        """
+        query = (
+            "SELECT categories, notes, error, propagated_from FROM results "
+            "WHERE book_id = ? AND content_hash = ? AND prompt_version = ?"
+        )
+        for book in books:
+            row = self.conn.execute(
+                query, (book["id"], content_hash(book), self.version)
+            ).fetchone()
+            categories, notes, error, propagated_from = row or (
+                None,
+                None,
+                "no response",
+                None,
+            )
+            if error is not None:
+                yield {"id": book["id"], "error": error}
+                continue
+            result = {
+                "id": book["id"],
+                "categories": json.loads(categories),
+                "notes": notes,
+            }
+            if propagated_from is not None:
+                result["propagated_from"] = propagated_from
+            yield result
+
+    def rows(self, books: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Stream the stored result of each book as a parsed-CSV row."""
+        for result in self.results(books):
+            yield csv_row(result)
+
+
+def csv_row(result: Dict[str, Any]) -> Dict[str, Any]:
+    """A result as a parsed-CSV row: categories as a JSON list, errors in notes."""
+    if "error" in result:
+        return {
+            "id": result["id"],
+            "categories": "",
+            "notes": f"Error: {result['error']}",
+        }
+    if "propagated_from" in result:
+        notes = f"Categorized like book {result['propagated_from']}."
+    else:
+        notes = result["notes"]
+    return {
+        "id": result["id"],
+        "categories": json.dumps(result["categories"]),
+        "notes": notes,
+    }
+
+
+async def get_book_categorization(
+    backend: Backend,
+    book: Dict[str, Any],
+    usage: Optional[UsageTracker] = None,
 ) -> Dict[str, Any]:
     """
     Get AI categorization for a single book.
 
     Args:
-        client: Anthropic client instance
+        backend: Inference backend
         book: Dictionary containing book metadata
+        usage: Optional tracker to record token usage in
 
     Returns:
-        Dictionary with book ID and AI response
+        {"id", "categories", "notes"}, or {"id", "error"}
     """
-    text = f"Title: {book['title']}, Author: {book['author']}, Existing tags: {book['tags']}"
-
     try:
-        message = client.messages.create(
-            model=MODEL_NAME,
-            max_tokens=1000,
-            temperature=1,
-            system=MAIN_PROMPT,
-            messages=[{"role": "user", "content": [{"type": "text", "text": text}]}],
-        )
-        return {"id": book["id"], "response": message.content[0].text}
+        start_time = time.monotonic()
+        message = await backend.create(build_request([book]))
+        if usage is not None:
+            usage.record(book["id"], message.usage, time.monotonic() - start_time)
+        save_raw_response(str(book["id"]), message)
     except Exception as e:
         logger.error(f"API error for book {book['id']}: {e}")
-        return {"id": book["id"], "response": f"Error: {str(e)}"}
+        return {"id": book["id"], "error": str(e)}
+
+    answer = extract_answers(message).get(str(book["id"]))
+    if answer is None:
+        return {"id": book["id"], "error": "no valid answer in the response"}
+    return {"id": book["id"], **answer}
+
+
+class TokenBucket:
+    """Budget refilled continuously at `per_minute`, holding at most a minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, scale: float) -> None:
+        rate = self.per_minute * scale / 60
+        self.level = min(self.per_minute, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_for(self, amount: float, scale: float) -> float:
+        """Seconds until `amount` is available (0 if it already is)."""
+        amount = min(amount, self.per_minute)
+        return max(0.0, (amount - self.level) / (self.per_minute * scale / 60))
+
+
+class RateLimiter:
+    """
+    Request/input-token/output-token per-minute budgets shared by all workers.
+
+    Output tokens are reserved at max_tokens up front and the unused part is
+    refunded from the response's usage, mirroring how the API accounts for
+    them. A 429/529 pauses every worker and halves the effective rate, which
+    then creeps back up as requests succeed.
+    """
+
+    def __init__(self, rpm: float, itpm: float, otpm: float):
+        budgets = {"requests": rpm, "input_tokens": itpm, "output_tokens": otpm}
+        # Budgets of 0 aren't enforced
+        self.buckets = {
+            name: TokenBucket(per_minute)
+            for name, per_minute in budgets.items()
+            if per_minute > 0
+        }
+        self.scale = 1.0
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, cost: Dict[str, float]) -> None:
+        """Wait until every budget can cover `cost`, then take it."""
+        while True:
+            async with self.lock:
+                now = time.monotonic()
+                for bucket in self.buckets.values():
+                    bucket.refill(now, self.scale)
+                wait = max(
+                    [self.paused_until - now]
+                    + [
+                        self.buckets[name].wait_for(amount, self.scale)
+                        for name, amount in cost.items()
+                        if name in self.buckets
+                    ]
+                )
+                if wait <= 0:
+                    for name, amount in cost.items():
+                        if name in self.buckets:
+                            bucket = self.buckets[name]
+                            bucket.level -= min(amount, bucket.per_minute)
+                    return
+            await asyncio.sleep(wait)
+
+    def refund(self, name: str, amount: float) -> None:
+        if name not in self.buckets:
+            return
+        bucket = self.buckets[name]
+        bucket.level = min(bucket.per_minute, bucket.level + max(0.0, amount))
+
+    def throttle(self, delay: float) -> None:
+        """Back off everyone after a 429/529."""
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.scale = max(0.1, self.scale / 2)
+
+    def recover(self) -> None:
+        self.scale = min(1.0, self.scale + 0.05)
 
 
-def process_books(books: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+class Progress:
+    """Periodic progress log lines with throughput and ETA."""
+
+    def __init__(self, total: int, interval: float = PROGRESS_INTERVAL):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def update(self, failed: bool = False) -> None:
+        self.done += 1
+        self.failed += failed
+        now = time.monotonic()
+        if now - self.last_report >= self.interval or self.done == self.total:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now: float) -> None:
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else float("inf")
+        logger.info(
+            f"Progress: {self.done}/{self.total} books ({self.done / self.total:.0%}), "
+            f"{self.failed} failed, {rate * 60:.1f} books/min, ETA {format_duration(eta)}"
+        )
+
+
+def format_duration(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def backoff_delay(attempt: int, error: Optional[StatusError] = None) -> float:
+    """Delay before retry `attempt` (1-based): the server's retry-after if
+    given, otherwise exponential with full jitter."""
+    if error is not None and error.retry_after is not None:
+        return min(BACKOFF_MAX, error.retry_after)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+async def send_request(
+    backend: Backend,
+    request: Dict[str, Any],
+    label: str,
+    limiter: RateLimiter,
+    usage: UsageTracker,
+    max_attempts: int = MAX_ATTEMPTS,
+):
     """
-    Process all books to get categorizations and save each response immediately.
+    Send one request within the shared rate budgets, retrying throttling
+    (429/529), server errors and dropped connections.
 
     Args:
-        books: List of book dictionaries
+        backend: Inference backend
+        request: Keyword arguments for messages.create
+        label: Book ID(s) the request is for, for logs and usage
+        limiter: Shared rate limiter
+        usage: Tracker to record token usage in
+        max_attempts: Attempts before giving up
 
     Returns:
-        List of responses with book IDs and categorizations
+        (response, None) on success, or (None, the last error)
     """
-    client = anthropic.Anthropic()
-    responses = []
+    input_tokens = estimate_input_tokens(request)
+    error = None
+    for attempt in range(1, max_attempts + 1):
+        await limiter.acquire(
+            {
+                "requests": 1,
+                "input_tokens": input_tokens,
+                "output_tokens": request["max_tokens"],
+            }
+        )
+        try:
+            start_time = time.monotonic()
+            message = await backend.create(request)
+        except StatusError as e:
+            error = e
+            if e.status_code in THROTTLE_STATUSES:
+                delay = backoff_delay(attempt, e)
+                limiter.throttle(delay)
+            elif e.status_code in RETRY_STATUSES:
+                delay = backoff_delay(attempt)
+            else:
+                break
+            logger.warning(
+                f"Book {label}: HTTP {e.status_code}, retrying in {delay:.1f}s "
+                f"(attempt {attempt}/{max_attempts})"
+            )
+            await asyncio.sleep(delay)
+            continue
+        except BackendUnavailable as e:
+            error = e
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
 
-    # Start the loop, and open and close the file within the loop
-    for i, book in enumerate(books):
-        logger.info(f"Processing book {i+1}/{len(books)}: {book['title']}")
-        response = get_book_categorization(client, book)
-        responses.append(response)
+        usage.record(label, message.usage, time.monotonic() - start_time)
+        limiter.recover()
+        limiter.refund(
+            "output_tokens", request["max_tokens"] - message.usage.output_tokens
+        )
+        # Cache reads don't count towards the input tokens rate limit
+        charged = message.usage.input_tokens + (
+            message.usage.cache_creation_input_tokens or 0
+        )
+        limiter.refund("input_tokens", input_tokens - charged)
+        return message, None
+
+    logger.error(f"API error for book {label}: {error}")
+    return None, error
 
-        with open(RAW_RESPONSES_CSV, "a", newline="", encoding="utf-8") as csvfile:
-            fieldnames = ["id", "response"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writerow(response)
-            logger.info(f"Saved response for book {book['id']} to {RAW_RESPONSES_CSV}")
 
-    return responses
+async def categorize_pack(
+    backend: Backend,
+    books: List[Dict[str, Any]],
+    limiter: RateLimiter,
+    usage: UsageTracker,
+):
+    """
+    Categorize one or more books in one request.
+
+    Args:
+        backend: Inference backend
+        books: Book dictionaries, with distinct IDs
+        limiter: Shared rate limiter
+        usage: Tracker to record token usage in
+
+    Returns:
+        (answers by book ID as a string, None), or (None, the error if the
+        request failed)
+    """
+    label = ",".join(str(book["id"]) for book in books)
+    message, error = await send_request(
+        backend, build_request(books), label, limiter, usage
+    )
+    if error is not None:
+        return None, error
+    save_raw_response(label, message)
+    return extract_answers(message), None
 
 
-def parse_responses(responses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def make_packs(
+    books: List[Dict[str, Any]], pack_size: int
+) -> List[List[Dict[str, Any]]]:
     """
-    Parse the AI responses to extract categories and notes.
+    Group books into packs of up to pack_size, never putting the same book
+    ID twice in one pack.
 
     Args:
-        responses: List of response dictionaries with book IDs and API responses
+        books: List of book dictionaries
+        pack_size: Maximum books per pack
 
     Returns:
-        List of dictionaries with book IDs, categories, and notes
+        List of packs
     """
-    parsed_data = []
+    packs: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    ids = set()
+    for book in books:
+        if len(current) == pack_size or book["id"] in ids:
+            packs.append(current)
+            current, ids = [], set()
+        current.append(book)
+        ids.add(book["id"])
+    if current:
+        packs.append(current)
+    return packs
 
-    for response in responses:
-        book_id = response["id"]
-        response_text = response["response"]
 
-        # Initialize default values
-        categories = []
-        notes = ""
+def save_raw_response(label: str, message: Any) -> None:
+    """
+    Append what the model returned, before any validation, to
+    RAW_RESPONSES_CSV: tool call inputs as JSON, and any text as is.
 
-        try:
-            # Extract categories using regex
-            categories_match = re.search(
-                r"CATEGORIES\s*=\s*(\[.*?\])", response_text, re.DOTALL
-            )
-            if categories_match:
-                categories_str = categories_match.group(1)
-                # Clean up and convert to string representation
-                categories = categories_str.replace("\n", " ").strip()
-
-            # Extract notes using regex
-            notes_match = re.search(r'NOTES\s*=\s*"(.*?)"', response_text, re.DOTALL)
-            if notes_match:
-                notes = notes_match.group(1).replace("\n", " ").strip()
-
-            parsed_data.append(
-                {"id": book_id, "categories": categories, "notes": notes}
+    Args:
+        label: The request's book IDs, comma-separated
+        message: The response
+    """
+    parts = []
+    for block in message.content:
+        if block.type == "tool_use":
+            parts.append(json.dumps(block.input))
+        elif block.type == "text":
+            parts.append(block.text)
+    with open(RAW_RESPONSES_CSV, "a", newline="", encoding="utf-8") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=["id", "response"])
+        writer.writerow({"id": label, "response": "\n".join(parts)})
+
+
+async def categorize_books(
+    backend: Backend,
+    books: List[Dict[str, Any]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    limiter: Optional[RateLimiter] = None,
+    usage: Optional[UsageTracker] = None,
+    pack_size: int = DEFAULT_PACK_SIZE,
+    store: Optional[ResultsStore] = None,
+) -> None:
+    """
+    Categorize books on a pool of async workers, validating and saving each
+    result as it arrives.
+
+    Books go pack_size to a request. Books missing from the answer or
+    failing validation are requeued: a pack is retried for up to
+    PACK_ATTEMPTS tries, then its remaining books one at a time, each again
+    for up to PACK_ATTEMPTS tries before the book is recorded as failed.
+
+    Args:
+        backend: Inference backend (with its own retries disabled)
+        books: List of book dictionaries
+        concurrency: Number of requests in flight at once
+        limiter: Shared rate limiter (default: the DEFAULT_* budgets)
+        usage: Tracker to record token usage in
+        pack_size: Books per request
+        store: Results store to commit each result to
+    """
+    limiter = limiter or RateLimiter(DEFAULT_RPM, DEFAULT_ITPM, DEFAULT_OTPM)
+    usage = usage or UsageTracker()
+    queue: asyncio.Queue = asyncio.Queue()
+    for pack in make_packs(books, max(1, pack_size)):
+        queue.put_nowait((1, pack))
+    progress = Progress(len(books))
+
+    def finish(book: Dict[str, Any], result: Dict[str, Any]) -> None:
+        if store is not None:
+            store.save(book, result)
+        progress.update(failed="error" in result)
+
+    async def worker():
+        while True:
+            attempt, pack = await queue.get()
+            try:
+                answers, error = await categorize_pack(backend, pack, limiter, usage)
+                if error is not None:
+                    if len(pack) > 1:
+                        for book in pack:
+                            queue.put_nowait((1, [book]))
+                    else:
+                        finish(pack[0], {"id": pack[0]["id"], "error": str(error)})
+                    continue
+
+                missing = []
+                for book in pack:
+                    answer = answers.get(str(book["id"]))
+                    if answer is None:
+                        missing.append(book)
+                    else:
+                        finish(book, {"id": book["id"], **answer})
+                if not missing:
+                    continue
+
+                logger.warning(
+                    f"{len(missing)} of {len(pack)} books missing or invalid "
+                    f"in the answer (attempt {attempt}/{PACK_ATTEMPTS})"
+                )
+                if attempt < PACK_ATTEMPTS:
+                    queue.put_nowait((attempt + 1, missing))
+                elif len(pack) > 1:
+                    for book in missing:
+                        queue.put_nowait((1, [book]))
+                else:
+                    finish(
+                        pack[0],
+                        {"id": pack[0]["id"], "error": "no valid answer"},
+                    )
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+    # Workers only stop by raising, so stop early if one does
+    done = asyncio.ensure_future(queue.join())
+    await asyncio.wait([done, *workers], return_when=asyncio.FIRST_COMPLETED)
+    for task in [done, *workers]:
+        task.cancel()
+    for task in workers:
+        if task.done() and not task.cancelled() and task.exception():
+            raise task.exception()
+
+
+def batch_custom_id(book: Dict[str, Any]) -> str:
+    """Per-request ID within a batch, carrying the book ID and content hash."""
+    return f"book-{book['id']}-{content_hash(book)}"
+
+
+def load_batch_state(path: str) -> Optional[Dict[str, Any]]:
+    """Load the persisted batch job, or None if there isn't one."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_batch_state(state: Dict[str, Any], path: str) -> None:
+    """Persist the batch job atomically, so a crash can't leave half a file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def submit_batches(
+    client: anthropic.Anthropic,
+    books: List[Dict[str, Any]],
+    state: Dict[str, Any],
+    state_path: str,
+    model: str = MODEL_NAME,
+) -> None:
+    """
+    Submit every book not yet in a batch, BATCH_MAX_REQUESTS per batch.
+
+    The state is saved after each batch is created, so a restart resumes
+    submission instead of paying for the same books twice.
+
+    Args:
+        client: Anthropic client instance
+        books: List of book dictionaries
+        state: Batch job state, updated in place
+        state_path: Where to persist the state
+        model: Model to request
+    """
+    submitted = {
+        custom_id for batch in state["batches"] for custom_id in batch["custom_ids"]
+    }
+    pending = {
+        batch_custom_id(book): book
+        for book in books
+        if batch_custom_id(book) not in submitted
+    }
+    pending = list(pending.items())
+
+    for start in range(0, len(pending), BATCH_MAX_REQUESTS):
+        chunk = pending[start : start + BATCH_MAX_REQUESTS]
+        batch = client.messages.batches.create(
+            requests=[
+                {
+                    "custom_id": custom_id,
+                    "params": {**build_request([book]), "model": model},
+                }
+                for custom_id, book in chunk
+            ]
+        )
+        state["batches"].append(
+            {
+                "id": batch.id,
+                "custom_ids": [custom_id for custom_id, _ in chunk],
+                "collected": False,
+            }
+        )
+        save_batch_state(state, state_path)
+        logger.info(f"Submitted batch {batch.id} with {len(chunk)} books")
+
+
+def wait_for_batches(client: anthropic.Anthropic, state: Dict[str, Any]) -> None:
+    """
+    Poll until every batch has ended.
+
+    Polling starts at BATCH_POLL_MIN and backs off to BATCH_POLL_MAX while
+    nothing changes, since batches can take up to a day.
+
+    Args:
+        client: Anthropic client instance
+        state: Batch job state
+    """
+    delay = BATCH_POLL_MIN
+    last_counts = None
+    while True:
+        counts = {"processing": 0, "succeeded": 0, "errored": 0, "other": 0}
+        ended = 0
+        for entry in state["batches"]:
+            batch = client.messages.batches.retrieve(entry["id"])
+            request_counts = batch.request_counts
+            counts["processing"] += request_counts.processing
+            counts["succeeded"] += request_counts.succeeded
+            counts["errored"] += request_counts.errored
+            counts["other"] += request_counts.canceled + request_counts.expired
+            ended += batch.processing_status == "ended"
+
+        logger.info(
+            f"Batches: {ended}/{len(state['batches'])} ended; "
+            f"{counts['succeeded']} succeeded, {counts['errored']} errored, "
+            f"{counts['processing']} processing"
+        )
+        if ended == len(state["batches"]):
+            return
+
+        delay = (
+            BATCH_POLL_MIN if counts != last_counts else min(BATCH_POLL_MAX, delay * 2)
+        )
+        last_counts = counts
+        time.sleep(delay)
+
+
+def iter_batch_results(
+    client: anthropic.Anthropic,
+    batch_id: str,
+    usage: Optional[UsageTracker] = None,
+):
+    """
+    Stream one ended batch's results.
+
+    Args:
+        client: Anthropic client instance
+        batch_id: ID of an ended batch
+        usage: Optional tracker to record token usage in
+
+    Yields:
+        (custom ID, result in the same shape as get_book_categorization's)
+    """
+    for entry in client.messages.batches.results(batch_id):
+        book_id = int(entry.custom_id.split("-")[1])
+        result = entry.result
+        if result.type == "succeeded":
+            if usage is not None:
+                usage.record(book_id, result.message.usage)
+            save_raw_response(str(book_id), result.message)
+            answer = extract_answers(result.message).get(str(book_id))
+            if answer is None:
+                yield entry.custom_id, {"id": book_id, "error": "no valid answer"}
+            else:
+                yield entry.custom_id, {"id": book_id, **answer}
+        elif result.type == "errored":
+            yield entry.custom_id, {"id": book_id, "error": result.error.error.message}
+        else:
+            yield entry.custom_id, {"id": book_id, "error": f"request {result.type}"}
+
+
+def process_books_batch(
+    books: List[Dict[str, Any]],
+    state_path: str = BATCH_STATE_JSON,
+    results_path: str = RESULTS_DB,
+    model: str = MODEL_NAME,
+) -> None:
+    """
+    Categorize books through the Message Batches API.
+
+    Batch IDs are persisted in state_path, so rerunning after a crash or
+    Ctrl-C picks the same job back up: unsubmitted books are submitted,
+    and finished batches are collected rather than paid for again. Results
+    are saved to the results store (and RAW_RESPONSES_CSV) once per batch,
+    and the state file is removed when the whole job has been collected.
+    Books already answered in the store aren't submitted again; books whose
+    answer is missing or invalid are left for the next run.
+
+    Args:
+        books: List of book dictionaries
+        state_path: Where to persist the batch job
+        results_path: Results store database
+        model: Model to request
+    """
+    client = anthropic.Anthropic()
+    store = ResultsStore(results_path, model)
+    state = load_batch_state(state_path)
+    if state is None:
+        state = {"batches": []}
+    else:
+        logger.info(f"Resuming batch job with {len(state['batches'])} batches")
+
+    try:
+        pending = store.pending(books)
+        logger.info(f"{len(books) - len(pending)} books already answered")
+        if pending or state["batches"]:
+            submit_batches(client, pending, state, state_path, model)
+            wait_for_batches(client, state)
+
+        by_custom_id = {batch_custom_id(book): book for book in books}
+        usage = UsageTracker(batch=True)
+        for entry in state["batches"]:
+            # Batches collected on an earlier run are already in the store,
+            # USAGE_CSV and RAW_RESPONSES_CSV
+            if entry["collected"]:
+                continue
+            for custom_id, result in iter_batch_results(client, entry["id"], usage):
+                if custom_id in by_custom_id:
+                    store.save(by_custom_id[custom_id], result)
+            entry["collected"] = True
+            save_batch_state(state, state_path)
+            logger.info(f"Collected results of batch {entry['id']}")
+
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        usage.log_summary()
+    finally:
+        store.close()
+
+
+def process_books(
+    books: List[Dict[str, Any]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rpm: float = DEFAULT_RPM,
+    itpm: float = DEFAULT_ITPM,
+    otpm: float = DEFAULT_OTPM,
+    pack_size: int = DEFAULT_PACK_SIZE,
+    results_path: str = RESULTS_DB,
+    backend: str = "anthropic",
+    model: Optional[str] = None,
+    cluster: Optional[float] = None,
+    holdout: float = DEFAULT_HOLDOUT,
+) -> None:
+    """
+    Process all books to get categorizations and save each result immediately.
+
+    Books already answered in the results store for their current metadata
+    and prompt are skipped, so an interrupted run picks up where it stopped.
+    With cluster set, only one book per cluster of similar books is asked
+    about (see librarian_cluster.py) and the rest take its answer.
+
+    Args:
+        books: List of book dictionaries
+        concurrency: Number of requests in flight at once
+        rpm: Requests per minute budget
+        itpm: Input tokens per minute budget
+        otpm: Output tokens per minute budget
+        pack_size: Books per request
+        results_path: Results store database
+        backend: One of inference.BACKENDS
+        model: Model to use (default: MODEL_NAME, or Ollama's default model)
+        cluster: Similarity threshold for clustering, or None to ask about
+            every book
+        holdout: Fraction of clustered books to ask about anyway, to
+            measure agreement
+    """
+    model = resolve_model(backend, model)
+    store = ResultsStore(results_path, model)
+    try:
+        pending = store.pending(books, propagated=cluster is not None)
+        logger.info(
+            f"{len(books) - len(pending)} books already answered; categorizing "
+            f"{len(pending)} with {model} on {backend}, {pack_size} per request, "
+            f"with {concurrency} workers ({rpm:g} RPM, {itpm:g} ITPM, {otpm:g} OTPM)"
+        )
+        if not pending:
+            return
+        plan = None
+        if cluster is not None:
+            plan = plan_clusters(pending, cluster, holdout)
+            saved = plan.propagated()
+            logger.info(
+                f"Clustered {len(pending)} books around {len(plan.representatives)} "
+                f"representatives at similarity {cluster:g}; asking about "
+                f"{len(plan.to_ask())} ({len(plan.holdout)} held out), saving "
+                f"{saved} answers ({saved / len(pending):.0%})"
             )
-        except Exception as e:
-            logger.error(f"Error parsing response for book {book_id}: {e}")
-            parsed_data.append(
-                {"id": book_id, "categories": "", "notes": f"Error parsing: {str(e)}"}
+            pending = plan.to_ask()
+        limiter = RateLimiter(rpm, itpm, otpm)
+        usage = UsageTracker(priced=backend == "anthropic")
+
+        async def run():
+            async with create_backend(backend, model, concurrency) as client:
+                await categorize_books(
+                    client, pending, concurrency, limiter, usage, pack_size, store
+                )
+
+        asyncio.run(run())
+        usage.log_summary()
+        if plan is not None:
+            propagate_answers(store, plan)
+    finally:
+        store.close()
+
+
+def propagate_answers(store: ResultsStore, plan: ClusterPlan) -> None:
+    """
+    Store each representative's answer for the rest of its cluster, and log
+    how well the held-out books' answers agree with their representatives'.
+
+    Propagated answers keep the categories but not the notes, which were
+    written about the representative. Clusters whose representative wasn't
+    answered stay pending.
+
+    Args:
+        store: Results store the representatives were answered into
+        plan: The cluster plan the run used
+    """
+    answers = {
+        result["id"]: result
+        for result in store.results(plan.representatives)
+        if "error" not in result
+    }
+    propagated = 0
+    for representative_id, members in plan.members.items():
+        answer = answers.get(representative_id)
+        if answer is None:
+            continue
+        for book, _ in members:
+            store.save(
+                book,
+                {
+                    "id": book["id"],
+                    "categories": answer["categories"],
+                    "propagated_from": representative_id,
+                },
             )
+            propagated += 1
 
-    return parsed_data
+    held_out = {
+        book["id"]: representative_id for book, representative_id in plan.holdout
+    }
+    pairs = [
+        (result["categories"], answers[held_out[result["id"]]]["categories"])
+        for result in store.results(book for book, _ in plan.holdout)
+        if "error" not in result and held_out[result["id"]] in answers
+    ]
+    score = agreement(pairs)
+    logger.info(
+        f"Propagated answers to {propagated} books; on {score['books']} held-out "
+        f"books they agree with the model's own at {score['jaccard']:.0%} mean "
+        f"overlap ({score['first']:.0%} same first category, "
+        f"{score['exact']:.0%} identical)"
+    )
 
 
 def save_parsed_responses_to_csv(
-    parsed_data: List[Dict[str, Any]], csv_path: str
+    parsed_data: Iterable[Dict[str, Any]], csv_path: str
 ) -> None:
     """
-    Save parsed responses to a CSV file.
+    Save parsed responses to a CSV file, row by row.
 
     Args:
-        parsed_data: List of dictionaries with book IDs, categories, and notes
+        parsed_data: Dictionaries with book IDs, categories, and notes
         csv_path: Path to save the CSV file
     """
     try:
@@ -188,7 +1510,85 @@ def parse_args():
     parser.add_argument(
         "--test-single", action="store_true", help="Test with a single random book"
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Requests in flight at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        help=f"Requests per minute budget, 0 for none (default: {DEFAULT_RPM:g}, "
+        "none with --backend ollama)",
+    )
+    parser.add_argument(
+        "--itpm",
+        type=float,
+        help=f"Input tokens per minute budget (default: {DEFAULT_ITPM:g})",
+    )
+    parser.add_argument(
+        "--otpm",
+        type=float,
+        help=f"Output tokens per minute budget (default: {DEFAULT_OTPM:g})",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="anthropic",
+        help="Where to run the model; ollama talks to $OLLAMA_URL (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--model",
+        help=f"Model to use (default: {MODEL_NAME}, or {OLLAMA_MODEL} with ollama)",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Use the Message Batches API (cheaper, results within 24h; resumable)",
+    )
+    parser.add_argument(
+        "--pack",
+        type=int,
+        default=DEFAULT_PACK_SIZE,
+        help="Books per request; higher is cheaper but may be less accurate "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--results-db",
+        default=RESULTS_DB,
+        help="Stored answers; books answered here are skipped (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cluster",
+        type=float,
+        metavar="THRESHOLD",
+        help="Ask about one book per cluster of books at least this similar "
+        "(0-1, e.g. 0.9) and give the rest its answer",
+    )
+    parser.add_argument(
+        "--holdout",
+        type=float,
+        default=DEFAULT_HOLDOUT,
+        help="Fraction of clustered books to ask about anyway, to measure "
+        "agreement (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    if args.batch and args.backend != "anthropic":
+        parser.error("--batch needs --backend anthropic")
+    if args.batch and args.cluster is not None:
+        parser.error("--cluster isn't supported with --batch")
+
+    # API budgets don't apply to a local model unless asked for
+    local = args.backend != "anthropic"
+    for name, default in (
+        ("rpm", DEFAULT_RPM),
+        ("itpm", DEFAULT_ITPM),
+        ("otpm", DEFAULT_OTPM),
+    ):
+        if getattr(args, name) is None:
+            setattr(args, name, 0 if local else default)
+    return args
 
 
 def main():
@@ -198,6 +1598,12 @@ def main():
         logger.info("Starting book categorization process")
         books = get_books_data(DATABASE_PATH)
         logger.info(f"Retrieved {len(books)} books from database")
+        model = resolve_model(args.backend, args.model)
+        if args.backend == "anthropic" and cached_prefix_tokens() < CACHE_MIN_TOKENS:
+            logger.warning(
+                f"The cached prefix is only ~{cached_prefix_tokens()} tokens, under the "
+                f"{CACHE_MIN_TOKENS}-token minimum; prompt caching won't apply"
+            )
 
         if args.test_single:
             # Select a random book for testing
@@ -207,27 +1613,46 @@ def main():
             )
 
             # Process just this one book
-            client = anthropic.Anthropic()
-            response = get_book_categorization(client, test_book)
-            responses = [response]
+            async def run():
+                async with create_backend(args.backend, model) as client:
+                    return await get_book_categorization(client, test_book, usage)
 
-            # Print the response for immediate feedback
-            logger.info(f"Response for test book:\n{response['response']}")
+            usage = UsageTracker(priced=args.backend == "anthropic")
+            result = asyncio.run(run())
+            usage.log_summary()
 
-        else:
-            # Process all books (CSV is written inside this function now)
-            responses = process_books(books)
+            # Print the result for immediate feedback
+            logger.info(f"Result for test book:\n{json.dumps(result, indent=2)}")
+            save_parsed_responses_to_csv([csv_row(result)], PARSED_RESPONSES_CSV)
+            return
 
-        # Parse responses and save to CSV
-        parsed_data = parse_responses(responses)
-        save_parsed_responses_to_csv(parsed_data, PARSED_RESPONSES_CSV)
+        if args.batch:
+            process_books_batch(books, results_path=args.results_db, model=model)
+        else:
+            process_books(
+                books,
+                args.concurrency,
+                args.rpm,
+                args.itpm,
+                args.otpm,
+                args.pack,
+                args.results_db,
+                args.backend,
+                model,
+                args.cluster,
+                args.holdout,
+            )
 
-        logger.info(f"Completed processing {len(responses)} books")
+        # Stream the stored results, old and new, to CSV
+        store = ResultsStore(args.results_db, model)
+        try:
+            save_parsed_responses_to_csv(store.rows(books), PARSED_RESPONSES_CSV)
+        finally:
+            store.close()
 
-        return responses
+        logger.info(f"Completed processing {len(books)} books")
     except Exception as e:
         logger.error(f"Error in main execution: {e}")
-        return []
 
 
 if __name__ == "__main__":
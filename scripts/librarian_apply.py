@@ -0,0 +1,458 @@
+"""
+Write librarian.py's answers back into the Calibre metadata database.
+
+Each answered book gets its categories added as tags (existing tags are
+kept; tag names match case-insensitively, as in Calibre) and its notes
+written to a custom column. Books that took their categories from a cluster
+representative (librarian.py --cluster) get the tags only. Changed books
+get a new last modified time and are marked dirty, so Calibre rewrites
+their metadata.opf backups. Everything goes in one transaction, and a
+snapshot of the database is taken first so the whole apply can be undone.
+
+Close Calibre before applying: it caches metadata and won't see, or may
+overwrite, changes made underneath it. The notes column has to exist
+already; create it in Calibre as a "Long text" (or single-value "Text")
+column with the lookup name given by --notes-column.
+
+Usage:
+    python librarian_apply.py --dry-run     # show what would change
+    python librarian_apply.py               # snapshot, then apply
+    python librarian_apply.py --restore metadata_working.before-librarian-20250101-120000.db
+"""
+
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from librarian import (
+    DATABASE_PATH,
+    MODEL_NAME,
+    RESULTS_DB,
+    ResultsStore,
+    get_books_data,
+)
+
+NOTES_COLUMN = "librarian_notes"
+# Leading articles Calibre moves to the end of a title's sort form (its
+# default for English)
+TITLE_SORT_ARTICLES = re.compile(r"^(A|The|An)\s+", re.IGNORECASE)
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def load_answers(
+    db_path: str, results_path: str, model: str = MODEL_NAME
+) -> List[Dict[str, Any]]:
+    """
+    Stored answers for the books as they currently are in the database.
+
+    Args:
+        db_path: Calibre metadata database
+        results_path: librarian.py's results store
+        model: Model whose answers to use
+
+    Returns:
+        {"id", "categories", "notes"} for every answered book, with
+        "propagated_from" for answers taken from a cluster representative
+    """
+    books = get_books_data(db_path)
+    store = ResultsStore(results_path, model)
+    try:
+        return [result for result in store.results(books) if "error" not in result]
+    finally:
+        store.close()
+
+
+def title_sort(title: Optional[str]) -> Optional[str]:
+    """A title's sort form as Calibre makes it, e.g. "Hobbit, The"."""
+    if not title:
+        return title
+    title = title.strip()
+    match = TITLE_SORT_ARTICLES.match(title)
+    if match is None:
+        return title
+    return f"{title[match.end():]}, {match.group(1)}"
+
+
+def register_calibre_functions(conn: sqlite3.Connection) -> None:
+    """
+    Define the SQL functions Calibre's triggers call.
+
+    Calibre registers these on its own connections, and SQLite resolves
+    them when a trigger is prepared, so without them any write to books
+    fails with "no such function", even one the trigger wouldn't act on.
+    """
+    conn.create_function("title_sort", 1, title_sort, deterministic=True)
+    conn.create_function("uuid4", 0, lambda: str(uuid.uuid4()))
+
+
+# (value table, link table); the link table is None when the value table
+# has a book column, as for long text columns
+NotesColumn = Tuple[str, Optional[str]]
+
+
+def notes_table(conn: sqlite3.Connection, label: str) -> Optional[NotesColumn]:
+    """
+    Tables holding the custom column with lookup name label.
+
+    Long text columns keep one (book, value) row per book. Text columns are
+    normalized: each distinct value is stored once, and books link to it
+    through books_custom_column_N_link.
+
+    Args:
+        conn: Connection to the Calibre database
+        label: The column's lookup name (without the leading #)
+
+    Returns:
+        The column's tables, or None if there's no such single-value text
+        column
+    """
+    has_columns = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'custom_columns'"
+    ).fetchone()
+    if not has_columns:
+        return None
+    row = conn.execute(
+        "SELECT id, normalized FROM custom_columns "
+        "WHERE label = ? AND datatype IN ('comments', 'text') AND NOT is_multiple",
+        (label,),
+    ).fetchone()
+    if not row:
+        return None
+    column_id, normalized = row
+    link = f"books_custom_column_{column_id}_link" if normalized else None
+    return f"custom_column_{column_id}", link
+
+
+def read_notes(conn: sqlite3.Connection, column: NotesColumn) -> Dict[int, str]:
+    """Book ID -> the notes column's value, for books that have one."""
+    table, link = column
+    if link is None:
+        return dict(conn.execute(f"SELECT book, value FROM {table}"))
+    return dict(
+        conn.execute(
+            f"SELECT link.book, value.value FROM {link} AS link "
+            f"JOIN {table} AS value ON value.id = link.value"
+        )
+    )
+
+
+def write_notes(
+    conn: sqlite3.Connection, column: NotesColumn, notes: List[Tuple[int, str]]
+) -> None:
+    """
+    Replace the notes column's value for each (book ID, notes).
+
+    Values no book links to any more are deleted, as Calibre does.
+    """
+    table, link = column
+    books = [(book,) for book, _ in notes]
+    if link is None:
+        # Calibre's single-value columns have one row per book
+        conn.executemany(f"DELETE FROM {table} WHERE book = ?", books)
+        conn.executemany(f"INSERT INTO {table} (book, value) VALUES (?, ?)", notes)
+        return
+
+    conn.executemany(
+        f"INSERT OR IGNORE INTO {table} (value) VALUES (?)",
+        [(value,) for _, value in notes],
+    )
+    conn.executemany(f"DELETE FROM {link} WHERE book = ?", books)
+    conn.executemany(
+        f"INSERT INTO {link} (book, value) "
+        f"SELECT ?, id FROM {table} WHERE value = ?",
+        notes,
+    )
+    conn.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT value FROM {link})")
+
+
+def plan_changes(
+    conn: sqlite3.Connection,
+    answers: List[Dict[str, Any]],
+    column: Optional[NotesColumn],
+) -> List[Dict[str, Any]]:
+    """
+    Work out what applying answers would change.
+
+    Args:
+        conn: Connection to the Calibre database
+        answers: Results from load_answers
+        column: Notes column from notes_table, or None to leave notes alone
+
+    Returns:
+        One {"id", "title", "add_tags", "old_notes", "new_notes"} per book
+        with something to change; add_tags are the categories the book
+        doesn't have yet, and the notes are None when unchanged
+    """
+    titles = dict(conn.execute("SELECT id, title FROM books"))
+    tag_names = {
+        tag_id: name for tag_id, name in conn.execute("SELECT id, name FROM tags")
+    }
+    book_tags: Dict[int, set] = {}
+    for book_id, tag_id in conn.execute("SELECT book, tag FROM books_tags_link"):
+        book_tags.setdefault(book_id, set()).add(tag_names[tag_id].lower())
+    notes = read_notes(conn, column) if column else {}
+
+    changes = []
+    for answer in answers:
+        book_id = answer["id"]
+        if book_id not in titles:
+            continue
+        existing = book_tags.get(book_id, set())
+        add_tags = []
+        for category in answer["categories"]:
+            if category.lower() not in existing:
+                add_tags.append(category)
+                existing.add(category.lower())
+        old_notes = notes.get(book_id)
+        # A propagated answer's notes were written about another book
+        notes_changed = (
+            column is not None
+            and "propagated_from" not in answer
+            and old_notes != answer["notes"]
+        )
+        if add_tags or notes_changed:
+            changes.append(
+                {
+                    "id": book_id,
+                    "title": titles[book_id],
+                    "add_tags": add_tags,
+                    "old_notes": old_notes if notes_changed else None,
+                    "new_notes": answer["notes"] if notes_changed else None,
+                }
+            )
+    return changes
+
+
+def print_diff(changes: List[Dict[str, Any]]) -> None:
+    """Print each book's changes, then a summary."""
+    for change in changes:
+        print(f"Book {change['id']}: {change['title']}")
+        for tag in change["add_tags"]:
+            print(f"    + tag {tag}")
+        if change["new_notes"] is not None:
+            if change["old_notes"] is not None:
+                print(f"    - notes {change['old_notes']}")
+            print(f"    + notes {change['new_notes']}")
+
+    tags = sum(len(change["add_tags"]) for change in changes)
+    notes = sum(change["new_notes"] is not None for change in changes)
+    print(f"{len(changes)} books to change: {tags} tags to add, {notes} notes to write")
+
+
+def apply_changes(
+    conn: sqlite3.Connection,
+    changes: List[Dict[str, Any]],
+    column: Optional[NotesColumn],
+) -> None:
+    """
+    Apply planned changes in a single transaction.
+
+    New tag names are inserted first, then every link and note in bulk with
+    executemany. Changed books get a new last_modified and are queued in
+    metadata_dirtied, where Calibre looks for books whose metadata.opf needs
+    rewriting. Any error rolls the whole apply back.
+
+    Args:
+        conn: Connection to the Calibre database
+        changes: Changes from plan_changes
+        column: Notes column from notes_table, or None to leave notes alone
+    """
+    register_calibre_functions(conn)
+    conn.isolation_level = None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        tag_ids = {
+            name.lower(): tag_id
+            for tag_id, name in conn.execute("SELECT id, name FROM tags")
+        }
+        new_tags = {
+            tag.lower(): tag
+            for change in changes
+            for tag in change["add_tags"]
+            if tag.lower() not in tag_ids
+        }
+        conn.executemany(
+            "INSERT INTO tags (name) VALUES (?)", [(tag,) for tag in new_tags.values()]
+        )
+        tag_ids.update(
+            (name.lower(), tag_id)
+            for tag_id, name in conn.execute("SELECT id, name FROM tags")
+        )
+
+        conn.executemany(
+            "INSERT OR IGNORE INTO books_tags_link (book, tag) VALUES (?, ?)",
+            [
+                (change["id"], tag_ids[tag.lower()])
+                for change in changes
+                for tag in change["add_tags"]
+            ],
+        )
+        if column:
+            write_notes(
+                conn,
+                column,
+                [
+                    (change["id"], change["new_notes"])
+                    for change in changes
+                    if change["new_notes"] is not None
+                ],
+            )
+
+        # Calibre stores timestamps as UTC ISO strings with an offset
+        now = datetime.now(timezone.utc).isoformat(sep=" ")
+        books = [(change["id"],) for change in changes]
+        conn.executemany(
+            "UPDATE books SET last_modified = ? WHERE id = ?",
+            [(now, book) for (book,) in books],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO metadata_dirtied (book) VALUES (?)", books
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def snapshot(conn: sqlite3.Connection, db_path: str) -> str:
+    """
+    Copy the database next to itself before applying.
+
+    Args:
+        conn: Connection to the Calibre database
+        db_path: Its path
+
+    Returns:
+        Path of the snapshot
+    """
+    stem, ext = os.path.splitext(db_path)
+    path = f"{stem}.before-librarian-{datetime.now():%Y%m%d-%H%M%S}{ext}"
+    backup = sqlite3.connect(path)
+    conn.backup(backup)
+    backup.close()
+    return path
+
+
+def rekey_answers(
+    db_path: str,
+    results_path: str,
+    answers: List[Dict[str, Any]],
+    model: str = MODEL_NAME,
+) -> None:
+    """
+    Store the applied answers again under the books' new metadata.
+
+    The results store keys answers on a hash that includes the tags, so
+    without this the tags just added would make librarian.py ask about
+    every applied book again.
+
+    Args:
+        db_path: Calibre metadata database
+        results_path: librarian.py's results store
+        answers: The answers that were applied
+        model: Model the answers came from
+    """
+    by_id = {answer["id"]: answer for answer in answers}
+    store = ResultsStore(results_path, model)
+    try:
+        for book in get_books_data(db_path):
+            if book["id"] in by_id:
+                store.save(book, by_id[book["id"]])
+    finally:
+        store.close()
+
+
+def restore(snapshot_path: str, db_path: str) -> None:
+    """Replace the database with a snapshot taken before an apply."""
+    source = sqlite3.connect(snapshot_path)
+    target = sqlite3.connect(db_path)
+    source.backup(target)
+    target.close()
+    source.close()
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Apply librarian categories and notes to the Calibre database"
+    )
+    parser.add_argument("--db", default=DATABASE_PATH)
+    parser.add_argument("--results-db", default=RESULTS_DB)
+    parser.add_argument(
+        "--model",
+        default=MODEL_NAME,
+        help="Model whose answers to apply, as given to librarian.py (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--notes-column",
+        default=NOTES_COLUMN,
+        help="Lookup name of the custom column for notes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Show the changes without applying"
+    )
+    parser.add_argument(
+        "--no-snapshot", action="store_true", help="Don't snapshot the database first"
+    )
+    parser.add_argument(
+        "--restore", metavar="SNAPSHOT", help="Undo an apply from its snapshot"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main execution function."""
+    args = parse_args()
+    if args.restore:
+        restore(args.restore, args.db)
+        logger.info(f"Restored {args.db} from {args.restore}")
+        return
+
+    answers = load_answers(args.db, args.results_db, args.model)
+    logger.info(f"{len(answers)} answered books in {args.results_db}")
+
+    conn = sqlite3.connect(args.db)
+    try:
+        column = notes_table(conn, args.notes_column)
+        if column is None:
+            logger.warning(
+                f"No text column #{args.notes_column}; notes won't be written"
+            )
+        changes = plan_changes(conn, answers, column)
+        print_diff(changes)
+        if args.dry_run or not changes:
+            return
+
+        if not args.no_snapshot:
+            path = snapshot(conn, args.db)
+            logger.info(f"Snapshot saved to {path}; undo with --restore {path}")
+
+        start_time = time.monotonic()
+        apply_changes(conn, changes, column)
+        logger.info(
+            f"Applied {len(changes)} books in {time.monotonic() - start_time:.2f}s"
+        )
+    finally:
+        conn.close()
+
+    changed = {change["id"] for change in changes}
+    rekey_answers(
+        args.db,
+        args.results_db,
+        [answer for answer in answers if answer["id"] in changed],
+        args.model,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Cluster similar books before categorizing, so librarian.py only asks the
+model about one book per cluster.
+
+Each book is embedded locally as a TF-IDF vector of its tags, author and
+title words. Features shared by at least two books get a column; the rest
+only count towards the vector's length, so a book with many unusual tags is
+less similar to everything. Nearest neighbours come from blocked matrix
+products in NumPy, and books are clustered greedily: the book with the most
+neighbours above the similarity threshold becomes a representative, and
+those neighbours join its cluster. Books with no close neighbour are their
+own cluster and are always asked about.
+
+A random sample of the clustered books (the held-out sample) is asked about
+too, and its answers are compared with the representatives' to measure how
+well the propagated answers agree with the model's own.
+"""
+
+import math
+import random
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# Feature weights before IDF; tags say the most about a book's categories
+TAG_WEIGHT = 1.0
+AUTHOR_WEIGHT = 0.75
+TITLE_WEIGHT = 0.5
+MAX_FEATURES = 4096  # most common shared features get a column
+TITLE_WORD = re.compile(r"[^\W\d_]{3,}")
+TITLE_STOPWORDS = {"the", "and", "for", "with", "from", "that", "this", "book"}
+
+DEFAULT_THRESHOLD = 0.9  # cosine similarity to a representative
+DEFAULT_NEIGHBOURS = 20  # largest cluster is this plus its representative
+DEFAULT_HOLDOUT = 0.05
+BLOCK_SIZE = 1024  # rows per similarity block
+
+
+@dataclass
+class ClusterPlan:
+    """Which books to ask about, and whose answers the others take."""
+
+    representatives: List[Dict[str, Any]] = field(default_factory=list)
+    # representative ID -> [(member book, similarity)]
+    members: Dict[int, List[Tuple[Dict[str, Any], float]]] = field(default_factory=dict)
+    # Clustered books asked about anyway, to measure agreement
+    holdout: List[Tuple[Dict[str, Any], int]] = field(default_factory=list)
+
+    def to_ask(self) -> List[Dict[str, Any]]:
+        """Books that need a model answer."""
+        return self.representatives + [book for book, _ in self.holdout]
+
+    def propagated(self) -> int:
+        return sum(len(members) for members in self.members.values())
+
+
+def book_features(book: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Weighted features of a book.
+
+    Args:
+        book: Dictionary containing book metadata
+
+    Returns:
+        Feature name -> weight
+    """
+    features = {}
+    for word in TITLE_WORD.findall((book["title"] or "").lower()):
+        if word not in TITLE_STOPWORDS:
+            features[f"title:{word}"] = TITLE_WEIGHT
+    if book["author"]:
+        features[f"author:{book['author'].lower()}"] = AUTHOR_WEIGHT
+    for tag in (book["tags"] or "").split(", "):
+        if tag:
+            features[f"tag:{tag.lower()}"] = TAG_WEIGHT
+    return features
+
+
+def embed_books(books: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Embed books as unit-length TF-IDF vectors.
+
+    Args:
+        books: Book dictionaries
+
+    Returns:
+        One float32 row per book; rows of featureless books are zero
+    """
+    features = [book_features(book) for book in books]
+    counts = Counter(name for feature in features for name in feature)
+    idf = {
+        name: math.log((1 + len(books)) / (1 + count)) + 1
+        for name, count in counts.items()
+    }
+    shared = [name for name, count in counts.most_common(MAX_FEATURES) if count > 1]
+    columns = {name: column for column, name in enumerate(shared)}
+
+    vectors = np.zeros((len(books), len(columns)), dtype=np.float32)
+    norms = np.zeros(len(books), dtype=np.float32)
+    for row, feature in enumerate(features):
+        for name, weight in feature.items():
+            value = weight * idf[name]
+            norms[row] += value * value
+            if name in columns:
+                vectors[row, columns[name]] = value
+    norms = np.sqrt(norms)
+    norms[norms == 0] = 1.0
+    return vectors / norms[:, None]
+
+
+def nearest_neighbours(
+    vectors: np.ndarray, k: int = DEFAULT_NEIGHBOURS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k most similar rows to each row, by cosine similarity.
+
+    Args:
+        vectors: Unit-length rows
+        k: Neighbours per row
+
+    Returns:
+        (indices, similarities), both of shape (rows, k), most similar first
+    """
+    n = len(vectors)
+    k = min(k, n - 1)
+    indices = np.zeros((n, k), dtype=np.int64)
+    similarities = np.zeros((n, k), dtype=np.float32)
+    if k <= 0:
+        return indices, similarities
+
+    for start in range(0, n, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, n)
+        block = vectors[start:stop] @ vectors.T
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_similarities = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1)
+        indices[start:stop] = np.take_along_axis(top, order, axis=1)
+        similarities[start:stop] = np.take_along_axis(top_similarities, order, axis=1)
+    return indices, similarities
+
+
+def plan_clusters(
+    books: List[Dict[str, Any]],
+    threshold: float = DEFAULT_THRESHOLD,
+    holdout: float = DEFAULT_HOLDOUT,
+    neighbours: int = DEFAULT_NEIGHBOURS,
+    seed: int = 0,
+) -> ClusterPlan:
+    """
+    Cluster books around representatives.
+
+    Args:
+        books: Books to categorize
+        threshold: Minimum cosine similarity for a book to take a
+            representative's answer
+        holdout: Fraction of clustered books to ask about anyway
+        neighbours: Neighbours considered per book
+        seed: Seed for choosing the held-out sample
+
+    Returns:
+        The plan
+    """
+    plan = ClusterPlan()
+    if not books:
+        return plan
+    indices, similarities = nearest_neighbours(embed_books(books), neighbours)
+    close = similarities >= threshold
+
+    # Densest books first, so clusters form around their centres
+    assigned = np.zeros(len(books), dtype=bool)
+    for row in np.argsort(-close.sum(axis=1), kind="stable"):
+        if assigned[row]:
+            continue
+        assigned[row] = True
+        representative = books[row]
+        plan.representatives.append(representative)
+        members = []
+        for other, similarity in zip(
+            indices[row][close[row]], similarities[row][close[row]]
+        ):
+            if not assigned[other]:
+                assigned[other] = True
+                members.append((books[other], float(similarity)))
+        if members:
+            plan.members[representative["id"]] = members
+
+    clustered = [
+        (book, representative_id)
+        for representative_id, members in plan.members.items()
+        for book, _ in members
+    ]
+    sample_size = min(len(clustered), math.ceil(len(clustered) * holdout))
+    plan.holdout = random.Random(seed).sample(clustered, sample_size)
+    held_out = {book["id"] for book, _ in plan.holdout}
+    for representative_id, members in plan.members.items():
+        members[:] = [member for member in members if member[0]["id"] not in held_out]
+    return plan
+
+
+def agreement(pairs: List[Tuple[List[str], List[str]]]) -> Dict[str, float]:
+    """
+    How closely propagated categories match the model's own answers.
+
+    Args:
+        pairs: (model's categories, propagated categories) per held-out book
+
+    Returns:
+        {"books", "jaccard" (mean overlap of the category sets), "first"
+        (fraction with the same first category), "exact" (fraction with the
+        same set)}
+    """
+    if not pairs:
+        return {"books": 0, "jaccard": 0.0, "first": 0.0, "exact": 0.0}
+    jaccard = first = exact = 0.0
+    for asked, propagated in pairs:
+        asked_set = {category.lower() for category in asked}
+        propagated_set = {category.lower() for category in propagated}
+        union = asked_set | propagated_set
+        jaccard += len(asked_set & propagated_set) / len(union) if union else 1.0
+        first += bool(asked and propagated) and (
+            asked[0].lower() == propagated[0].lower()
+        )
+        exact += asked_set == propagated_set
+    return {
+        "books": len(pairs),
+        "jaccard": jaccard / len(pairs),
+        "first": first / len(pairs),
+        "exact": exact / len(pairs),
+    }
@@ -0,0 +1,689 @@
+"""
+Local stand-in for the Anthropic Messages API and Ollama's /api/chat, for
+exercising librarian.py and anki_chat.py through inference.py.
+
+Answers POST /v1/messages with a deterministic categorization of every
+"[ID n]" line: as a call to the request's tool when it has one, otherwise
+as text in the CATEGORIES = [...], NOTES = "..." form. Usage numbers are
+realistic, including simulated prompt caching for requests with
+cache_control breakpoints. It can enforce its own requests-per-minute limit
+(429 with retry-after) and randomly report overload (529), so rate limiting
+and backoff can be tested without spending anything.
+
+The Message Batches endpoints are served too: a batch reports in_progress
+for --batch-delay seconds after creation, then ends with every request
+answered as /v1/messages would have.
+
+POST /api/chat answers requests with a JSON-schema "format" the same way,
+as JSON, and anything else by echoing the question; GET /api/version
+reports a stub version.
+
+--make-library writes a small Calibre-shaped metadata database to run
+librarian.py and librarian_apply.py against. It has Calibre's triggers, so
+writes that only work with Calibre's SQL functions defined fail here too.
+
+Usage:
+    python librarian_stub.py --port 8766 --rpm 120 --overload-rate 0.05
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8766 ANTHROPIC_API_KEY=stub python librarian.py
+    OLLAMA_URL=http://127.0.0.1:8766 python librarian.py --backend ollama
+    python librarian_stub.py --make-library metadata_test.db --books 400
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CACHE_TTL = 300  # seconds, like the API's default ephemeral cache
+CACHE_MIN_TOKENS = 1024  # shortest cacheable prefix for Opus and Sonnet
+ID_LINE = re.compile(r"^\s*\[ID\s+([\w-]+)\]\s*(.*)$")
+
+CATEGORIES = [
+    ["Fiction", "Science fiction", "Dystopia"],
+    ["Fiction", "Literary fiction", "Family saga"],
+    ["Fiction", "Fantasy", "Epic fantasy"],
+    ["Fiction", "Mystery", "Detective"],
+    ["Non-fiction", "History", "Modern history"],
+    ["Non-fiction", "Science", "Popular science"],
+    ["Non-fiction", "Philosophy", "Ethics"],
+    ["Non-fiction", "Biography", "Memoir"],
+    ["Non-fiction", "Cooking", "Italian cuisine"],
+    ["Children's", "Picture books", "Bedtime stories"],
+]
+
+
+# The tables of Calibre's metadata.db that the librarian scripts touch, as
+# Calibre creates them, with a "Long text" (#librarian_notes) and a "Text"
+# (#librarian_text) custom column
+LIBRARY_TABLES = """
+CREATE TABLE books (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL DEFAULT 'Unknown' COLLATE NOCASE,
+    sort TEXT COLLATE NOCASE,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    pubdate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    series_index REAL NOT NULL DEFAULT 1.0,
+    author_sort TEXT COLLATE NOCASE,
+    isbn TEXT DEFAULT "" COLLATE NOCASE,
+    lccn TEXT DEFAULT "" COLLATE NOCASE,
+    path TEXT NOT NULL DEFAULT "",
+    flags INTEGER NOT NULL DEFAULT 1,
+    uuid TEXT,
+    has_cover BOOL DEFAULT 0,
+    last_modified TIMESTAMP NOT NULL DEFAULT "2000-01-01 00:00:00+00:00"
+);
+CREATE TABLE tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    link TEXT NOT NULL DEFAULT "",
+    UNIQUE (name)
+);
+CREATE TABLE books_tags_link (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    tag INTEGER NOT NULL,
+    UNIQUE(book, tag)
+);
+CREATE TABLE metadata_dirtied (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    UNIQUE(book)
+);
+CREATE TABLE custom_columns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT NOT NULL,
+    name TEXT NOT NULL,
+    datatype TEXT NOT NULL,
+    mark_for_delete BOOL DEFAULT 0 NOT NULL,
+    editable BOOL DEFAULT 1 NOT NULL,
+    display TEXT DEFAULT '{}' NOT NULL,
+    is_multiple BOOL DEFAULT 0 NOT NULL,
+    normalized BOOL NOT NULL,
+    UNIQUE(label)
+);
+INSERT INTO custom_columns (id, label, name, datatype, normalized)
+VALUES (1, 'librarian_notes', 'Librarian notes', 'comments', 0),
+       (2, 'librarian_text', 'Librarian text', 'text', 1);
+CREATE TABLE custom_column_1 (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book INTEGER,
+    value TEXT NOT NULL,
+    UNIQUE(book)
+);
+CREATE TABLE custom_column_2 (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    value TEXT NOT NULL COLLATE NOCASE,
+    link TEXT NOT NULL DEFAULT "",
+    UNIQUE(value)
+);
+CREATE TABLE books_custom_column_2_link (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    UNIQUE(book, value)
+);
+"""
+
+# Calibre's triggers on those tables; books_insert_trg and books_update_trg
+# call title_sort() and uuid4(), which Calibre defines on its own connections
+LIBRARY_TRIGGERS = """
+CREATE TRIGGER books_insert_trg AFTER INSERT ON books
+BEGIN
+    UPDATE books SET sort=title_sort(NEW.title),uuid=uuid4() WHERE id=NEW.id;
+END;
+CREATE TRIGGER books_update_trg AFTER UPDATE ON books
+BEGIN
+    UPDATE books SET sort=title_sort(NEW.title)
+    WHERE id=NEW.id AND OLD.title <> NEW.title;
+END;
+CREATE TRIGGER books_delete_trg AFTER DELETE ON books
+BEGIN
+    DELETE FROM books_tags_link WHERE book=OLD.id;
+    DELETE FROM metadata_dirtied WHERE book=OLD.id;
+    DELETE FROM custom_column_1 WHERE book=OLD.id;
+    DELETE FROM books_custom_column_2_link WHERE book=OLD.id;
+END;
+CREATE TRIGGER fkc_btl_insert BEFORE INSERT ON books_tags_link
+BEGIN
+    SELECT CASE
+        WHEN (SELECT id from books WHERE id=NEW.book) IS NULL
+        THEN RAISE(ABORT, 'Foreign key violation: book not in books')
+        WHEN (SELECT id from tags WHERE id=NEW.tag) IS NULL
+        THEN RAISE(ABORT, 'Foreign key violation: tag not in tags')
+    END;
+END;
+CREATE TRIGGER fkc_delete_on_tags BEFORE DELETE ON tags
+BEGIN
+    SELECT CASE
+        WHEN (SELECT COUNT(id) FROM books_tags_link WHERE tag=OLD.id) > 0
+        THEN RAISE(ABORT, 'Foreign key violation: tag is still referenced')
+    END;
+END;
+CREATE TRIGGER fkc_insert_custom_column_1 BEFORE INSERT ON custom_column_1
+BEGIN
+    SELECT CASE
+        WHEN (SELECT id from books WHERE id=NEW.book) IS NULL
+        THEN RAISE(ABORT, 'Foreign key violation: book not in books')
+    END;
+END;
+CREATE TRIGGER fkc_insert_books_custom_column_2_link
+BEFORE INSERT ON books_custom_column_2_link
+BEGIN
+    SELECT CASE
+        WHEN (SELECT id from books WHERE id=NEW.book) IS NULL
+        THEN RAISE(ABORT, 'Foreign key violation: book not in books')
+        WHEN (SELECT id from custom_column_2 WHERE id=NEW.value) IS NULL
+        THEN RAISE(ABORT, 'Foreign key violation: value not in custom_column_2')
+    END;
+END;
+CREATE TRIGGER fkc_delete_custom_column_2 BEFORE DELETE ON custom_column_2
+BEGIN
+    DELETE FROM books_custom_column_2_link WHERE value=OLD.id;
+END;
+"""
+LIBRARY_TAGS = [
+    "Fiction",
+    "History",
+    "Science",
+    "Fantasy",
+    "Italian",
+    "Cooking",
+    "Philosophy",
+    "Mystery",
+    "Kids",
+    "Poetry",
+]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def message_text(content) -> str:
+    """Flatten a message's text (string or list of blocks) to one string."""
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block.get("text", "")
+        for block in content
+        if isinstance(block, dict) and block.get("type", "text") == "text"
+    )
+
+
+def categorize(text: str) -> str:
+    """Stable fake answer for one user message."""
+    digest = int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16)
+    categories = CATEGORIES[digest % len(CATEGORIES)]
+    return (
+        f"CATEGORIES = {json.dumps(categories)}, "
+        f'NOTES = "A {categories[-1].lower()} book, as told by the stub."'
+    )
+
+
+def answer(text: str, drop_rate: float = 0.0, rng=None) -> str:
+    """Answer a user message; packed "[ID n] ..." lines get one line each.
+
+    With drop_rate, that fraction of packed books is left out of the answer,
+    like a model skipping lines.
+    """
+    lines = [ID_LINE.match(line) for line in text.splitlines()]
+    if not lines or not all(lines):
+        return categorize(text)
+    rng = rng or random
+    return "\n".join(
+        f"[ID {match.group(1)}] {categorize(match.group(2))}"
+        for match in lines
+        if not (drop_rate and rng.random() < drop_rate)
+    )
+
+
+def tool_answer(text: str, drop_rate: float = 0.0, rng=None) -> dict:
+    """Tool input recording every "[ID n] ..." line of a user message.
+
+    With drop_rate, that fraction of books is either left out or recorded
+    with no categories, like a model skipping or botching entries.
+    """
+    rng = rng or random
+    books = []
+    for line in text.splitlines():
+        match = ID_LINE.match(line)
+        if not match:
+            continue
+        digest = int(hashlib.sha256(match.group(2).encode("utf-8")).hexdigest(), 16)
+        categories = CATEGORIES[digest % len(CATEGORIES)]
+        entry = {
+            "id": match.group(1),
+            "categories": categories,
+            "notes": f"A {categories[-1].lower()} book, as told by the stub.",
+        }
+        if drop_rate and rng.random() < drop_rate:
+            if rng.random() < 0.5:
+                continue
+            entry["categories"] = []
+        books.append(entry)
+    return {"books": books}
+
+
+def block_text(block) -> str:
+    """A content block's text, or its JSON for tool blocks (for token counts)."""
+    if not isinstance(block, dict):
+        return str(block)
+    if "text" in block:
+        return block["text"]
+    return json.dumps(block, sort_keys=True)
+
+
+def split_cached_prefix(request):
+    """(prefix text up to the last cache_control breakpoint, remaining text)."""
+    blocks = [
+        {"text": json.dumps(tool, sort_keys=True), **tool}
+        for tool in request.get("tools", [])
+    ] + [
+        block if isinstance(block, dict) else {"text": block}
+        for block in (
+            request.get("system")
+            if isinstance(request.get("system"), list)
+            else [request.get("system", "")]
+        )
+    ]
+    for message in request["messages"]:
+        content = message["content"]
+        blocks.extend([{"text": content}] if isinstance(content, str) else content)
+
+    breakpoint = max(
+        (i for i, block in enumerate(blocks) if block.get("cache_control")),
+        default=-1,
+    )
+    texts = [block_text(block) for block in blocks]
+    return "".join(texts[: breakpoint + 1]), "".join(texts[breakpoint + 1 :])
+
+
+def make_message(request, server=None) -> dict:
+    """A Messages API response to one request.
+
+    With a server, prompt caching is simulated: the first request with a
+    given prefix writes it to the cache, later ones within CACHE_TTL read it.
+    """
+    prefix, rest = split_cached_prefix(request)
+    usage = {"cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+    prefix_tokens = estimate_tokens(prefix) if prefix else 0
+    if server is not None and prefix_tokens >= max(1, server.cache_min_tokens):
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        with server.lock:
+            hit = now - server.prompt_cache.get(key, -CACHE_TTL) < CACHE_TTL
+            server.prompt_cache[key] = now
+        usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = (
+            prefix_tokens
+        )
+        usage["input_tokens"] = estimate_tokens(rest)
+    else:
+        usage["input_tokens"] = prefix_tokens + estimate_tokens(rest)
+
+    text = message_text(request["messages"][-1]["content"])
+    drop_rate = server.drop_rate if server is not None else 0.0
+    rng = server.rng if server is not None else None
+    tools = request.get("tools") or []
+    if tools:
+        tool_input = tool_answer(text, drop_rate, rng)
+        content = [
+            {
+                "type": "tool_use",
+                "id": f"toolu_{uuid.uuid4().hex[:24]}",
+                "name": tools[0]["name"],
+                "input": tool_input,
+            }
+        ]
+        stop_reason = "tool_use"
+        output = json.dumps(tool_input)
+    else:
+        output = answer(text, drop_rate, rng)
+        content = [{"type": "text", "text": output}]
+        stop_reason = "end_turn"
+    usage["output_tokens"] = estimate_tokens(output)
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": request.get("model", "stub"),
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": usage,
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Request handler; limits and counters live on the server."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/api/chat"):
+            self.ollama_chat(request)
+            return
+        if path.endswith("/v1/messages/batches"):
+            self.create_batch(request)
+            return
+        if not path.endswith("/v1/messages"):
+            self.send_error_json(404, "not_found_error", f"No route for {self.path}")
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests_received += 1
+            now = time.monotonic()
+            while server.recent and now - server.recent[0] > 60:
+                server.recent.popleft()
+            limited = server.rpm and len(server.recent) >= server.rpm
+            if not limited:
+                server.recent.append(now)
+            retry_after = 60 - (now - server.recent[0]) if limited else 0
+            overloaded = not limited and server.rng.random() < server.overload_rate
+
+        if limited:
+            server.rejected += 1
+            self.send_error_json(
+                429,
+                "rate_limit_error",
+                "Number of requests has exceeded your per-minute rate limit",
+                {"retry-after": str(max(1, round(retry_after)))},
+            )
+            return
+        if overloaded:
+            server.rejected += 1
+            self.send_error_json(529, "overloaded_error", "Overloaded")
+            return
+
+        message = make_message(request, server)
+        if server.latency:
+            # Cached prefix tokens are cheaper to process, as on the real API
+            usage = message["usage"]
+            total = sum(usage[k] for k in ("input_tokens", "cache_read_input_tokens"))
+            uncached = 1 - usage["cache_read_input_tokens"] / max(1, total)
+            time.sleep(server.latency * (0.3 + 0.7 * uncached))
+        self.send_json(200, message)
+
+    def create_batch(self, request):
+        server = self.server
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        with server.lock:
+            server.batches[batch_id] = {
+                "created": time.monotonic(),
+                "created_at": datetime.now(timezone.utc),
+                "requests": request["requests"],
+            }
+        self.send_json(200, self.batch_object(batch_id))
+
+    def batch_object(self, batch_id: str):
+        batch = self.server.batches[batch_id]
+        ended = time.monotonic() - batch["created"] >= self.server.batch_delay
+        count = len(batch["requests"])
+        created_at = batch["created_at"]
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": created_at.isoformat(),
+            "expires_at": (created_at + timedelta(days=1)).isoformat(),
+            "ended_at": datetime.now(timezone.utc).isoformat() if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": (
+                f"{self.server.url}/v1/messages/batches/{batch_id}/results"
+                if ended
+                else None
+            ),
+        }
+
+    def ollama_chat(self, request):
+        """Ollama's /api/chat: JSON for the requested format, else plain text."""
+        server = self.server
+        with server.lock:
+            server.requests_received += 1
+        messages = request.get("messages", [])
+        text = messages[-1]["content"] if messages else ""
+        if isinstance(request.get("format"), dict):
+            reply = json.dumps(tool_answer(text, server.drop_rate, server.rng))
+        else:
+            reply = f"(stub) You asked: {text}"
+        if server.latency:
+            time.sleep(server.latency)
+        prompt = "".join(message["content"] for message in messages)
+        self.send_json(
+            200,
+            {
+                "model": request.get("model", "stub"),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "message": {"role": "assistant", "content": reply},
+                "done": True,
+                "prompt_eval_count": estimate_tokens(prompt),
+                "eval_count": estimate_tokens(reply),
+            },
+        )
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/").endswith("/api/version"):
+            self.send_json(200, {"version": "0.0.0-stub"})
+            return
+        parts = self.path.split("?")[0].strip("/").split("/")
+        # v1/messages/batches/<id>[/results]
+        if parts[:3] != ["v1", "messages", "batches"] or len(parts) not in (4, 5):
+            self.send_error_json(404, "not_found_error", f"No route for {self.path}")
+            return
+        batch_id = parts[3]
+        if batch_id not in self.server.batches:
+            self.send_error_json(404, "not_found_error", f"No batch {batch_id}")
+            return
+        if len(parts) == 4:
+            self.send_json(200, self.batch_object(batch_id))
+            return
+
+        lines = [
+            json.dumps(
+                {
+                    "custom_id": item["custom_id"],
+                    "result": {
+                        "type": "succeeded",
+                        "message": make_message(item["params"], self.server),
+                    },
+                }
+            )
+            for item in self.server.batches[batch_id]["requests"]
+        ]
+        body = ("\n".join(lines) + "\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/binary")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, kind: str, message: str, headers=None):
+        payload = {"type": "error", "error": {"type": kind, "message": message}}
+        self.send_json(status, payload, headers)
+
+    def send_json(self, status: int, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_library(path: str, books: int = 400, seed: int = 0) -> None:
+    """Write a Calibre-shaped metadata database of random books.
+
+    The books go in before the triggers, so the stub needn't define
+    Calibre's SQL functions; anything writing to the library afterwards
+    has to, as with a real one.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(LIBRARY_TABLES)
+        conn.executemany(
+            "INSERT INTO tags (id, name) VALUES (?, ?)",
+            list(enumerate(LIBRARY_TAGS, 1)),
+        )
+        conn.executemany(
+            "INSERT INTO books (id, title, sort, author_sort, uuid) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    book,
+                    f"Book {book}",
+                    f"Book {book}",
+                    f"Author {book % 60}, A",
+                    str(uuid.UUID(int=rng.getrandbits(128))),
+                )
+                for book in range(1, books + 1)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO books_tags_link (book, tag) VALUES (?, ?)",
+            [
+                (book, tag)
+                for book in range(1, books + 1)
+                for tag in rng.sample(
+                    range(1, len(LIBRARY_TAGS) + 1), rng.randint(0, 4)
+                )
+            ],
+        )
+        conn.executescript(LIBRARY_TRIGGERS)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency: float = 0.0,
+    rpm: int = 0,
+    overload_rate: float = 0.0,
+    seed: int = 0,
+    batch_delay: float = 5.0,
+    cache_min_tokens: int = CACHE_MIN_TOKENS,
+    drop_rate: float = 0.0,
+):
+    """Start the stub in a background thread and return the server.
+
+    Use port=0 to get a free port; the bound URL is server.url. rpm=0
+    disables the stub's own rate limit. Prefixes shorter than
+    cache_min_tokens aren't cached, as with the real API (pass 0 to cache
+    any prefix).
+    drop_rate is the fraction of books left out of (or botched in) answers.
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.rpm = rpm
+    server.overload_rate = overload_rate
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.recent = deque()
+    server.requests_received = 0
+    server.rejected = 0
+    server.batches = {}
+    server.batch_delay = batch_delay
+    server.prompt_cache = {}
+    server.cache_min_tokens = cache_min_tokens
+    server.drop_rate = drop_rate
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Anthropic Messages API stub")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="Seconds of delay per request"
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=0, help="Requests per minute before 429s (0: none)"
+    )
+    parser.add_argument(
+        "--overload-rate", type=float, default=0.0, help="Fraction of 529 responses"
+    )
+    parser.add_argument(
+        "--batch-delay",
+        type=float,
+        default=5.0,
+        help="Seconds a message batch stays in progress",
+    )
+    parser.add_argument(
+        "--cache-min-tokens",
+        type=int,
+        default=CACHE_MIN_TOKENS,
+        help="Shortest prefix that prompt caching applies to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--drop-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of books left out of or botched in answers",
+    )
+    parser.add_argument(
+        "--make-library",
+        metavar="PATH",
+        help="Write a Calibre-shaped test library to PATH and exit",
+    )
+    parser.add_argument(
+        "--books",
+        type=int,
+        default=400,
+        help="Books in the test library (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    if args.make_library:
+        make_library(args.make_library, args.books)
+        print(f"Wrote a test library of {args.books} books to {args.make_library}")
+        return
+
+    server = serve(
+        port=args.port,
+        latency=args.latency,
+        rpm=args.rpm,
+        overload_rate=args.overload_rate,
+        batch_delay=args.batch_delay,
+        cache_min_tokens=args.cache_min_tokens,
+        drop_rate=args.drop_rate,
+    )
+    print(f"Serving a fake Messages API and Ollama at {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()